@@ -0,0 +1,91 @@
+from django.db import transaction
+
+from tasks.models import Satellite, TLEData
+from tasks.propagation import iter_tle, TLEError
+
+
+class TLECatalogImport:
+    """
+    Upserts a TLE catalog (e.g. a CelesTrak or Space-Track dump) batch by batch.
+    Every object keeps one catalog element set (TLEData without a task) of the newest epoch;
+    element sets attached to tasks are never touched. Broken entries are skipped and reported
+    in errors, keyed by the index of the entry in the catalog.
+    """
+    batch_size = 5000
+
+    def __init__(self, batch_size=None):
+        if batch_size:
+            self.batch_size = batch_size
+        self.errors = {}
+        self.satellites_created = 0
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    @property
+    def stats(self):
+        return {
+            'satellites_created': self.satellites_created,
+            'created': self.created,
+            'updated': self.updated,
+            'skipped': self.skipped,
+            'errors': len(self.errors),
+        }
+
+    def run(self, lines):
+        batch = {}
+        for index, element in iter_tle(lines):
+            if isinstance(element, TLEError):
+                self.errors[index] = str(element)
+                continue
+            previous = batch.get(element.number, None)
+            if previous is not None:
+                self.skipped += 1
+                if previous.epoch >= element.epoch:
+                    continue
+            batch[element.number] = element
+            if len(batch) >= self.batch_size:
+                self._save(batch)
+                batch = {}
+        if batch:
+            self._save(batch)
+        return self.stats
+
+    @transaction.atomic
+    def _save(self, batch):
+        numbers = list(batch)
+        satellites = {satellite.number: satellite for satellite in Satellite.objects.filter(number__in=numbers)}
+        new_satellites = [Satellite(number=number, name=batch[number].header or '') for number in numbers if number not in satellites]
+        Satellite.objects.bulk_create(new_satellites, batch_size=self.batch_size, ignore_conflicts=True)
+        # ignore_conflicts skips the objects a concurrent import has created meanwhile, so count the stored ones
+        if new_satellites:
+            self.satellites_created += Satellite.objects.filter(number__in=numbers).count() - len(satellites)
+        renamed = []
+        for number, satellite in satellites.items():
+            if not satellite.name and batch[number].header:
+                satellite.name = batch[number].header
+                renamed.append(satellite)
+        Satellite.objects.bulk_update(renamed, ['name'], batch_size=self.batch_size)
+
+        stored = TLEData.objects.filter(task__isnull=True, satellite_id__in=numbers).values_list('id', 'satellite_id', 'epoch')
+        # outdated rows are replaced rather than updated: one DELETE and one INSERT per batch
+        # are much cheaper than the per-row CASE expressions of bulk_update
+        outdated = []
+        replaced = set()
+        current = set()
+        for tle_id, number, epoch in stored:
+            if epoch is None or epoch < batch[number].epoch:
+                outdated.append(tle_id)
+                replaced.add(number)
+            else:
+                current.add(number)
+        replaced -= current
+        TLEData.objects.filter(id__in=outdated).delete()
+        TLEData.objects.bulk_create([
+            TLEData(satellite_id=number, header=batch[number].header and batch[number].header[:25],
+                    line1=batch[number].line1, line2=batch[number].line2, epoch=batch[number].epoch)
+            for number in numbers if number not in current
+        ], batch_size=self.batch_size)
+        self.skipped += len(current)
+        self.updated += len(replaced)
+        self.created += len(numbers) - len(current) - len(replaced)
@@ -0,0 +1,133 @@
+import zlib
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+DEFAULT_LEVELS = {'zstd': 3, 'br': 4, 'gzip': 6}
+DEFAULT_MIN_SIZE = 1024
+
+
+def available_codings():
+    """Content codings the server can produce, the preferred first."""
+    codings = []
+    if zstandard is not None:
+        codings.append('zstd')
+    if brotli is not None:
+        codings.append('br')
+    codings.append('gzip')
+    return codings
+
+
+def negotiate(accept_encoding):
+    """
+    The coding to answer an Accept-Encoding header with, or None for no compression: the one of the highest
+    q-value among the available codings, ties going to the server preference.
+    """
+    weights = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+    best = None
+    best_weight = 0.0
+    for coding in available_codings():
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def level(coding):
+    return getattr(settings, 'API_COMPRESSION_LEVELS', {}).get(coding, DEFAULT_LEVELS[coding])
+
+
+def min_size():
+    return getattr(settings, 'API_COMPRESSION_MIN_SIZE', DEFAULT_MIN_SIZE)
+
+
+def compress(data, coding):
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=level(coding)).compress(data)
+    if coding == 'br':
+        return brotli.compress(data, quality=level(coding))
+    compressor = zlib.compressobj(level(coding), zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, coding):
+    if coding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=level(coding)).compressobj()
+        step, finish = compressor.compress, compressor.flush
+    elif coding == 'br':
+        compressor = brotli.Compressor(quality=level(coding))
+        step, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(level(coding), zlib.DEFLATED, 31)
+        step, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        data = step(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def compress_response(request, response):
+    """
+    Compresses the successful response with the coding negotiated by the Accept-Encoding of the request.
+    Streamed responses are compressed chunk by chunk; others are skipped when smaller than
+    API_COMPRESSION_MIN_SIZE or when compression does not make them smaller.
+    """
+    if response.has_header('Content-Encoding') or not 200 <= response.status_code < 300 or response.status_code == 204:
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if coding is None:
+        return response
+    if response.streaming:
+        response.streaming_content = compress_stream(response.streaming_content, coding)
+        if response.has_header('Content-Length'):
+            del response['Content-Length']
+    else:
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        if len(response.content) < min_size():
+            return response
+        compressed = compress(response.content, coding)
+        if not len(compressed) < len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+    etag = response.get('ETag', None)
+    if etag and not etag.startswith('W/'):
+        # the compressed bytes differ from the identity ones, as the GZipMiddleware of Django also reckons
+        response['ETag'] = 'W/' + etag
+    response['Content-Encoding'] = coding
+    return response
+
+
+class CompressionMixin:
+    """Negotiates the compression of the responses of a view (see compress_response)."""
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        return compress_response(request, response)
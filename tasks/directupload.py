@@ -0,0 +1,103 @@
+import os
+import secrets
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+
+
+TOKEN_SALT = 'tasks.directupload'
+
+_backend = None
+
+
+def url_max_age():
+    return getattr(settings, 'RESULT_UPLOAD_URL_MAX_AGE', 15 * 60)
+
+
+def token_max_age():
+    return getattr(settings, 'RESULT_UPLOAD_TOKEN_MAX_AGE', 24 * 60 * 60)
+
+
+def image_key(task_id, frame_id, name):
+    """The storage name of an uploaded image: under the upload_to of TaskResult.image, not guessable."""
+    name = get_valid_filename(os.path.basename(name)) or 'image'
+    return f'results/{task_id}/{frame_id}-{secrets.token_hex(8)}-{name}'[:100]
+
+
+def make_token(task_id, frame_id, point_id, key):
+    return signing.dumps({'task': task_id, 'frame': frame_id, 'point': point_id, 'key': key}, salt=TOKEN_SALT)
+
+
+def load_token(token, max_age):
+    """The entry signed into the token, None if the token is forged or older than max_age seconds."""
+    try:
+        return signing.loads(token, salt=TOKEN_SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+
+
+class LocalUploadBackend:
+    """
+    Stand-in for development and tests: the telescope PUTs the image to the upload_target endpoint of the app
+    itself, which writes it to the default storage. Production uses an S3-compatible storage instead.
+    """
+
+    def upload_url(self, request, key, token):
+        return request.build_absolute_uri(reverse('upload_target', args=[token]))
+
+    def size(self, key):
+        """The size of the uploaded image, None if it is not uploaded."""
+        return default_storage.size(key) if default_storage.exists(key) else None
+
+
+class S3UploadBackend:
+    """
+    Presigned PUT URLs of an S3-compatible storage (AWS S3, MinIO...), from RESULT_UPLOAD_S3: bucket, and
+    optionally endpoint_url, region_name, access_key and secret_key. The storage of TaskResult.image must be
+    the same bucket, so the uploaded keys are the names of the images.
+    """
+
+    def __init__(self, options):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise ImproperlyConfigured('RESULT_UPLOAD_BACKEND = "s3" requires boto3')
+        self.bucket = options['bucket']
+        self.client = boto3.client(
+            's3',
+            endpoint_url=options.get('endpoint_url', None),
+            region_name=options.get('region_name', None),
+            aws_access_key_id=options.get('access_key', None),
+            aws_secret_access_key=options.get('secret_key', None),
+        )
+        self.errors = (ClientError,)
+
+    def upload_url(self, request, key, token):
+        return self.client.generate_presigned_url(
+            'put_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=url_max_age()
+        )
+
+    def size(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+        except self.errors:
+            return None
+
+
+def get_backend():
+    """The backend of RESULT_UPLOAD_BACKEND: "local" (default) or "s3"."""
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'RESULT_UPLOAD_BACKEND', 'local')
+        if name == 's3':
+            _backend = S3UploadBackend(getattr(settings, 'RESULT_UPLOAD_S3', {}))
+        elif name == 'local':
+            _backend = LocalUploadBackend()
+        else:
+            raise ImproperlyConfigured(f'RESULT_UPLOAD_BACKEND "{name}" is not "local" or "s3"')
+    return _backend
@@ -0,0 +1,119 @@
+import asyncio
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+
+from tasks.models import Telescope, TelescopePlan
+from tasks.pubsub import get_broker, telescope_channel
+from tasks.views import TelescopeTasks
+
+
+EVENTS_PATH = '/api/tasks/tasks_events/'
+
+
+@sync_to_async
+def _authenticate(scope):
+    """
+    (telescope id, None, None) for the telescope of the user authenticated as TelescopeTasks authenticates
+    (JWT, token or session), else (None, status, error message).
+    """
+    close_old_connections()
+    try:
+        request = ASGIRequest(scope, io.BytesIO())
+        # session authentication takes the user the middlewares read from the session
+        SessionMiddleware(lambda request: None).process_request(request)
+        AuthenticationMiddleware(lambda request: None).process_request(request)
+        request = Request(request, authenticators=[authentication() for authentication in TelescopeTasks.authentication_classes])
+        try:
+            user = request.user
+        except APIException as error:
+            detail = error.detail
+            if isinstance(detail, dict):
+                detail = detail.get('detail', '')
+            return None, 401, str(detail)
+        if not user.is_authenticated:
+            return None, 401, 'Authentication credentials were not provided.'
+        telescope_id = Telescope.objects.filter(user=user).values_list('id', flat=True).first()
+        if telescope_id is None:
+            return None, 404, 'Not found.'
+        return telescope_id, None, None
+    finally:
+        close_old_connections()
+
+
+@sync_to_async
+def _versions(telescope_id):
+    try:
+        return list(TelescopePlan.objects.filter(telescope_id=telescope_id).order_by('-jdn').values('jdn', 'version')[:2])
+    finally:
+        close_old_connections()
+
+
+async def _send_error(send, status, message):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+def _event(name, data):
+    return f'event: {name}\ndata: {data}\n\n'.encode()
+
+
+async def plan_events(scope, receive, send):
+    """
+    Server-sent events of the plan changes of the telescope of the authenticated user. The stream starts
+    with a versions event (current versions of the latest plans), then sends a plan event with the delta
+    of every committed change (see plans.plan_delta) and a comment line every PLAN_PUSH_KEEPALIVE seconds.
+    """
+    telescope_id, status, error = await _authenticate(scope)
+    if telescope_id is None:
+        await _send_error(send, status, error)
+        return
+    broker = get_broker()
+    if broker is None:
+        await _send_error(send, 503, 'plan push is not configured, PLAN_PUSH_BROKER_URL is not set')
+        return
+    keepalive = getattr(settings, 'PLAN_PUSH_KEEPALIVE', 15.0)
+    subscription = broker.subscribe(telescope_channel(telescope_id))
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': _event('versions', json.dumps(await _versions(telescope_id))), 'more_body': True})
+        while not disconnected.done():
+            message = asyncio.ensure_future(subscription.get(keepalive))
+            await asyncio.wait((message, disconnected), return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                message.cancel()
+                break
+            data = message.result()
+            body = _event('plan', data) if data is not None else b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        subscription.close()
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
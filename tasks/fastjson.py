@@ -0,0 +1,48 @@
+import datetime
+
+from rest_framework.utils import json
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson is not None:
+    # datetimes and NumPy arrays are encoded by orjson itself; the rest of what DRF encodes (decimals, lazy
+    # strings, querysets...) goes through its encoder
+    # UTC as "Z" like the DRF encoder and plans.format_dt, naive datetimes (UTC with USE_TZ) as UTC
+    OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    OPTIONS = 0
+    JSONDecodeError = json.JSONDecodeError
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """The DRF encoder rendering naive datetimes as UTC, as orjson does with OPT_NAIVE_UTC."""
+
+    def default(self, obj):
+        if isinstance(obj, datetime.datetime) and obj.tzinfo is None:
+            obj = obj.replace(tzinfo=datetime.timezone.utc)
+        return super().default(obj)
+
+
+_encoder = JSONEncoder()
+
+
+def dumps(obj, indent=False):
+    """UTF-8 JSON of obj: by orjson when it is installed, else by the stdlib json with the DRF encoder."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_encoder.default, option=OPTIONS | (orjson.OPT_INDENT_2 if indent else 0))
+    return json.dumps(obj, cls=JSONEncoder, ensure_ascii=False, indent=2 if indent else None,
+                      separators=None if indent else (',', ':')).encode()
+
+
+def loads(data):
+    """Decodes JSON bytes or text; raises JSONDecodeError (a ValueError) when they are not JSON."""
+    if orjson is not None:
+        # orjson takes exact str only, while form fields come as str subclasses (e.g. the JSONString of DRF)
+        return orjson.loads(str(data) if isinstance(data, str) else data)
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
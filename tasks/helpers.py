@@ -1,19 +1,30 @@
 from _datetime import datetime, timedelta
-import julian
+from tasks import jdtime
 from tasks.models import Task
 
 
-def telescope_collision_task_message(telescope_id, start_dt, end_dt):
-    actual_tasks_ids = Task.objects.filter(
-        telescope_id=telescope_id, task_type=Task.POINTS_MODE, status__in=[Task.CREATED, Task.RECEIVED]
+def telescope_collision_task(telescope_id, start_dt, end_dt, exclude_task_id=None):
+    """
+    The earliest active task of the telescope whose time slot overlaps [start_dt, end_dt], or None.
+    Two slots overlap when each starts before the other ends, which also covers containment.
+    One range query served by the partial (telescope, start_dt, end_dt) index of active tasks.
+    """
+    tasks = Task.objects.filter(
+        telescope_id=telescope_id, status__in=[Task.CREATED, Task.RECEIVED], start_dt__lt=end_dt, end_dt__gt=start_dt
     )
-    for task in actual_tasks_ids:
-        if start_dt > task.start_dt and start_dt < task.end_dt or end_dt > task.start_dt and end_dt < task.end_dt:
-            local_start_dt = task.start_dt + timedelta(hours=3)
-            local_end_dt = task.end_dt + timedelta(hours=3)
-            return f'Задание не может быть сохранено, так как есть другое задание в ' \
-                f'{local_start_dt.strftime("%H:%M:%S")}, продлящееся до {local_end_dt.strftime("%H:%M:%S")}'
-    return ''
+    if exclude_task_id is not None:
+        tasks = tasks.exclude(id=exclude_task_id)
+    return tasks.order_by('start_dt').only('id', 'start_dt', 'end_dt').first()
+
+
+def telescope_collision_task_message(telescope_id, start_dt, end_dt, exclude_task_id=None):
+    task = telescope_collision_task(telescope_id, start_dt, end_dt, exclude_task_id)
+    if task is None:
+        return ''
+    local_start_dt = task.start_dt + timedelta(hours=3)
+    local_end_dt = task.end_dt + timedelta(hours=3)
+    return f'Задание не может быть сохранено, так как есть другое задание в ' \
+        f'{local_start_dt.strftime("%H:%M:%S")}, продлящееся до {local_end_dt.strftime("%H:%M:%S")}'
 
 
 def converting_degrees(value):
@@ -25,12 +36,14 @@ def converting_degrees(value):
 
 
 def get_points_json(points):
+    points = list(points)
+    jds = jdtime.to_jd(jdtime.from_datetimes([point.dt for point in points])).tolist()
     data = []
-    for point in points:
+    for point, jd in zip(points, jds):
         data.append({
             'id': point.satellite_id,
             'mag': point.mag,
-            'jd': julian.to_jd(point.dt, fmt='jd'),
+            'jd': jd,
             'alpha': point.alpha,
             'beta': point.beta,
             'exp': point.exposure,
@@ -40,10 +53,12 @@ def get_points_json(points):
 
 
 def get_track_json(track_list):
+    track_list = list(track_list)
+    jds = jdtime.to_jd(jdtime.from_datetimes([track.dt for track in track_list])).tolist()
     data = []
-    for track in track_list:
+    for track, jd in zip(track_list, jds):
         data.append({
-            'jd': julian.to_jd(track.dt, fmt='jd'),
+            'jd': jd,
             'alpha': track.alpha,
             'beta': track.beta,
         })
@@ -51,10 +66,12 @@ def get_track_json(track_list):
 
 
 def get_frames_json(frames):
+    frames = list(frames)
+    jds = jdtime.to_jd(jdtime.from_datetimes([frame.dt for frame in frames])).tolist()
     data = []
-    for frame in frames:
+    for frame, jd in zip(frames, jds):
         data.append({
-            'jd': julian.to_jd(frame.dt, fmt='jd'),
+            'jd': jd,
             'exp': frame.exposure,
         })
     return data
@@ -0,0 +1,293 @@
+from datetime import datetime
+
+import numpy as np
+import pytz
+from django.db import transaction
+
+from tasks import jdtime, validators
+from tasks.helpers import telescope_collision_task_message
+from tasks.jdtime import DT_FORMAT
+from tasks.models import Telescope, Task, Point, Frame, AbstractTimeMoment
+
+
+POINT_FIELDS = (('alpha', 'float'), ('beta', 'float'), ('cs_type', 'int'))
+FRAME_FIELDS = (('mag', 'float'), ('exposure', 'float'))
+
+
+class SlotCollisionError(ValueError):
+    pass
+
+
+class PlanColumns:
+    """
+    Accumulates the points or frames of a plan as NumPy columns, converting incoming dicts
+    chunk by chunk, so the rows are never held as Python objects all at once.
+    Fields given as constants (e.g. cs_type of a tracking task) are not read from the items.
+    """
+    chunk_size = 10000
+
+    def __init__(self, key, fields, constants=None):
+        self.key = key
+        self.name = key[:-1]
+        self.field_names = tuple(field for field, kind in fields)
+        self.constants = dict(constants or {})
+        self.fields = fields
+        self.errors = {}
+        self._size = 0
+        self._pending = []
+        self._chunks = []
+        self._columns = None
+
+    def append(self, item):
+        self._pending.append(item)
+        if len(self._pending) >= self.chunk_size:
+            self._flush()
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    @property
+    def size(self):
+        return self._size + len(self._pending)
+
+    def set_constant(self, field, value):
+        self.constants[field] = value
+
+    @classmethod
+    def from_arrays(cls, key, fields, arrays, constants=None):
+        """Wraps already decoded arrays (e.g. of a binary plan) without copying them."""
+        instance = cls(key, fields, constants)
+        instance._size = len(arrays['dt'])
+        instance._columns = instance._complete({name: arrays[name] for name in arrays})
+        return instance
+
+    @property
+    def columns(self):
+        if self._columns is None:
+            self._flush()
+            columns = {}
+            for name in ('dt',) + self.field_names:
+                if name not in self.constants:
+                    columns[name] = np.concatenate([chunk[name] for chunk in self._chunks])
+            self._chunks = []
+            self._columns = self._complete(columns)
+        return self._columns
+
+    def to_record(self):
+        """
+        The columns as JSON lists (dt as DT_FORMAT strings) and the constants, e.g. to keep a plan submitted
+        as columns in InputData one list per column rather than one dict per row; see from_record.
+        """
+        columns = self.columns
+        record = {'dt': jdtime.format_dt_array(columns['dt']).tolist()}
+        for field, kind in self.fields:
+            if field not in self.constants:
+                record[field] = (columns[field].astype(np.int64) if kind == 'int' else columns[field]).tolist()
+        if self.constants:
+            record['constants'] = dict(self.constants)
+        return record
+
+    @classmethod
+    def from_record(cls, key, fields, record):
+        constants = record.get('constants', {})
+        arrays = {'dt': jdtime.parse_dt_array(record['dt'])}
+        for field, kind in fields:
+            if field not in constants:
+                arrays[field] = np.asarray(record[field], dtype=np.float64)
+        return cls.from_arrays(key, fields, arrays, constants)
+
+    def _complete(self, columns):
+        for name in self.field_names:
+            if name in self.constants:
+                columns[name] = np.full(self.size, self.constants[name], dtype=np.float64)
+        columns['jdn'], columns['jd'] = jdtime.dt_to_jdn_jdf(columns['dt'])
+        return columns
+
+    def _flush(self):
+        items = self._pending
+        self._pending = []
+        if items or not self._chunks:
+            self._chunks.append(self._convert(items, self._size))
+            self._size += len(items)
+
+    def _convert(self, items, offset):
+        errors = {}
+        dicts = []
+        for index, item in enumerate(items):
+            if isinstance(item, dict):
+                dicts.append(item)
+            else:
+                errors[index] = {self.name: f'{self.name} is not dict'}
+                dicts.append({})
+        raw_dts = [item.get('dt', None) for item in dicts]
+        chunk = {'dt': jdtime.parse_dt_array(raw_dts)}
+        for index in np.flatnonzero(np.isnat(chunk['dt'])).tolist():
+            if index in errors:
+                continue
+            if raw_dts[index] is None:
+                errors[index] = {'dt': 'dt is None'}
+            else:
+                errors[index] = {'dt': f'dt does not match format {DT_FORMAT}'}
+        for field, kind in self.fields:
+            if field not in self.constants:
+                chunk[field] = validators.collect_column(dicts, field, errors, kind=kind)
+        for index, error in errors.items():
+            self.errors.setdefault(offset + index, error)
+        return chunk
+
+
+class PlanIngestion:
+    """
+    Validates a whole plan ({'points': [...], 'frames': [...]}) before anything is written
+    and then stores its points and frames with batched inserts.
+    Errors are keyed by the index of the failed element: {'points': {3: {'alpha': '...'}}}.
+    """
+    batch_size = 10000
+
+    def __init__(self, plan=None, points=None, frames=None):
+        self.plan = plan
+        self.points = points
+        self.frames = frames
+        self.start_dt = None
+        self.end_dt = None
+        self._errors = None
+
+    @classmethod
+    def from_columns(cls, points, frames):
+        return cls(points=points, frames=frames)
+
+    @classmethod
+    def from_input_data(cls, data):
+        """The ingestion of a plan kept in InputData.data_json: a JSON plan or the columns kept by to_record."""
+        if isinstance(data, dict) and isinstance(data.get('columns', None), dict):
+            columns = data['columns']
+            return cls.from_columns(PlanColumns.from_record('points', POINT_FIELDS, columns['points']),
+                                    PlanColumns.from_record('frames', FRAME_FIELDS, columns['frames']))
+        return cls(data)
+
+    def to_record(self, summary):
+        """summary (e.g. the metadata of a binary plan) with the columns of the plan, see PlanColumns.to_record."""
+        return dict(summary, columns={'points': self.points.to_record(), 'frames': self.frames.to_record()})
+
+    @property
+    def errors(self):
+        if self._errors is None:
+            raise AssertionError('You must call `.is_valid()` before accessing `.errors`.')
+        return self._errors
+
+    @property
+    def size(self):
+        return self.points.size + self.frames.size
+
+    def is_valid(self):
+        self._errors = {}
+        if self.plan is not None:
+            if not isinstance(self.plan, dict):
+                self._errors['plan'] = 'plan is not dict'
+                return False
+            self.points = self._collect('points', POINT_FIELDS)
+            self.frames = self._collect('frames', FRAME_FIELDS)
+            if self._errors:
+                return False
+        now = datetime.now(tz=pytz.UTC)
+        self._validate(self.points, validators.validate_points, now)
+        self._validate(self.frames, validators.validate_frames, now)
+        if self._errors:
+            return False
+        self.points.columns['cs_type'] = self.points.columns['cs_type'].astype(np.int64)
+        dts = np.concatenate((self.points.columns['dt'], self.frames.columns['dt']))
+        self.start_dt, self.end_dt = jdtime.to_datetimes(np.array([dts.min(), dts.max()]))
+        return True
+
+    def check_slot(self, task):
+        """
+        Raises SlotCollisionError if the plan overlaps an active task of the same telescope.
+        Must run in a transaction: the telescope row stays locked until commit, so concurrent
+        plans for one telescope are checked and saved one after another.
+        """
+        Telescope.objects.select_for_update().filter(id=task.telescope_id).first()
+        message = telescope_collision_task_message(task.telescope_id, self.start_dt, self.end_dt, exclude_task_id=task.id)
+        if message:
+            raise SlotCollisionError(message)
+
+    def save(self, task):
+        self._check_saveable()
+        self.check_slot(task)
+        self._bulk_create(Point, self.points.columns, task)
+        self._bulk_create(Frame, self.frames.columns, task)
+        return self._complete_task(task)
+
+    def save_in_batches(self, task, progress):
+        """
+        Stores the plan of a draft task committing every batch on its own and calling progress with the count
+        of points and frames stored so far, so other connections see the progress of a long ingestion.
+        Must run outside a transaction. The task stays a draft, out of the plans, until the last transaction
+        checks the slot again and completes it; the stored points and frames are removed if anything fails.
+        """
+        self._check_saveable()
+        with transaction.atomic():
+            self.check_slot(task)
+        try:
+            stored = self._bulk_create(Point, self.points.columns, task, progress)
+            self._bulk_create(Frame, self.frames.columns, task, progress, stored)
+            with transaction.atomic():
+                self.check_slot(task)
+                self._complete_task(task)
+        except Exception:
+            Point.objects.filter(task=task).delete()
+            Frame.objects.filter(task=task).delete()
+            raise
+        return task
+
+    def _check_saveable(self):
+        if self._errors is None or self._errors:
+            raise AssertionError('You must call `.is_valid()` and get no errors before calling `.save()`.')
+
+    def _complete_task(self, task):
+        jdn1, jdf1 = AbstractTimeMoment.dt_to_jdn_jdf(self.start_dt)
+        jdn2, jdf2 = AbstractTimeMoment.dt_to_jdn_jdf(self.end_dt)
+        task.start_dt = self.start_dt
+        task.start_jd = jdf1 + jdn1
+        task.jdn = jdn1
+        task.end_dt = self.end_dt
+        task.end_jd = jdf2 + jdn2
+        task.status = Task.CREATED
+        task.save()
+        return task
+
+    def _collect(self, key, fields):
+        items = self.plan.get(key, None)
+        if items is None:
+            self._errors[key] = f'{key} is None'
+            return None
+        if not isinstance(items, list):
+            self._errors[key] = f'{key} is not list'
+            return None
+        columns = PlanColumns(key, fields)
+        columns.extend(items)
+        return columns
+
+    def _validate(self, columns, validate, now):
+        if not columns.size > 0:
+            self._errors[columns.key] = f'{columns.key} is Empty'
+            return
+        data = columns.columns
+        rule_errors = validate(*(data[name] for name in columns.field_names), data['dt'], data['jd'], now)
+        errors = validators.keep_type_errors(dict(columns.errors), rule_errors)
+        if errors:
+            self._errors[columns.key] = {index: errors[index] for index in sorted(errors)}
+
+    def _bulk_create(self, model, columns, task, progress=None, stored=0):
+        names = [name for name in columns if name != 'dt']
+        for start in range(0, len(columns['dt']), self.batch_size):
+            stop = start + self.batch_size
+            rows = zip(
+                jdtime.to_datetimes(columns['dt'][start:stop]),
+                *(columns[name][start:stop].tolist() for name in names)
+            )
+            objects = model.objects.bulk_create([model(task=task, dt=dt, **dict(zip(names, values))) for dt, *values in rows])
+            stored += len(objects)
+            if progress is not None:
+                progress(stored)
+        return stored
@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+
+DT_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+UNIX_EPOCH_JDN = 2440588
+US_PER_DAY = 86400000000
+US_PER_HALF_DAY = US_PER_DAY // 2
+NAT = np.datetime64('NaT', 'us')
+
+
+def parse_dt_array(values):
+    """
+    Parses a sequence of DT_FORMAT strings (or datetime objects) into a datetime64[us] array.
+    Elements which cannot be parsed become NaT.
+    """
+    size = len(values)
+    result = np.full(size, NAT)
+    if size == 0:
+        return result
+    strings = np.array([value if isinstance(value, str) else '' for value in values], dtype='U')
+    is_str = np.char.str_len(strings) > 0
+    well_formed = (
+        is_str
+        & np.char.endswith(strings, 'Z')
+        & (np.char.find(strings, 'T') == 10)
+        & (np.char.find(strings, '.') == 19)
+    )
+    stripped = np.char.rstrip(strings[well_formed], 'Z')
+    try:
+        result[well_formed] = stripped.astype('datetime64[us]')
+    except ValueError:
+        indexes = np.flatnonzero(well_formed)
+        for index, string in zip(indexes, stripped):
+            try:
+                result[index] = np.datetime64(str(string), 'us')
+            except ValueError:
+                pass
+    for index in np.flatnonzero(~is_str):
+        value = values[index]
+        if isinstance(value, datetime):
+            result[index] = from_datetimes([value])[0]
+    return result
+
+
+def format_dt_array(dt64):
+    """Formats a datetime64 array as DT_FORMAT strings."""
+    return np.char.add(np.datetime_as_string(dt64.astype('datetime64[us]'), unit='us'), 'Z')
+
+
+def from_datetimes(dts):
+    """Converts datetime objects to a datetime64[us] array using their wall clock fields, as julian.to_jd does."""
+    return np.array([dt.replace(tzinfo=None) for dt in dts], dtype='datetime64[us]')
+
+
+def to_datetimes(dt64, tz=pytz.UTC):
+    return [dt.replace(tzinfo=tz) if dt is not None else None for dt in dt64.astype('datetime64[us]').astype(object)]
+
+
+def dt_to_jdn_jdf(dt64):
+    """
+    Vectorized AbstractTimeMoment.dt_to_jdn_jdf: returns the julian day number (changing at noon)
+    and the day fraction counted from noon of the calendar date, for a datetime64 array.
+    """
+    us = dt64.astype('datetime64[us]').astype(np.int64)
+    days, us_of_day = np.divmod(us, US_PER_DAY)
+    jdn = days + UNIX_EPOCH_JDN - (us_of_day < US_PER_HALF_DAY)
+    jdf = (us_of_day - US_PER_HALF_DAY) / US_PER_DAY
+    return jdn, jdf
+
+
+def to_jd(dt64):
+    """Vectorized julian.to_jd(dt, fmt='jd') for a datetime64 array, summed in the same order to keep its rounding."""
+    us = dt64.astype('datetime64[us]').astype(np.int64)
+    days, us_of_day = np.divmod(us, US_PER_DAY)
+    seconds, microsecond = np.divmod(us_of_day, 1000000)
+    minutes, second = np.divmod(seconds, 60)
+    hour, minute = np.divmod(minutes, 60)
+    return (days + UNIX_EPOCH_JDN) + (hour - 12) / 24 + minute / 1440 + second / 86400 + microsecond / 86400000000
+
+
+def to_jd_fr(dt64):
+    """Splits datetime64 values into the julian date of the preceding midnight and the day fraction, as sgp4 expects."""
+    us = dt64.astype('datetime64[us]').astype(np.int64)
+    days, us_of_day = np.divmod(us, US_PER_DAY)
+    return (days + UNIX_EPOCH_JDN) - 0.5, us_of_day / US_PER_DAY
@@ -0,0 +1,107 @@
+import codecs
+import json
+
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONObjectStream:
+    """
+    Incremental reader of a top-level JSON object from a file-like stream.
+    Members listed in stream_keys must be arrays and are yielded element by element
+    as ('item', key, element); all other members are yielded whole as ('value', key, value).
+    Only the element being decoded and one read chunk are held in memory.
+    """
+    chunk_size = 64 * 1024
+    whitespace = ' \t\n\r'
+    delimiters = whitespace + ',:]}'
+
+    def __init__(self, stream, stream_keys=(), encoding='utf-8'):
+        self.stream = stream
+        self.stream_keys = set(stream_keys)
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder(encoding)()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._decode()
+            if not isinstance(key, str):
+                raise JSONStreamError('object key is not string')
+            self._expect(':')
+            if key in self.stream_keys:
+                yield from self._iter_array(key)
+            else:
+                yield 'value', key, self._decode()
+            if self._next_delimiter('}'):
+                break
+        if self._peek() != '':
+            raise JSONStreamError('extra data after the top-level object')
+
+    def _iter_array(self, key):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield 'item', key, self._decode()
+            if self._next_delimiter(']'):
+                return
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            self.text_decoder.decode(b'', final=True)
+            return False
+        self.buffer = self.buffer[self.pos:] + (self.text_decoder.decode(chunk) if isinstance(chunk, bytes) else chunk)
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise JSONStreamError(f'expected "{char}" at offset {self.pos}')
+        self.pos += 1
+
+    def _next_delimiter(self, closing):
+        char = self._peek()
+        self.pos += 1
+        if char == ',':
+            return False
+        if char == closing:
+            return True
+        raise JSONStreamError(f'expected "," or "{closing}"')
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError as e:
+                if self._fill():
+                    continue
+                raise JSONStreamError(str(e))
+            # a number split by a chunk boundary ("1." + "25") decodes as a shorter number,
+            # so a value is accepted only when followed by a delimiter or the end of the stream
+            if (end >= len(self.buffer) or self.buffer[end] not in self.delimiters) and self._fill():
+                continue
+            self.pos = end
+            return value
@@ -0,0 +1,70 @@
+import io
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from django.core.management.base import BaseCommand
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from tasks import fastjson
+from tasks.parsers import FastJSONParser
+from tasks.renderers import FastJSONRenderer
+
+
+def sample_plan(size):
+    """A plan of size points and frames as the API sends it, with datetime moments."""
+    start = datetime.now(tz=pytz.UTC).replace(microsecond=0)
+    points = []
+    frames = []
+    for index in range(size):
+        dt = start + timedelta(milliseconds=250 * index)
+        points.append({'id': index, 'task': 1, 'dt': dt, 'jdn': 2460000, 'jd': 0.5 + index / 86400.0,
+                       'alpha': index * 0.001 % 360.0, 'beta': 45.0, 'cs_type': 1, 'task_type': 1, 'satellite': 25544})
+        frames.append({'id': index, 'task': 1, 'dt': dt, 'jdn': 2460000, 'jd': 0.5 + index / 86400.0,
+                       'mag': 5.0, 'exposure': 100.0, 'task_type': 1, 'satellite': 25544})
+    return [{'telescope': {'id': 1, 'name': 'T'}, 'jdn': 2460000, 'points': points, 'frames': frames}]
+
+
+def sample_columns(size):
+    """The columnar form of the plan, as NumPy arrays."""
+    return {
+        'dt': np.datetime64(datetime.utcnow(), 'us') + np.arange(size) * np.timedelta64(250, 'ms'),
+        'jd': np.linspace(0.5, 0.6, size),
+        'alpha': np.linspace(0.0, 360.0, size),
+        'beta': np.full(size, 45.0),
+        'cs_type': np.ones(size, dtype=np.int64),
+    }
+
+
+class Command(BaseCommand):
+    help = 'Compares the JSON encoding and decoding of plans by the DRF renderer and parser and the fast ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=20000, help='points and frames in the plan')
+        parser.add_argument('--repeat', type=int, default=5, help='runs of every case, the best one is reported')
+
+    def measure(self, name, function, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f'{name:<32}{best * 1000:10.1f} ms')
+        return result
+
+    def handle(self, *args, **options):
+        size, repeat = options['size'], options['repeat']
+        self.stdout.write(f'orjson: {"yes" if fastjson.orjson is not None else "no, stdlib fallback"}, '
+                          f'{size} points and frames, best of {repeat}')
+        plan = sample_plan(size)
+        columns = sample_columns(size)
+        data = self.measure('encode plan, drf', lambda: JSONRenderer().render(plan), repeat)
+        self.measure('encode plan, fast', lambda: FastJSONRenderer().render(plan), repeat)
+        self.measure('encode numpy columns, drf', lambda: JSONRenderer().render(columns), repeat)
+        self.measure('encode numpy columns, fast', lambda: FastJSONRenderer().render(columns), repeat)
+        self.measure('decode plan, drf', lambda: JSONParser().parse(io.BytesIO(data)), repeat)
+        self.measure('decode plan, fast', lambda: FastJSONParser().parse(io.BytesIO(data)), repeat)
+        self.stdout.write(f'plan size {len(data)} bytes')
@@ -0,0 +1,24 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from tasks.catalog import TLECatalogImport
+
+
+class Command(BaseCommand):
+    help = 'Imports a TLE catalog file, keeping the newest element set of every satellite'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='catalog file in two- or three-line format, "-" for stdin')
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        catalog = TLECatalogImport(batch_size=options['batch_size'])
+        if options['path'] == '-':
+            stats = catalog.run(sys.stdin)
+        else:
+            with open(options['path'], encoding='utf-8', errors='replace') as lines:
+                stats = catalog.run(lines)
+        for index, error in sorted(catalog.errors.items()):
+            self.stderr.write(f'entry {index}: {error}')
+        self.stdout.write(', '.join(f'{name}: {value}' for name, value in stats.items()))
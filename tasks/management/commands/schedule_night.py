@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from tasks.tasks import schedule_nights
+
+
+class Command(BaseCommand):
+    help = 'Builds the conflict-free plans of the night for all enabled telescopes, deferring what does not fit'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--jdn', type=int, default=None, help='julian day number of the night, tonight by default')
+
+    def handle(self, *args, **options):
+        for result in schedule_nights(options['jdn']):
+            self.stdout.write(f'telescope {result["telescope"]}, jdn {result["jdn"]}: '
+                              f'scheduled {len(result["scheduled"])}, deferred {len(result["deferred"])}')
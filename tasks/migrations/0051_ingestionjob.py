@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0050_auto_20210907_1239'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.SmallIntegerField(choices=[(1, 'В очереди'), (2, 'Обрабатывается'), (3, 'Обработано'), (4, 'Ошибка обработки')], default=1, verbose_name='Статус обработки')),
+                ('total', models.IntegerField(default=0, verbose_name='Всего точек и фреймов')),
+                ('processed', models.IntegerField(default=0, verbose_name='Обработано точек и фреймов')),
+                ('errors', models.JSONField(blank=True, null=True, verbose_name='Ошибки валидации')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('task', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion', to='tasks.task', verbose_name='Задание')),
+            ],
+            options={
+                'verbose_name': 'Обработка входных данных',
+                'verbose_name_plural': 'Обработка входных данных',
+            },
+        ),
+    ]
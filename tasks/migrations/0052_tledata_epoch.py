@@ -0,0 +1,45 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:25
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+import django.db.models.deletion
+import pytz
+
+
+def fill_epoch(apps, schema_editor):
+    TLEData = apps.get_model('tasks', 'TLEData')
+    for tle in TLEData.objects.filter(epoch__isnull=True).only('id', 'line1'):
+        try:
+            year = int(tle.line1[18:20])
+            day = float(tle.line1[20:32])
+        except ValueError:
+            continue
+        year += 2000 if year < 57 else 1900
+        tle.epoch = datetime(year, 1, 1, tzinfo=pytz.UTC) + timedelta(days=day - 1)
+        tle.save(update_fields=['epoch'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0051_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tledata',
+            name='epoch',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Эпоха элементов'),
+        ),
+        migrations.AlterField(
+            model_name='tledata',
+            name='task',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='TLE_data', to='tasks.task', verbose_name='Задание'),
+        ),
+        migrations.AddIndex(
+            model_name='tledata',
+            index=models.Index(fields=['satellite', 'epoch'], name='tasks_tleda_satelli_a5f481_idx'),
+        ),
+        migrations.RunPython(fill_epoch, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0052_tledata_epoch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(status__in=[1, 2]), fields=['telescope', 'start_dt', 'end_dt'], name='task_active_slot_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:30
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0053_task_active_slot_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0, validators=[django.core.validators.MaxValueValidator(10)], verbose_name='Приоритет'),
+        ),
+        migrations.AlterField(
+            model_name='task',
+            name='status',
+            field=models.SmallIntegerField(choices=[(0, 'Черновик'), (1, 'Создано'), (2, 'Получено телескопом'), (3, 'Выполнено'), (4, 'Не удалось выполнить'), (5, 'Отложено')], default=0, editable=False, verbose_name='Статус задания'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0054_task_priority_deferred'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelescopePlan',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('jdn', models.IntegerField(verbose_name='Юлианская дата')),
+                ('points', models.JSONField(default=list, verbose_name='Точки плана')),
+                ('frames', models.JSONField(default=list, verbose_name='Фреймы плана')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('telescope', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='plans', to='tasks.telescope', verbose_name='Телескоп')),
+            ],
+            options={
+                'verbose_name': 'План телескопа',
+                'verbose_name_plural': 'Планы телескопов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='telescopeplan',
+            constraint=models.UniqueConstraint(fields=('telescope', 'jdn'), name='telescope_plan_unique'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0055_telescopeplan'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='telescopeplan',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Версия плана'),
+        ),
+    ]
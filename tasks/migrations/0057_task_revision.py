@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0056_telescopeplan_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Ревизия'),
+        ),
+        migrations.AddField(
+            model_name='telescope',
+            name='revision',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Ревизия заданий'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['telescope', 'status', 'start_jd'], name='task_plan_horizon_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['telescope', 'revision'], name='task_plan_revision_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0057_task_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TelescopePlanBody',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etag', models.CharField(max_length=100, verbose_name='ETag представления')),
+                ('coding', models.CharField(max_length=10, verbose_name='Сжатие')),
+                ('content_type', models.CharField(max_length=100, verbose_name='Тип содержимого')),
+                ('body', models.BinaryField(verbose_name='Сжатое тело ответа')),
+                ('plan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bodies', to='tasks.telescopeplan', verbose_name='План телескопа')),
+            ],
+            options={
+                'verbose_name': 'Сжатый план телескопа',
+                'verbose_name_plural': 'Сжатые планы телескопов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='telescopeplanbody',
+            constraint=models.UniqueConstraint(fields=('plan', 'etag', 'coding'), name='telescope_plan_body_unique'),
+        ),
+    ]
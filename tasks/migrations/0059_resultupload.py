@@ -0,0 +1,35 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0058_telescopeplanbody'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultUpload',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=100, verbose_name='Имя файла')),
+                ('size', models.BigIntegerField(verbose_name='Размер в байтах')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='Получено байт')),
+                ('checksum', models.CharField(blank=True, max_length=64, verbose_name='Контрольная сумма SHA-256')),
+                ('status', models.SmallIntegerField(choices=[(1, 'Загружается'), (2, 'Загружен')], default=1, verbose_name='Статус загрузки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('frame', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='tasks.frame', verbose_name='Фрейм')),
+                ('point', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='tasks.point', verbose_name='Точка')),
+                ('result', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='tasks.taskresult', verbose_name='Результат')),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='tasks.task', verbose_name='Задание')),
+            ],
+            options={
+                'verbose_name': 'Загрузка снимка',
+                'verbose_name_plural': 'Загрузки снимков',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.2 on 2026-10-18 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0059_resultupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='taskresult',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хэш снимка SHA-256'),
+        ),
+        migrations.AddField(
+            model_name='taskresult',
+            name='previews',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Уменьшенные копии снимка'),
+        ),
+    ]
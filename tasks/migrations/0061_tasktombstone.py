@@ -0,0 +1,31 @@
+# Generated by Django 3.1.2 on 2026-10-18 04:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0060_taskresult_previews'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.IntegerField(verbose_name='Номер задания')),
+                ('revision', models.BigIntegerField(editable=False, verbose_name='Ревизия')),
+                ('telescope', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_tombstones', to='tasks.telescope', verbose_name='Телескоп')),
+            ],
+            options={
+                'verbose_name': 'Удаленное задание',
+                'verbose_name_plural': 'Удаленные задания',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='tasktombstone',
+            index=models.Index(fields=['telescope', 'revision'], name='task_tombstone_revision_idx'),
+        ),
+    ]
@@ -1,7 +1,8 @@
 from datetime import datetime
 from julian import julian
 
-from django.db import models
+from django.core.validators import MaxValueValidator
+from django.db import models, transaction
 from django.conf import settings
 
 
@@ -25,6 +26,7 @@ class Telescope(models.Model):
     fov = models.FloatField('Поле зрения в градусах')
     avatar = models.ImageField('Аватар', null=True, blank=True, upload_to='telescopes')
     user = models.OneToOneField(settings.AUTH_USER_MODEL, verbose_name='Пользователь телескопа', related_name='telescopes', null=True, default=None, on_delete=models.DO_NOTHING)
+    revision = models.BigIntegerField('Ревизия заданий', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Телескоп'
@@ -33,6 +35,15 @@ class Telescope(models.Model):
     def __str__(self):
         return f'({self.code}) {self.name}'
 
+    @staticmethod
+    def next_revision(telescope_id):
+        """
+        Increments the task revision counter of the telescope. The counter row stays locked until the
+        transaction commits, so the revisions of one telescope become visible in their order.
+        """
+        Telescope.objects.filter(id=telescope_id).update(revision=models.F('revision') + 1)
+        return Telescope.objects.filter(id=telescope_id).values_list('revision', flat=True).first()
+
     def get_user_balance(self, user):
         balance = self.balances.filter(user=user).first()
         return balance.minutes if balance else 0
@@ -40,6 +51,9 @@ class Telescope(models.Model):
     def to_dict(self):
         data = {}
         for f in self._meta.concrete_fields:
+            # the revision moves with every task change; the plans carry it in their ETag only
+            if f.name == 'revision':
+                continue
             data[f.name] = f.value_from_object(self)
         return data
 
@@ -69,12 +83,14 @@ class Task(models.Model):
     RECEIVED = 2
     READY = 3
     FAILED = 4
+    DEFERRED = 5
     STATUS_CHOICES = (
         (DRAFT, 'Черновик'),
         (CREATED, 'Создано'),
         (RECEIVED, 'Получено телескопом'),
         (READY, 'Выполнено'),
         (FAILED, 'Не удалось выполнить'),
+        (DEFERRED, 'Отложено'),
     )
     POINTS_MODE = 1
     TRACKING_MODE = 2
@@ -93,14 +109,51 @@ class Task(models.Model):
     jdn = models.IntegerField('Юлианская дата начала наблюдения', editable=False, null=True)
     start_jd = models.FloatField('Юлианское время начала наблюдения', editable=False, null=True)
     end_jd = models.FloatField('Юлианское время конца наблюдения', editable=False, null=True)
+    priority = models.PositiveSmallIntegerField('Приоритет', default=0, validators=[MaxValueValidator(10)])
+    revision = models.BigIntegerField('Ревизия', default=0, editable=False)
+
+    # fields of the task that its plan rows depend on: saving other changes does not bump the revision
+    PLAN_FIELDS = ('telescope', 'jdn', 'status', 'start_dt', 'end_dt', 'start_jd', 'end_jd', 'task_type', 'satellite')
 
     class Meta:
         verbose_name = 'Задание'
         verbose_name_plural = 'Задания'
+        indexes = [
+            # slot collision checks look only at the active (CREATED, RECEIVED) tasks, so the index stays small with any history
+            models.Index(fields=['telescope', 'start_dt', 'end_dt'], name='task_active_slot_idx',
+                         condition=models.Q(status__in=[1, 2])),
+            # plan synchronization: tasks in the horizon, and tasks changed since a revision
+            models.Index(fields=['telescope', 'status', 'start_jd'], name='task_plan_horizon_idx'),
+            models.Index(fields=['telescope', 'revision'], name='task_plan_revision_idx'),
+        ]
 
     def __str__(self):
         return f'({self.id}) за {self.created_at.strftime("%Y-%m-%d %H:%M")} от пользователя {self.author.get_full_name()}: {self.get_task_type_display()} ({self.get_status_display()})'
 
+    def save(self, *args, **kwargs):
+        # the stored plan fields tell the post_save signal which plans to rebuild
+        self._stored_plan = None
+        if self.pk is not None:
+            self._stored_plan = Task.objects.filter(pk=self.pk).values_list(*self.PLAN_FIELDS).first()
+        update_fields = kwargs.get('update_fields', None)
+        self._plan_changed = self._stored_plan is None or any(
+            getattr(self, self._meta.get_field(name).attname) != stored
+            for name, stored in zip(self.PLAN_FIELDS, self._stored_plan)
+            if update_fields is None or name in update_fields
+        )
+        if not self._plan_changed:
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            self.revision = Telescope.next_revision(self.telescope_id)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'revision'}
+            if self._stored_plan is not None and self._stored_plan[0] != self.telescope_id:
+                # the telescope the task left syncs its removal
+                TaskTombstone.objects.create(telescope_id=self._stored_plan[0], task_id=self.pk,
+                                             revision=Telescope.next_revision(self._stored_plan[0]))
+            super().save(*args, **kwargs)
+
     def to_dict(self):
         data = {}
         for f in self._meta.concrete_fields:
@@ -108,6 +161,57 @@ class Task(models.Model):
         return data
 
 
+class TaskTombstone(models.Model):
+    """A task deleted from (or moved off) the telescope, kept for the plan synchronization to report its removal."""
+    telescope = models.ForeignKey(to=Telescope, verbose_name='Телескоп', related_name='task_tombstones', on_delete=models.CASCADE)
+    task_id = models.IntegerField('Номер задания')
+    revision = models.BigIntegerField('Ревизия', editable=False)
+
+    class Meta:
+        verbose_name = 'Удаленное задание'
+        verbose_name_plural = 'Удаленные задания'
+        indexes = [
+            models.Index(fields=['telescope', 'revision'], name='task_tombstone_revision_idx'),
+        ]
+
+    def __str__(self):
+        return f'Задание {self.task_id} удалено с телескопа {self.telescope_id}'
+
+
+class TelescopePlan(models.Model):
+    telescope = models.ForeignKey(to=Telescope, verbose_name='Телескоп', related_name='plans', on_delete=models.CASCADE)
+    jdn = models.IntegerField('Юлианская дата')
+    points = models.JSONField('Точки плана', default=list)
+    frames = models.JSONField('Фреймы плана', default=list)
+    version = models.PositiveIntegerField('Версия плана', default=0)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'План телескопа'
+        verbose_name_plural = 'Планы телескопов'
+        constraints = [
+            models.UniqueConstraint(fields=['telescope', 'jdn'], name='telescope_plan_unique'),
+        ]
+
+    def __str__(self):
+        return f'План телескопа {self.telescope_id} на {self.jdn}'
+
+
+class TelescopePlanBody(models.Model):
+    plan = models.ForeignKey(to=TelescopePlan, verbose_name='План телескопа', related_name='bodies', on_delete=models.CASCADE)
+    etag = models.CharField('ETag представления', max_length=100)
+    coding = models.CharField('Сжатие', max_length=10)
+    content_type = models.CharField('Тип содержимого', max_length=100)
+    body = models.BinaryField('Сжатое тело ответа')
+
+    class Meta:
+        verbose_name = 'Сжатый план телескопа'
+        verbose_name_plural = 'Сжатые планы телескопов'
+        constraints = [
+            models.UniqueConstraint(fields=['plan', 'etag', 'coding'], name='telescope_plan_body_unique'),
+        ]
+
+
 class InputData(models.Model):
     NONE = 0
     TLE = 1
@@ -130,6 +234,33 @@ class InputData(models.Model):
         return f'({self.id}) {self.get_data_type_display()} для задания {self.task}'
 
 
+class IngestionJob(models.Model):
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+    STATUS_CHOICES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Обрабатывается'),
+        (DONE, 'Обработано'),
+        (FAILED, 'Ошибка обработки'),
+    )
+    task = models.OneToOneField(Task, verbose_name='Задание', related_name='ingestion', on_delete=models.CASCADE)
+    status = models.SmallIntegerField('Статус обработки', choices=STATUS_CHOICES, default=PENDING)
+    total = models.IntegerField('Всего точек и фреймов', default=0)
+    processed = models.IntegerField('Обработано точек и фреймов', default=0)
+    errors = models.JSONField('Ошибки валидации', null=True, blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Обработка входных данных'
+        verbose_name_plural = 'Обработка входных данных'
+
+    def __str__(self):
+        return f'({self.id}) {self.get_status_display()} для задания {self.task_id}'
+
+
 class AbstractSpherePoint(models.Model):
     EARTH_SYSTEM = 0
     STARS_SYSTEM = 1
@@ -317,21 +448,39 @@ class Frame(AbstractTimeMoment, AbstractImageFrame):
 
 
 class TLEData(models.Model):
-    task = models.ForeignKey(to=Task, verbose_name='Задание', related_name='TLE_data', on_delete=models.DO_NOTHING)
+    task = models.ForeignKey(to=Task, verbose_name='Задание', related_name='TLE_data', null=True, blank=True, on_delete=models.DO_NOTHING)
     satellite = models.ForeignKey(to=Satellite, to_field='number', verbose_name='Спутник', related_name='TLE_data', null=True, on_delete=models.DO_NOTHING)
     header = models.CharField('Заголовок', max_length=25, null=True, blank=True)
     line1 = models.CharField('Первая строка TLE спутника', max_length=70)
     line2 = models.CharField('Вторая строка TLE спутника', max_length=70)
+    epoch = models.DateTimeField('Эпоха элементов', null=True, blank=True)
 
     class Meta:
         verbose_name = 'Данные в формате TLE'
         verbose_name_plural = 'Данные в формате TLE'
+        indexes = [
+            models.Index(fields=['satellite', 'epoch']),
+        ]
 
     def __str__(self):
         if self.header:
             return self.header
         return 'Без заголовка'
 
+    @staticmethod
+    def current(numbers=None):
+        """
+        The TLE of the newest epoch of every satellite (or of the satellites with the given numbers)
+        as {number: TLEData}, fetched with one query using the (satellite, epoch) index.
+        """
+        queryset = TLEData.objects.filter(satellite__isnull=False)
+        if numbers is not None:
+            queryset = queryset.filter(satellite_id__in=numbers)
+        newest = TLEData.objects.filter(satellite_id=models.OuterRef('satellite_id')).order_by(
+            models.F('epoch').desc(nulls_last=True), '-id'
+        ).values('id')[:1]
+        return {tle.satellite_id: tle for tle in queryset.filter(id=models.Subquery(newest))}
+
 
 class Point(AbstractSpherePoint, AbstractTimeMoment):
     id = models.BigAutoField(primary_key=True)
@@ -415,6 +564,8 @@ class TaskResult(models.Model):
     image = models.ImageField('Снимок', null=True, blank=True, upload_to='results')
     point = models.OneToOneField(to=Point, verbose_name='Точка', related_name='result', null=True, on_delete=models.DO_NOTHING)
     frame = models.OneToOneField(to=Frame, verbose_name='Фрейм', related_name='result', null=True, on_delete=models.DO_NOTHING)
+    image_hash = models.CharField('Хэш снимка SHA-256', max_length=64, blank=True, editable=False)
+    previews = models.JSONField('Уменьшенные копии снимка', default=dict, blank=True, editable=False)
 
     class Meta:
         verbose_name = 'Результат наблюдений'
@@ -422,3 +573,31 @@ class TaskResult(models.Model):
 
     def __str__(self):
         return f'Снимок {self.id} (задание {self.task.id}, на фрейм/точку №{self.point_id or self.frame_id })'
+
+
+class ResultUpload(models.Model):
+    UPLOADING = 1
+    COMPLETED = 2
+    STATUS_CHOICES = (
+        (UPLOADING, 'Загружается'),
+        (COMPLETED, 'Загружен'),
+    )
+    id = models.BigAutoField(primary_key=True)
+    task = models.ForeignKey(to=Task, verbose_name='Задание', related_name='uploads', on_delete=models.CASCADE)
+    point = models.ForeignKey(to=Point, verbose_name='Точка', related_name='uploads', null=True, on_delete=models.CASCADE)
+    frame = models.ForeignKey(to=Frame, verbose_name='Фрейм', related_name='uploads', on_delete=models.CASCADE)
+    name = models.CharField('Имя файла', max_length=100)
+    size = models.BigIntegerField('Размер в байтах')
+    offset = models.BigIntegerField('Получено байт', default=0)
+    checksum = models.CharField('Контрольная сумма SHA-256', max_length=64, blank=True)
+    status = models.SmallIntegerField('Статус загрузки', choices=STATUS_CHOICES, default=UPLOADING)
+    result = models.OneToOneField(to=TaskResult, verbose_name='Результат', related_name='upload', null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    updated_at = models.DateTimeField('Дата обновления', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Загрузка снимка'
+        verbose_name_plural = 'Загрузки снимков'
+
+    def __str__(self):
+        return f'({self.id}) {self.get_status_display()} {self.offset}/{self.size} для задания {self.task_id}'
@@ -0,0 +1,43 @@
+import codecs
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+
+from tasks import fastjson, planformat
+from tasks.renderers import FastJSONRenderer
+
+
+class FastJSONParser(JSONParser):
+    """JSON parser on orjson when it is installed (see tasks.fastjson), else the usual one."""
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if fastjson.orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            # orjson reads UTF-8 only: bodies of another charset are decoded first
+            if codecs.lookup(encoding).name != 'utf-8':
+                data = data.decode(encoding)
+            return fastjson.loads(data)
+        except (LookupError, UnicodeDecodeError, fastjson.JSONDecodeError) as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+
+class PlanBinaryParser(BaseParser):
+    """
+    Parses the compact binary plan format (see tasks.planformat) into
+    {'meta': {...}, 'points': {column: array}, 'frames': {column: array}}.
+    """
+    media_type = planformat.MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            raise ParseError('Binary plan is empty')
+        try:
+            meta, points, frames = planformat.decode_plan(stream.read())
+        except planformat.PlanFormatError as e:
+            raise ParseError(f'Binary plan parse error - {e}')
+        return {'meta': meta, 'points': points, 'frames': frames}
@@ -0,0 +1,216 @@
+from collections import namedtuple
+
+import numpy as np
+
+from tasks import jdtime
+from sgp4.api import SatrecArray
+
+from tasks.propagation import teme_to_topocentric, topocentric_pairs
+
+
+Pass = namedtuple('Pass', ('index', 'rise', 'culmination', 'set', 'max_elevation', 'culmination_azimuth'))
+
+
+class PassPredictor:
+    """
+    Finds the passes of many satellites above min_elevation for one observer and time window.
+
+    All satellites are sampled together on a coarse grid (chunk_size satellites per propagation
+    call); satellites in high orbits, which move slowly over the sky, get a proportionally longer
+    step. SGP4 runs only at every knot_interval-th sample, the positions in between are cubic
+    Hermite interpolated from the positions and velocities at the knots. The bracketed rise and set moments are then refined by the Illinois (regula falsi) method
+    and culminations by successive parabolic interpolation, each round evaluating all the passes of
+    all satellites in one vectorized call.
+
+    Passes shorter than the step may be missed. Moments are seconds from the window start;
+    rise (set) is None when the satellite is already (still) above min_elevation at the window start (end).
+    """
+    chunk_size = 500
+    knot_interval = 5
+    refine_rounds = 4
+    # satellites whose pass near perigee lasts longer get the step multiplied by up to this factor
+    max_step_factor = 8
+    reference_period = 120.0
+
+    def __init__(self, satellites, latitude, longitude, altitude, min_elevation=0.0, step=60.0):
+        self.satellites = satellites
+        self.observer = (latitude, longitude, altitude)
+        self.min_elevation = min_elevation
+        self.step = step
+
+    def predict(self, start, end):
+        """Returns a list of Pass tuples for the window [start, end] given as datetime64 values."""
+        self.jd0, self.fr0 = jdtime.to_jd_fr(np.array([start], dtype='datetime64[us]'))
+        self.duration = (np.datetime64(end, 'us') - np.datetime64(start, 'us')) / np.timedelta64(1, 's')
+        brackets = self._screen()
+        if not len(brackets['index']) > 0:
+            return []
+        rise, set_, culmination = self._refine(brackets)
+        azimuth, max_elevation = self._evaluate(brackets['index'], culmination)
+        return sorted((
+            Pass(int(index), None if np.isnan(r) else float(r), float(c), None if np.isnan(s) else float(s), float(e), float(a))
+            for index, r, c, s, e, a in zip(brackets['index'], rise, culmination, set_, max_elevation, azimuth)
+        ), key=lambda item: (item.culmination if item.rise is None else item.rise, item.index))
+
+    def step_factors(self):
+        """
+        Power of two multipliers of the screening step: the step is scaled by the time the satellite
+        needs to cover the same arc as a low orbit one, using its angular rate at perigee.
+        """
+        n = np.array([satellite.no_kozai for satellite in self.satellites])
+        e = np.array([satellite.ecco for satellite in self.satellites])
+        perigee_rate = n * (1 + e) ** 2 / (1 - e ** 2) ** 1.5
+        ratio = 2 * np.pi / perigee_rate / self.reference_period
+        factors = 2.0 ** np.floor(np.log2(np.maximum(ratio, 1.0)))
+        return np.minimum(factors, self.max_step_factor)
+
+    def _moments(self, seconds):
+        seconds = np.asarray(seconds, dtype=np.float64)
+        return np.full(seconds.shape, self.jd0[0]), self.fr0[0] + seconds / 86400.0
+
+    def _evaluate(self, indexes, seconds):
+        jd, fr = self._moments(seconds)
+        return topocentric_pairs(self.satellites, indexes, jd, fr, *self.observer)
+
+    def _screen(self):
+        parts = []
+        factors = self.step_factors()
+        for factor in np.unique(factors):
+            group = np.flatnonzero(factors == factor)
+            times = np.append(np.arange(0.0, self.duration, self.step * factor), self.duration)
+            for offset in range(0, len(group), self.chunk_size):
+                indexes = group[offset:offset + self.chunk_size]
+                elevation = self._sample([self.satellites[index] for index in indexes], times)
+                parts.append(self._brackets(indexes, times, np.nan_to_num(elevation, nan=-90.0)))
+        return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+    def _sample(self, satellites, times):
+        """Elevations of the satellites at the moments times, interpolated between the SGP4 knots."""
+        knots = np.unique(np.append(np.arange(0, len(times), self.knot_interval), len(times) - 1))
+        knot_jd, knot_fr = self._moments(times[knots])
+        errors, r, v = SatrecArray(satellites).sgp4(knot_jd, knot_fr)
+        interval = np.clip(np.searchsorted(knots, np.arange(len(times)), side='right') - 1, 0, max(len(knots) - 2, 0))
+        following = np.minimum(interval + 1, len(knots) - 1)
+        h = (times[knots[following]] - times[knots[interval]])
+        s = np.where(h > 0, (times - times[knots[interval]]) / np.where(h > 0, h, 1.0), 0.0)[:, None]
+        h = h[:, None]
+        # velocities are in km/s, the interval is in seconds
+        positions = (
+            (2 * s ** 3 - 3 * s ** 2 + 1) * r[:, interval] + (s ** 3 - 2 * s ** 2 + s) * h * v[:, interval]
+            + (-2 * s ** 3 + 3 * s ** 2) * r[:, following] + (s ** 3 - s ** 2) * h * v[:, following]
+        )
+        jd, fr = self._moments(times)
+        azimuth, elevation = teme_to_topocentric(positions, jd, fr, *self.observer)
+        elevation[(errors[:, interval] != 0) | (errors[:, following] != 0)] = np.nan
+        return elevation
+
+    def _brackets(self, indexes, times, elevation):
+        """
+        Splits the sampled elevations into passes: runs of samples at or above min_elevation.
+        For every pass returns the samples around its rise and set and the three samples around
+        its highest one; brackets of rises and sets outside the window are NaN.
+        """
+        last = len(times) - 1
+        padded = np.zeros((elevation.shape[0], elevation.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = elevation >= self.min_elevation
+        edges = np.diff(padded, axis=1)
+        rows, begins = np.nonzero(edges == 1)
+        ends = np.nonzero(edges == -1)[1] - 1
+        # highest sample of every pass: maximum of the elevation masked outside the pass
+        masked = np.where(padded[:, 1:-1].astype(bool), elevation, -np.inf)
+        peaks = np.array([begin + np.argmax(masked[row, begin:end + 1]) for row, begin, end in zip(rows, begins, ends)],
+                         dtype=np.int64)
+        has_rise = begins > 0
+        has_set = ends < last
+        rise_before = np.where(has_rise, begins - 1, 0)
+        set_after = np.where(has_set, ends + 1, last)
+        around = np.stack((np.maximum(peaks - 1, 0), peaks, np.minimum(peaks + 1, last)), axis=1)
+        return {
+            'index': indexes[rows],
+            'rise_t': np.where(has_rise[:, None], np.stack((times[rise_before], times[begins]), axis=1), np.nan),
+            'rise_e': np.stack((elevation[rows, rise_before], elevation[rows, begins]), axis=1),
+            'set_t': np.where(has_set[:, None], np.stack((times[ends], times[set_after]), axis=1), np.nan),
+            'set_e': np.stack((elevation[rows, ends], elevation[rows, set_after]), axis=1),
+            'peak_t': times[around],
+            'peak_e': elevation[rows[:, None], around],
+        }
+
+    def _refine(self, brackets):
+        index = brackets['index']
+        has_rise = ~np.isnan(brackets['rise_t'][:, 0])
+        has_set = ~np.isnan(brackets['set_t'][:, 0])
+        # rises and sets are refined together as roots of elevation - min_elevation
+        roots_index = np.concatenate((index[has_rise], index[has_set]))
+        t = np.concatenate((brackets['rise_t'][has_rise], brackets['set_t'][has_set]))
+        g = np.concatenate((brackets['rise_e'][has_rise], brackets['set_e'][has_set])) - self.min_elevation
+        side = np.zeros(len(roots_index), dtype=np.int8)
+        peak_t = brackets['peak_t'].copy()
+        peak_e = brackets['peak_e'].copy()
+        for _ in range(self.refine_rounds):
+            guess = self._illinois_guess(t, g)
+            probes = np.concatenate((guess, self._parabola_probes(peak_t, peak_e)))
+            azimuth, elevation = self._evaluate(np.concatenate((roots_index, index, index, index)), probes)
+            self._illinois_update(t, g, side, guess, elevation[:len(guess)] - self.min_elevation)
+            peak_t, peak_e = self._parabola_update(peak_t, peak_e, probes[len(guess):], elevation[len(guess):])
+        roots = self._illinois_guess(t, g)
+        rise = np.full(len(index), np.nan)
+        rise[has_rise] = roots[:has_rise.sum()]
+        set_ = np.full(len(index), np.nan)
+        set_[has_set] = roots[has_rise.sum():]
+        best = np.argmax(peak_e, axis=1)
+        return rise, set_, peak_t[np.arange(len(index)), best]
+
+    @staticmethod
+    def _illinois_guess(t, g):
+        span = g[:, 1] - g[:, 0]
+        safe = np.where(span == 0, 1.0, span)
+        guess = t[:, 0] - g[:, 0] * (t[:, 1] - t[:, 0]) / safe
+        middle = (t[:, 0] + t[:, 1]) / 2
+        return np.where((span == 0) | ~np.isfinite(guess), middle, guess)
+
+    @staticmethod
+    def _illinois_update(t, g, side, guess, value):
+        # the probe replaces the bracket end of the same sign; when the same end is kept twice in a row
+        # the function value there is halved, which keeps the convergence superlinear
+        value = np.nan_to_num(value, nan=-90.0)
+        replace_first = np.sign(value) == np.sign(g[:, 0])
+        replace_second = ~replace_first
+        halve_second = replace_first & (side == 1)
+        halve_first = replace_second & (side == -1)
+        g[halve_second, 1] /= 2
+        g[halve_first, 0] /= 2
+        t[replace_first, 0] = guess[replace_first]
+        g[replace_first, 0] = value[replace_first]
+        t[replace_second, 1] = guess[replace_second]
+        g[replace_second, 1] = value[replace_second]
+        side[:] = np.where(replace_first, 1, -1)
+
+    def _parabola_probes(self, peak_t, peak_e):
+        """Vertex of the parabola through the three best samples, and two points around it."""
+        t1, t2, t3 = peak_t.T
+        e1, e2, e3 = peak_e.T
+        numerator = (t2 - t1) ** 2 * (e2 - e3) - (t2 - t3) ** 2 * (e2 - e1)
+        denominator = (t2 - t1) * (e2 - e3) - (t2 - t3) * (e2 - e1)
+        vertex = t2 - 0.5 * numerator / np.where(denominator == 0, np.inf, denominator)
+        vertex = np.clip(np.nan_to_num(vertex, nan=t2), t1, t3)
+        # the stencil shrinks with the bracket but stays inside the window
+        half = np.maximum((t3 - t1) / 8, 0.05)
+        vertex = np.clip(vertex, half, self.duration - half)
+        vertex = np.clip(vertex, 0.0, self.duration)
+        return np.concatenate((vertex - half, vertex, vertex + half))
+
+    def _parabola_update(self, peak_t, peak_e, probes, values):
+        size = len(peak_t)
+        t = np.concatenate((peak_t, probes.reshape(3, size).T), axis=1)
+        e = np.concatenate((peak_e, np.nan_to_num(values, nan=-90.0).reshape(3, size).T), axis=1)
+        outside = (t < 0.0) | (t > self.duration)
+        e = np.where(outside, -np.inf, e)
+        best = np.argmax(e, axis=1)
+        order = np.argsort(t, axis=1, kind='stable')
+        t = np.take_along_axis(t, order, axis=1)
+        e = np.take_along_axis(e, order, axis=1)
+        position = np.argmax(order == best[:, None], axis=1)
+        # keep the best sample and its two neighbours in time, shifted inside the six samples
+        position = np.clip(position, 1, t.shape[1] - 2)
+        around = np.stack((position - 1, position, position + 1), axis=1)
+        return np.take_along_axis(t, around, axis=1), np.take_along_axis(e, around, axis=1)
@@ -0,0 +1,183 @@
+import json
+import struct
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+MEDIA_TYPE = 'application/x-chronos-plan'
+MAGIC = b'CHPL'
+VERSION = 1
+HAS_CS_TYPE = 0x1
+# magic, version, flags, number of points, number of frames, length of the JSON metadata
+HEADER = struct.Struct('<4sHHIII')
+ALIGNMENT = 8
+
+POINT_COLUMNS = (('dt', '<i8'), ('alpha', '<f8'), ('beta', '<f8'))
+FRAME_COLUMNS = (('dt', '<i8'), ('exposure', '<f8'), ('mag', '<f8'))
+
+
+class PlanFormatError(ValueError):
+    pass
+
+
+def _padding(size):
+    return -size % ALIGNMENT
+
+
+def encode_plan(meta, points, frames):
+    """
+    Packs a plan into the binary upload format:
+    header, JSON metadata padded to 8 bytes, then little-endian columns -
+    points dt/alpha/beta, frames dt/exposure/mag and optionally points cs_type (uint8).
+    dt columns are int64 microseconds since 1970-01-01T00:00:00Z.
+    """
+    meta_bytes = json.dumps(meta or {}).encode()
+    n_points = len(points['dt'])
+    n_frames = len(frames['dt'])
+    flags = HAS_CS_TYPE if 'cs_type' in points else 0
+    parts = [HEADER.pack(MAGIC, VERSION, flags, n_points, n_frames, len(meta_bytes)), meta_bytes]
+    parts.append(b'\0' * _padding(HEADER.size + len(meta_bytes)))
+    for columns, layout in ((points, POINT_COLUMNS), (frames, FRAME_COLUMNS)):
+        for name, dtype in layout:
+            column = np.asarray(columns[name])
+            if name == 'dt':
+                column = column.astype('datetime64[us]').astype(np.int64)
+            parts.append(np.ascontiguousarray(column, dtype=dtype).tobytes())
+    if flags & HAS_CS_TYPE:
+        parts.append(np.ascontiguousarray(points['cs_type'], dtype=np.uint8).tobytes())
+    return b''.join(parts)
+
+
+def decode_plan(buffer):
+    """
+    Unpacks the binary upload format into (meta, points, frames), where points and frames are
+    dicts of NumPy arrays viewing the buffer without copying it. dt columns are datetime64[us].
+    """
+    view = memoryview(buffer)
+    if len(view) < HEADER.size:
+        raise PlanFormatError('plan is shorter than its header')
+    magic, version, flags, n_points, n_frames, meta_size = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise PlanFormatError('plan has wrong magic bytes')
+    if version != VERSION:
+        raise PlanFormatError(f'plan version {version} is not supported')
+    offset = HEADER.size + meta_size
+    expected = offset + _padding(offset) + 8 * (len(POINT_COLUMNS) * n_points + len(FRAME_COLUMNS) * n_frames)
+    if flags & HAS_CS_TYPE:
+        expected += n_points
+    if len(view) != expected:
+        raise PlanFormatError(f'plan size is {len(view)} bytes, expected {expected}')
+    try:
+        meta = json.loads(bytes(view[HEADER.size:offset]) or b'{}')
+    except ValueError:
+        raise PlanFormatError('plan metadata is not valid JSON')
+    if not isinstance(meta, dict):
+        raise PlanFormatError('plan metadata is not an object')
+    offset += _padding(offset)
+    points = {}
+    frames = {}
+    for columns, layout, size in ((points, POINT_COLUMNS, n_points), (frames, FRAME_COLUMNS, n_frames)):
+        for name, dtype in layout:
+            columns[name] = np.frombuffer(view, dtype=dtype, count=size, offset=offset)
+            offset += 8 * size
+        columns['dt'] = columns['dt'].view('datetime64[us]')
+    if flags & HAS_CS_TYPE:
+        points['cs_type'] = np.frombuffer(view, dtype=np.uint8, count=n_points, offset=offset)
+    return meta, points, frames
+
+
+COLUMNS_MEDIA_TYPE = 'application/x-chronos-plan-columns'
+COLUMNS_JSON_MEDIA_TYPE = 'application/x-chronos-plan-columns+json'
+COLUMNS_MAGIC = b'CHPC'
+COLUMNS_VERSION = 1
+# magic, version, flags (reserved), length of the JSON metadata
+COLUMNS_HEADER = struct.Struct('<4sHHI')
+
+# columns of the delivered plan; satellite is 0 for tasks without a satellite in the binary format
+PLAN_POINT_COLUMNS = (
+    ('id', '<i8'), ('task', '<i8'), ('dt', '<i8'), ('jdn', '<i8'), ('jd', '<f8'),
+    ('alpha', '<f8'), ('beta', '<f8'), ('cs_type', '|u1'), ('task_type', '|u1'), ('satellite', '<i8'),
+)
+PLAN_FRAME_COLUMNS = (
+    ('id', '<i8'), ('task', '<i8'), ('dt', '<i8'), ('jdn', '<i8'), ('jd', '<f8'),
+    ('exposure', '<f8'), ('mag', '<f8'), ('task_type', '|u1'), ('satellite', '<i8'),
+)
+PLAN_TABLES = (('points', PLAN_POINT_COLUMNS), ('frames', PLAN_FRAME_COLUMNS))
+
+
+def rows_to_columns(rows, layout):
+    """One list per column of the layout; absent values (satellite of most tasks) are None."""
+    return {name: [row.get(name, None) for row in rows] for name, dtype in layout}
+
+
+def encode_columns(meta, tables):
+    """
+    Packs tables of columns into the binary delivery format: header, JSON metadata padded to 8 bytes,
+    then the little-endian columns of every table in the order the metadata lists them, each padded
+    to 8 bytes. tables maps a name to (layout, {column: values}); dt columns are datetime64 values or
+    strings and are stored as int64 microseconds since 1970-01-01T00:00:00Z, None values are stored as 0.
+    """
+    meta = dict(meta or {})
+    meta['tables'] = {
+        name: {'size': len(columns[layout[0][0]]), 'columns': [list(column) for column in layout]}
+        for name, (layout, columns) in tables.items()
+    }
+    meta_bytes = json.dumps(meta).encode()
+    parts = [COLUMNS_HEADER.pack(COLUMNS_MAGIC, COLUMNS_VERSION, 0, len(meta_bytes)), meta_bytes]
+    parts.append(b'\0' * _padding(COLUMNS_HEADER.size + len(meta_bytes)))
+    for name, (layout, columns) in tables.items():
+        for column, dtype in layout:
+            values = columns[column]
+            if column == 'dt':
+                array = _dt_column(values)
+            else:
+                array = np.array([0 if value is None else value for value in values], dtype=dtype)
+            data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+            parts.append(data)
+            parts.append(b'\0' * _padding(len(data)))
+    return b''.join(parts)
+
+
+def decode_columns(buffer):
+    """
+    Unpacks the binary delivery format into (meta, tables), tables mapping a name to a dict of NumPy
+    arrays viewing the buffer without copying it. dt columns are datetime64[us].
+    """
+    view = memoryview(buffer)
+    if len(view) < COLUMNS_HEADER.size:
+        raise PlanFormatError('plan is shorter than its header')
+    magic, version, flags, meta_size = COLUMNS_HEADER.unpack_from(view)
+    if magic != COLUMNS_MAGIC:
+        raise PlanFormatError('plan has wrong magic bytes')
+    if version != COLUMNS_VERSION:
+        raise PlanFormatError(f'plan version {version} is not supported')
+    offset = COLUMNS_HEADER.size + meta_size
+    try:
+        meta = json.loads(bytes(view[COLUMNS_HEADER.size:offset]))
+        layouts = meta.pop('tables')
+    except (ValueError, KeyError, TypeError):
+        raise PlanFormatError('plan metadata is not valid')
+    offset += _padding(offset)
+    tables = {}
+    for name, table in layouts.items():
+        columns = tables[name] = {}
+        for column, dtype in table['columns']:
+            size = np.dtype(dtype).itemsize * table['size']
+            if offset + size > len(view):
+                raise PlanFormatError(f'plan is shorter than its {name} columns')
+            columns[column] = np.frombuffer(view, dtype=dtype, count=table['size'], offset=offset)
+            offset += size + _padding(size)
+        if 'dt' in columns:
+            columns['dt'] = columns['dt'].view('datetime64[us]')
+    return meta, tables
+
+
+def _dt_column(values):
+    if isinstance(values, np.ndarray):
+        return values.astype('datetime64[us]').astype(np.int64)
+    strings = [
+        value.astimezone(timezone.utc).replace(tzinfo=None).isoformat() if isinstance(value, datetime) else value.rstrip('Z')
+        for value in values
+    ]
+    return np.array(strings, dtype='datetime64[us]').astype(np.int64)
@@ -0,0 +1,259 @@
+import math
+import threading
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from tasks.models import Telescope, Task, TaskTombstone, Point, Frame, TelescopePlan, TelescopePlanBody
+from tasks import fastjson
+from tasks.pubsub import get_broker, telescope_channel
+
+
+_pending = threading.local()
+
+
+def format_dt(dt):
+    """Formats a datetime as the API renders it (see fastjson), so a stored plan reads the same as a built one."""
+    value = dt.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    elif dt.tzinfo is None:
+        value += 'Z'
+    return value
+
+
+def build_plan(telescope_id, jdn):
+    """Points and frames of the CREATED tasks of the telescope for the night, as delivered to the telescope."""
+    return plan_rows(Task.objects.filter(
+        status=Task.CREATED,
+        telescope_id=telescope_id,
+        jdn=jdn
+    ))
+
+
+def plan_rows(tasks):
+    """
+    Points and frames of the tasks, ordered by the task start and then by dt: one query for each,
+    reading the rows joined to their task straight into dicts keyed as Model.to_dict() keys them.
+    """
+    return _moment_rows(Point, tasks), _moment_rows(Frame, tasks)
+
+
+def _moment_rows(model, tasks):
+    fields = model._meta.concrete_fields
+    names = [field.name for field in fields]
+    dt_position = names.index('dt')
+    # satellite refers to Satellite.number, so the key of the task is the number itself
+    values = model.objects.filter(task__in=tasks).order_by('task__start_dt', 'task_id', 'dt').values_list(
+        *(field.attname for field in fields), 'task__task_type', 'task__satellite_id'
+    )
+    rows = []
+    for *row, task_type, satellite in values.iterator(chunk_size=10000):
+        row[dt_position] = format_dt(row[dt_position])
+        item = dict(zip(names, row))
+        item['task_type'] = task_type
+        if satellite is not None:
+            item['satellite'] = satellite
+        rows.append(item)
+    return rows
+
+
+def sync_plan(telescope_id, cursor, start, horizon):
+    """
+    Plan synchronization across nights. cursor is None for a full sync, otherwise the (revision, horizon)
+    returned by the previous sync. Delivers the CREATED tasks ending after start (a datetime) and starting
+    before horizon (a julian date): all of them for a full sync, else the ones changed since the revision
+    and the ones the grown horizon has reached. removed lists the changed and the deleted tasks, whose rows
+    the telescope drops before adding the delivered ones.
+    """
+    revision = Telescope.objects.filter(id=telescope_id).values_list('revision', flat=True).first()
+    tasks = Task.objects.filter(telescope_id=telescope_id, status=Task.CREATED, start_jd__lt=horizon, end_dt__gt=start)
+    removed = []
+    if cursor is not None:
+        since, synced_horizon = cursor
+        removed = set(Task.objects.filter(telescope_id=telescope_id, revision__gt=since).values_list('id', flat=True))
+        removed.update(TaskTombstone.objects.filter(telescope_id=telescope_id, revision__gt=since).values_list('task_id', flat=True))
+        removed = sorted(removed)
+        tasks = tasks.filter(Q(revision__gt=since) | Q(start_jd__gte=synced_horizon))
+    points, frames = plan_rows(tasks)
+    return {'cursor': format_cursor(revision, horizon), 'removed': removed, 'points': points, 'frames': frames}
+
+
+def format_cursor(revision, horizon):
+    return f'{revision}:{horizon!r}'
+
+
+def parse_cursor(value):
+    """(revision, horizon) of a cursor, or None if it is malformed."""
+    revision, _, horizon = value.partition(':')
+    try:
+        revision, horizon = int(revision), float(horizon)
+    except ValueError:
+        return None
+    if revision < 0 or not math.isfinite(horizon):
+        return None
+    return revision, horizon
+
+
+@transaction.atomic
+def rebuild_plan(telescope_id, jdn):
+    """
+    Stores the freshly built plan of the telescope for the night and bumps its version. The plan row is locked
+    while it is being built, so concurrent rebuilds write one after another and the last one sees every commit.
+    """
+    TelescopePlan.objects.get_or_create(telescope_id=telescope_id, jdn=jdn)
+    plan = TelescopePlan.objects.select_for_update().get(telescope_id=telescope_id, jdn=jdn)
+    points, frames = build_plan(telescope_id, jdn)
+    delta = plan_delta(plan.points, plan.frames, points, frames)
+    plan.points, plan.frames = points, frames
+    _store_plan(plan, delta)
+    return plan
+
+
+@transaction.atomic
+def update_plan(telescope_id, jdn, task_ids):
+    """
+    Recomputes the rows of the changed tasks only and splices them into the stored plan of the telescope for
+    the night, in the order of build_plan; a plan not stored yet is built whole. The plan row is locked
+    meanwhile, so concurrent updates apply one after another and the last one sees every commit.
+    """
+    plan, created = TelescopePlan.objects.get_or_create(telescope_id=telescope_id, jdn=jdn)
+    if created:
+        return rebuild_plan(telescope_id, jdn)
+    plan = TelescopePlan.objects.select_for_update().get(id=plan.id)
+    points, frames = plan_rows(Task.objects.filter(id__in=task_ids, status=Task.CREATED, telescope_id=telescope_id, jdn=jdn))
+    delta = plan_delta([point for point in plan.points if point['task'] in task_ids],
+                       [frame for frame in plan.frames if frame['task'] in task_ids], points, frames)
+    if not (delta['removed'] or delta['points'] or delta['frames']):
+        return plan
+    rows = {task: group for task, group in _rows_by_task(plan.points, plan.frames).items() if task not in task_ids}
+    rows.update(_rows_by_task(points, frames))
+    starts = dict(Task.objects.filter(id__in=list(rows)).values_list('id', 'start_dt'))
+    order = sorted((task for task in rows if task in starts), key=lambda task: (starts[task], task))
+    plan.points = [point for task in order for point in rows[task][0]]
+    plan.frames = [frame for task in order for frame in rows[task][1]]
+    _store_plan(plan, delta)
+    return plan
+
+
+def _store_plan(plan, delta):
+    plan.version += 1
+    plan.save()
+    TelescopePlanBody.objects.filter(plan=plan).delete()
+    if delta['removed'] or delta['points'] or delta['frames']:
+        message = fastjson.dumps(dict(telescope=plan.telescope_id, jdn=plan.jdn, version=plan.version, **delta)).decode()
+        transaction.on_commit(lambda: publish_plan(plan.telescope_id, message))
+
+
+def publish_plan(telescope_id, message):
+    broker = get_broker()
+    if broker is not None:
+        broker.publish(telescope_channel(telescope_id), message)
+
+
+def plan_delta(old_points, old_frames, new_points, new_frames):
+    """
+    Changes of a plan by task: removed lists the tasks whose rows are to be dropped (cancelled, received
+    or rescheduled ones), points and frames are the rows of the added and rescheduled tasks.
+    """
+    old = _rows_by_task(old_points, old_frames)
+    new = _rows_by_task(new_points, new_frames)
+    removed = sorted(task for task in old if old[task] != new.get(task, None))
+    added = {task for task in new if new[task] != old.get(task, None)}
+    return {
+        'removed': removed,
+        'points': [point for point in new_points if point['task'] in added],
+        'frames': [frame for frame in new_frames if frame['task'] in added],
+    }
+
+
+def _rows_by_task(points, frames):
+    rows = {}
+    for index, items in enumerate((points, frames)):
+        for item in items:
+            rows.setdefault(item['task'], ([], []))[index].append(item)
+    return rows
+
+
+def get_plan(telescope_id, jdn):
+    """
+    The stored plan of the telescope for the night. A night nothing has changed yet has no stored plan, so the
+    first request builds and stores it: reading a plan may write, which is why the rebuild locks the plan row.
+    """
+    plan = TelescopePlan.objects.filter(telescope_id=telescope_id, jdn=jdn).first()
+    if plan is None:
+        plan = rebuild_plan(telescope_id, jdn)
+    return plan
+
+
+def _on_commit_once(name, key, ids, flush):
+    """
+    Collects ids under key until the current transaction commits, then calls flush(key, ids) once for all of them.
+    The ids collected by a transaction or a savepoint that is rolled back are dropped together with its on_commit
+    callback: an entry whose callback is no longer pending on the connection is never flushed.
+    """
+    pending = getattr(_pending, name, None)
+    if pending is None:
+        pending = {}
+        setattr(_pending, name, pending)
+    callbacks = {id(func) for sids, func in transaction.get_connection().run_on_commit}
+    for stale in [stale for stale, entry in pending.items() if id(entry[1]) not in callbacks]:
+        del pending[stale]
+    if key in pending:
+        pending[key][0].update(ids)
+        return
+    collected = set(ids)
+
+    def callback():
+        if pending.get(key, (None, None))[1] is callback:
+            del pending[key]
+        flush(key, collected)
+
+    pending[key] = (collected, callback)
+    transaction.on_commit(callback)
+
+
+def refresh_plan(telescope_id, jdn, task_ids):
+    """
+    Updates the rows of the tasks in the plan of the telescope for the night once the current transaction
+    commits. Any number of changes of one plan within a transaction lead to one update of all their tasks.
+    """
+    if telescope_id is None or jdn is None:
+        return
+    _on_commit_once('plans', (telescope_id, jdn), task_ids, _flush)
+
+
+def _flush(key, task_ids):
+    update_plan(*key, task_ids)
+
+
+def refresh_task_moments(task_id):
+    """
+    Bumps the revision of the task and rebuilds its plan once the current transaction commits, after a change
+    of its points or frames. Any number of changes of the moments of one task within a transaction lead to one.
+    """
+    _on_commit_once('tasks', task_id, (), _flush_task)
+
+
+def _flush_task(task_id, ids):
+    stored = Task.objects.filter(pk=task_id).values_list('telescope_id', 'jdn', 'status').first()
+    if stored is not None and stored[2] == Task.CREATED:
+        with transaction.atomic():
+            Task.objects.filter(pk=task_id).update(revision=Telescope.next_revision(stored[0]))
+        refresh_plan(stored[0], stored[1], [task_id])
+
+
+def touch_plans(telescope_id):
+    """Bumps the versions of the plans of the telescope, whose description is delivered with every plan."""
+    TelescopePlan.objects.filter(telescope_id=telescope_id).update(version=F('version') + 1)
+    TelescopePlanBody.objects.filter(plan__telescope_id=telescope_id).delete()
+
+
+def get_plan_body(plan, etag, coding):
+    """The compressed response body stored for a representation (ETag) of the plan, or None."""
+    return TelescopePlanBody.objects.filter(plan=plan, etag=etag, coding=coding).first()
+
+
+def store_plan_body(plan, etag, coding, content_type, body):
+    TelescopePlanBody.objects.update_or_create(plan=plan, etag=etag, coding=coding,
+                                               defaults={'content_type': content_type, 'body': body})
@@ -0,0 +1,91 @@
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image
+
+from tasks.models import TaskResult
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'thumb': 256, 'preview': 1024}
+
+
+def preview_sizes():
+    """Names of the previews mapped to their largest side in pixels."""
+    return getattr(settings, 'RESULT_PREVIEW_SIZES', DEFAULT_SIZES)
+
+
+def preview_name(digest, size):
+    """The storage name of a preview: images with the same content share their previews."""
+    return f'previews/{digest[:2]}/{digest}-{size}.jpg'
+
+
+def image_digest(image):
+    digest = hashlib.sha256()
+    with image.open('rb'):
+        for chunk in image.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def displayable(picture):
+    """An 8-bit grayscale or RGB copy of the picture; deeper grayscale (16-bit, float) is stretched over its range."""
+    if picture.mode.startswith('I;16'):
+        picture = picture.convert('I')
+    if picture.mode in ('I', 'F'):
+        low, high = picture.getextrema()
+        scale = 255.0 / (high - low) if high > low else 0.0
+        # the expressions of Image.point take the form value * scale + offset only
+        return picture.point(lambda value: value * scale + (-low * scale)).convert('L')
+    if picture.mode not in ('L', 'RGB'):
+        return picture.convert('RGB')
+    return picture
+
+
+def render_preview(picture, size):
+    preview = picture.copy()
+    preview.thumbnail((size, size), Image.LANCZOS)
+    buffer = io.BytesIO()
+    preview.save(buffer, 'JPEG', quality=85, optimize=True)
+    return buffer.getvalue()
+
+
+def build_previews(result_id):
+    """
+    Renders the missing previews of the image of the result and stores their names with the content hash
+    of the image. Previews already stored for the same content are reused; images Pillow cannot read get none.
+    """
+    result = TaskResult.objects.filter(id=result_id).first()
+    if result is None or not result.image:
+        return {}
+    digest = image_digest(result.image)
+    sizes = preview_sizes()
+    names = {name: preview_name(digest, size) for name, size in sizes.items()}
+    missing = {name: size for name, size in sizes.items() if not default_storage.exists(names[name])}
+    if missing:
+        try:
+            with result.image.open('rb'):
+                picture = Image.open(result.image)
+                # JPEG decodes straight to a reduced scale
+                picture.draft('RGB', (max(missing.values()), max(missing.values())))
+                picture.load()
+                picture = displayable(picture)
+        except (OSError, ValueError):
+            logger.warning('Could not read the image of result %s', result_id, exc_info=True)
+            names = {}
+        else:
+            for name, size in missing.items():
+                names[name] = default_storage.save(names[name], ContentFile(render_preview(picture, size)))
+    TaskResult.objects.filter(id=result_id).update(image_hash=digest, previews=names)
+    return names
+
+
+def missing_previews(limit):
+    """Ids of the results with images whose previews are not built yet, e.g. created by bulk inserts."""
+    return list(TaskResult.objects.exclude(image='').exclude(image__isnull=True).filter(image_hash='')
+                .order_by('id').values_list('id', flat=True)[:limit])
@@ -0,0 +1,198 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+from sgp4.api import Satrec, SatrecArray
+
+from tasks import jdtime
+
+
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+TLE = namedtuple('TLE', ('header', 'line1', 'line2', 'number', 'epoch'))
+
+
+class TLEError(ValueError):
+    pass
+
+
+def _checksum(line):
+    total = 0
+    for char in line[:68]:
+        if char.isdigit():
+            total += int(char)
+        elif char == '-':
+            total += 1
+    return total % 10
+
+
+def _check_line(line, number):
+    if len(line) != 69:
+        raise TLEError(f'line {number} of TLE should be 69 characters long')
+    if not line.startswith(f'{number} '):
+        raise TLEError(f'line {number} of TLE should start with "{number} "')
+    if not line[68].isdigit() or int(line[68]) != _checksum(line):
+        raise TLEError(f'line {number} of TLE has wrong checksum')
+
+
+def tle_epoch(line1):
+    """Epoch of the element set from columns 19-32 of the first line (two-digit year, day of year with fraction)."""
+    try:
+        year = int(line1[18:20])
+        day = float(line1[20:32])
+    except ValueError:
+        raise TLEError('line 1 of TLE has wrong epoch')
+    year += 2000 if year < 57 else 1900
+    return datetime(year, 1, 1, tzinfo=pytz.UTC) + timedelta(days=day - 1)
+
+
+def _parse_element(header, line1, line2):
+    _check_line(line1, 1)
+    _check_line(line2, 2)
+    if line1[2:7] != line2[2:7]:
+        raise TLEError('lines of TLE belong to different satellites')
+    try:
+        number = int(line1[2:7])
+    except ValueError:
+        raise TLEError('TLE has wrong satellite number')
+    return TLE(header, line1, line2, number, tle_epoch(line1))
+
+
+def iter_tle(lines):
+    """
+    Yields (index, TLE or TLEError) for the element sets of an iterable of lines, two- or three-line
+    form, so a catalog file can be read line by line and its broken entries skipped.
+    """
+    header = None
+    first = None
+    index = 0
+    for line in lines:
+        line = line.rstrip('\r\n').rstrip()
+        if not line.strip():
+            continue
+        if first is not None:
+            try:
+                yield index, _parse_element(header, first, line)
+            except TLEError as e:
+                yield index, e
+            index += 1
+            header = first = None
+        elif header is not None or line.startswith('1 '):
+            first = line
+        else:
+            header = line.strip()
+            if header.startswith('0 '):
+                header = header[2:].strip()
+    if first is not None or header is not None:
+        yield index, TLEError('TLE is incomplete')
+
+
+def parse_tle(text):
+    """Parses two- or three-line element sets; returns a list of TLE tuples."""
+    elements = []
+    for index, element in iter_tle(text.replace('\r', '').split('\n')):
+        if isinstance(element, TLEError):
+            raise element
+        elements.append(element)
+    if not elements:
+        raise TLEError('TLE is empty')
+    return elements
+
+
+def satrecs(elements):
+    return [Satrec.twoline2rv(element.line1, element.line2) for element in elements]
+
+
+def gmst(jd, fr):
+    """Greenwich mean sidereal time (IAU 1982) in radians; UT1 is taken equal to UTC."""
+    t = ((jd - 2451545.0) + fr) / 36525.0
+    seconds = 67310.54841 + (876600.0 * 3600.0 + 8640184.812866) * t + 0.093104 * t ** 2 - 6.2e-6 * t ** 3
+    return np.radians(np.mod(seconds, 86400.0) / 240.0)
+
+
+def observer_ecef(latitude, longitude, altitude):
+    """Geodetic WGS84 position (degrees, degrees, metres) to ECEF kilometres."""
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    h = altitude / 1000.0
+    n = WGS84_A / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+    return np.array([
+        (n + h) * np.cos(lat) * np.cos(lon),
+        (n + h) * np.cos(lat) * np.sin(lon),
+        (n * (1 - WGS84_E2) + h) * np.sin(lat),
+    ])
+
+
+def teme_to_topocentric(r, jd, fr, latitude, longitude, altitude):
+    """Converts TEME positions r[..., 3] at moments jd + fr to azimuth and elevation in degrees."""
+    theta = gmst(jd, fr)
+    cos_t, sin_t = np.cos(theta), np.sin(theta)
+    # TEME -> pseudo Earth fixed frame (polar motion is neglected)
+    x = r[..., 0] * cos_t + r[..., 1] * sin_t
+    y = -r[..., 0] * sin_t + r[..., 1] * cos_t
+    z = r[..., 2]
+    ox, oy, oz = observer_ecef(latitude, longitude, altitude)
+    dx, dy, dz = x - ox, y - oy, z - oz
+    lat = np.radians(latitude)
+    lon = np.radians(longitude)
+    east = -np.sin(lon) * dx + np.cos(lon) * dy
+    north = -np.sin(lat) * np.cos(lon) * dx - np.sin(lat) * np.sin(lon) * dy + np.cos(lat) * dz
+    up = np.cos(lat) * np.cos(lon) * dx + np.cos(lat) * np.sin(lon) * dy + np.sin(lat) * dz
+    distance = np.sqrt(dx ** 2 + dy ** 2 + dz ** 2)
+    azimuth = np.mod(np.degrees(np.arctan2(east, north)), 360.0)
+    elevation = np.degrees(np.arcsin(up / distance))
+    return azimuth, elevation
+
+
+def topocentric_jd(satellites, jd, fr, latitude, longitude, altitude):
+    """
+    Propagates all satellites over all moments jd + fr at once and returns azimuth and elevation
+    in degrees as arrays of shape (satellites, moments). Failed propagations are NaN.
+    """
+    errors, r, v = SatrecArray(satellites).sgp4(jd, fr)
+    azimuth, elevation = teme_to_topocentric(r, jd, fr, latitude, longitude, altitude)
+    failed = errors != 0
+    azimuth[failed] = np.nan
+    elevation[failed] = np.nan
+    return azimuth, elevation
+
+
+def topocentric(satellites, dt64, latitude, longitude, altitude):
+    jd, fr = jdtime.to_jd_fr(dt64)
+    return topocentric_jd(satellites, jd, fr, latitude, longitude, altitude)
+
+
+def topocentric_pairs(satellites, indexes, jd, fr, latitude, longitude, altitude):
+    """
+    Like topocentric_jd, but for pairs: satellite satellites[indexes[i]] at moment jd[i] + fr[i].
+    Returns one-dimensional arrays of azimuth and elevation.
+    """
+    r = np.empty((len(indexes), 3))
+    errors = np.zeros(len(indexes), dtype=np.int64)
+    order = np.argsort(indexes, kind='stable')
+    bounds = np.flatnonzero(np.diff(indexes[order])) + 1
+    for rows in np.split(order, bounds):
+        if len(rows) > 0:
+            errors[rows], r[rows], v = satellites[indexes[rows[0]]].sgp4_array(jd[rows], fr[rows])
+    azimuth, elevation = teme_to_topocentric(r, jd, fr, latitude, longitude, altitude)
+    failed = errors != 0
+    azimuth[failed] = np.nan
+    elevation[failed] = np.nan
+    return azimuth, elevation
+
+
+def track(element, telescope, start, end, step):
+    """
+    Samples the topocentric track of one satellite for the telescope every step seconds of [start, end]
+    and keeps the moments when the satellite is above the horizon. Returns (dt, azimuth, elevation).
+    """
+    step_us = int(round(step * 1000000))
+    start = np.datetime64(start.replace(tzinfo=None), 'us')
+    end = np.datetime64(end.replace(tzinfo=None), 'us')
+    dt64 = np.arange(start, end + np.timedelta64(1, 'us'), np.timedelta64(step_us, 'us'))
+    azimuth, elevation = topocentric(satrecs([element]), dt64, telescope.latitude, telescope.longitude, telescope.altitude)
+    visible = elevation[0] >= 0.0
+    return dt64[visible], azimuth[0][visible], elevation[0][visible]
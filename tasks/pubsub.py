@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+class MemoryBroker:
+    """
+    Publish/subscribe within one process, selected by the memory:// URL: only for a development server that
+    runs the web application and the push channel in one process, as plans rebuilt by Celery workers or other
+    web processes never reach it. Messages published from other threads are handed to the event loop of every
+    subscriber; RedisBroker hands the messages it receives to the subscribers of its process the same way.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.loop.call_soon_threadsafe(subscription.queue.put_nowait, message)
+
+    def subscribe(self, channel):
+        subscription = MemorySubscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.channel, None)
+
+
+class MemorySubscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue()
+
+    async def get(self, timeout):
+        """The next message, or None if nothing was published within timeout seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class RedisBroker(MemoryBroker):
+    """
+    Publish/subscribe through Redis, so changes committed by any process (e.g. Celery workers) reach the telescopes.
+    One listener thread per process receives the messages of all telescope channels and hands them to the local
+    subscribers, so the number of connected telescopes costs no threads or Redis connections.
+    """
+    pattern = 'telescope.*'
+    retry_interval = 1.0
+
+    def __init__(self, url):
+        import redis
+        super().__init__()
+        self.client = redis.Redis.from_url(url)
+        self.errors = (redis.RedisError,)
+        self._listener = None
+
+    def publish(self, channel, message):
+        try:
+            self.client.publish(channel, message)
+        except self.errors:
+            # telescopes still get the changes by polling
+            logger.exception('Could not publish to %s', channel)
+
+    def subscribe(self, channel):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='plan-push-listener', daemon=True)
+                self._listener.start()
+        return super().subscribe(channel)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.pattern)
+                for message in pubsub.listen():
+                    channel, data = message['channel'], message['data']
+                    MemoryBroker.publish(self, channel.decode() if isinstance(channel, bytes) else channel,
+                                         data.decode() if isinstance(data, bytes) else data)
+            except self.errors:
+                logger.exception('Lost the subscription to %s', self.pattern)
+                time.sleep(self.retry_interval)
+
+
+def get_broker():
+    """
+    The broker of PLAN_PUSH_BROKER_URL: a redis:// URL, or memory:// for a single process server.
+    None when it is not set: plan changes are not pushed then, and telescopes get them by polling only.
+    """
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            url = getattr(settings, 'PLAN_PUSH_BROKER_URL', None)
+            if not url:
+                logger.error('PLAN_PUSH_BROKER_URL is not set: plan changes are not pushed to telescopes')
+                _broker = False
+            elif url.startswith('memory:'):
+                _broker = MemoryBroker()
+            else:
+                _broker = RedisBroker(url)
+        return _broker or None
+
+
+def telescope_channel(telescope_id):
+    return f'telescope.{telescope_id}.plan'
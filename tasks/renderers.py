@@ -0,0 +1,68 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from tasks import fastjson, planformat
+
+
+def is_plan_list(data):
+    return isinstance(data, list) and all(isinstance(item, dict) and 'points' in item and 'frames' in item for item in data)
+
+
+def columnar_plan(plan):
+    plan = dict(plan)
+    for name, layout in planformat.PLAN_TABLES:
+        plan[name] = planformat.rows_to_columns(plan[name], layout)
+    return plan
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSON renderer on orjson when it is installed (see tasks.fastjson): datetimes and NumPy arrays are encoded
+    natively instead of value by value in Python. Indented output (the browsable API) takes the usual way,
+    with the encoder of fastjson, so both render the same values.
+    """
+    encoder_class = fastjson.JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if fastjson.orjson is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return fastjson.dumps(data)
+
+
+class PlanColumnsJSONRenderer(FastJSONRenderer):
+    """
+    Renders telescope plans with the points and frames as one array per field
+    (see planformat.PLAN_TABLES) instead of one object per row.
+    """
+    media_type = planformat.COLUMNS_JSON_MEDIA_TYPE
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if is_plan_list(data):
+            data = [columnar_plan(plan) for plan in data]
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+class PlanColumnsRenderer(BaseRenderer):
+    """
+    Renders a telescope plan in the binary columnar format (see planformat.encode_columns):
+    the rest of the plan goes to the metadata. Anything else, e.g. errors, is rendered as JSON.
+    """
+    media_type = planformat.COLUMNS_MEDIA_TYPE
+    format = 'plan'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if not (is_plan_list(data) and len(data) == 1):
+            response = (renderer_context or {}).get('response', None)
+            if response is not None:
+                response['Content-Type'] = 'application/json'
+            return FastJSONRenderer().render(data, renderer_context=renderer_context)
+        plan = data[0]
+        meta = {key: value for key, value in plan.items() if key not in ('points', 'frames')}
+        tables = {name: (layout, planformat.rows_to_columns(plan[name], layout)) for name, layout in planformat.PLAN_TABLES}
+        return planformat.encode_columns(meta, tables)
@@ -0,0 +1,147 @@
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from tasks.models import Telescope, Task, Balance
+from tasks.plans import refresh_plan
+
+
+def weighted_interval_schedule(starts, ends, weights):
+    """
+    Chooses non-overlapping intervals [start, end) of the maximal total weight.
+    Classic O(n log n) dynamic programming over the intervals sorted by end; intervals touching
+    at one moment do not overlap. Returns a boolean mask of the chosen intervals.
+    """
+    size = len(starts)
+    chosen = np.zeros(size, dtype=bool)
+    if size == 0:
+        return chosen
+    order = np.lexsort((starts, ends))
+    starts = np.asarray(starts)[order]
+    ends = np.asarray(ends)[order]
+    weights = np.asarray(weights, dtype=np.float64)[order]
+    # index (in the sorted order) of the last interval ending not later than each interval starts
+    previous = (np.searchsorted(ends, starts, side='right') - 1).tolist()
+    weights_list = weights.tolist()
+    best = [0.0] * (size + 1)
+    for index in range(size):
+        with_it = weights_list[index] + best[previous[index] + 1]
+        best[index + 1] = with_it if with_it > best[index] else best[index]
+    index = size - 1
+    while index >= 0:
+        if weights_list[index] + best[previous[index] + 1] > best[index]:
+            chosen[order[index]] = True
+            index = previous[index]
+        else:
+            index -= 1
+    return chosen
+
+
+class NightScheduler:
+    """
+    Builds the conflict-free plan of one telescope for one night (jdn) out of its CREATED tasks.
+    Tasks already RECEIVED by the telescope are kept as they are; the candidates are weighted
+    by duration and priority, and the time scheduled for every author with a Balance on the
+    telescope is limited by it. Candidates left out of the plan become DEFERRED.
+    """
+
+    def __init__(self, telescope, jdn, enforce_balance=None):
+        self.telescope = telescope
+        self.jdn = jdn
+        if enforce_balance is None:
+            enforce_balance = getattr(settings, 'SCHEDULER_ENFORCE_BALANCE', True)
+        self.enforce_balance = enforce_balance
+
+    def load(self):
+        rows = list(Task.objects.filter(
+            telescope=self.telescope, jdn=self.jdn, status__in=[Task.CREATED, Task.RECEIVED],
+            start_dt__isnull=False, end_dt__isnull=False,
+        ).values_list('id', 'author_id', 'status', 'start_dt', 'end_dt', 'priority'))
+        ids, authors, statuses, start_dts, end_dts, priorities = zip(*rows) if rows else ((),) * 6
+        self.ids = np.array(ids, dtype=np.int64)
+        self.authors = np.array(authors, dtype=np.int64)
+        self.fixed = np.array(statuses, dtype=np.int64) == Task.RECEIVED
+        self.starts = np.array([dt.timestamp() for dt in start_dts], dtype=np.float64)
+        self.ends = np.array([dt.timestamp() for dt in end_dts], dtype=np.float64)
+        self.priorities = np.array(priorities, dtype=np.float64)
+        self.minutes = (self.ends - self.starts) / 60.0
+        self.balances = dict(Balance.objects.filter(telescope=self.telescope).values_list('user_id', 'minutes'))
+
+    def plan(self):
+        """Returns the boolean mask of the scheduled tasks among the loaded ones."""
+        candidates = ~self.fixed & ~self._overlaps_fixed()
+        budgets = self._budgets()
+        weights = self.minutes * (self.priorities + 1)
+        while True:
+            indexes = np.flatnonzero(candidates)
+            chosen = indexes[weighted_interval_schedule(self.starts[indexes], self.ends[indexes], weights[indexes])]
+            excess = self._excess(chosen, budgets)
+            if not excess:
+                break
+            for author, minutes in excess.items():
+                own = chosen[self.authors[chosen] == author]
+                # the lowest priority goes first, and of equal priorities the longest frees the most time
+                for index in own[np.lexsort((-self.minutes[own], self.priorities[own]))]:
+                    candidates[index] = False
+                    minutes -= self.minutes[index]
+                    if minutes <= 0:
+                        break
+        scheduled = self.fixed.copy()
+        scheduled[chosen] = True
+        return scheduled
+
+    @transaction.atomic
+    def run(self):
+        self.load()
+        scheduled = self.plan()
+        deferred = self.ids[~scheduled & ~self.fixed].tolist()
+        if deferred:
+            Task.objects.filter(id__in=deferred, status=Task.CREATED).update(
+                status=Task.DEFERRED, revision=Telescope.next_revision(self.telescope.id)
+            )
+            # update() sends no signals
+            refresh_plan(self.telescope.id, self.jdn, deferred)
+        return {
+            'telescope': self.telescope.id,
+            'jdn': self.jdn,
+            'scheduled': self.ids[scheduled].tolist(),
+            'deferred': deferred,
+        }
+
+    def _overlaps_fixed(self):
+        overlaps = np.zeros(len(self.ids), dtype=bool)
+        fixed = np.flatnonzero(self.fixed)
+        if not len(fixed) > 0:
+            return overlaps
+        order = fixed[np.argsort(self.starts[fixed])]
+        fixed_starts = self.starts[order]
+        # running maximum of the ends: fixed tasks never overlap each other, but stay safe if they do
+        fixed_ends = np.maximum.accumulate(self.ends[order])
+        before = np.searchsorted(fixed_starts, self.ends, side='left') - 1
+        overlaps = (before >= 0) & (fixed_ends[np.maximum(before, 0)] > self.starts)
+        return overlaps
+
+    def _budgets(self):
+        """
+        Minutes left after the fixed tasks to every author with a Balance on the telescope; unlimited when
+        balances are not enforced, and for the authors without a Balance row.
+        """
+        if not self.enforce_balance:
+            return None
+        budgets = {}
+        for author in np.unique(self.authors).tolist():
+            if author in self.balances:
+                budgets[author] = self.balances[author] - self.minutes[self.fixed & (self.authors == author)].sum()
+        return budgets
+
+    def _excess(self, chosen, budgets):
+        if budgets is None:
+            return {}
+        excess = {}
+        used = {}
+        for author, minutes in zip(self.authors[chosen].tolist(), self.minutes[chosen].tolist()):
+            used[author] = used.get(author, 0.0) + minutes
+        for author, minutes in used.items():
+            if author in budgets and minutes > budgets[author] + 1e-9:
+                excess[author] = minutes - budgets[author]
+        return excess
@@ -1,13 +1,40 @@
-import json
 import locale
+import os
+import re
 from datetime import datetime
 
 import pytz
+from django.db import IntegrityError, transaction
 from django.db.models import Q, QuerySet
+from django.conf import settings
+from django.core.files.storage import default_storage
 from rest_framework import serializers
 from telescope.settings import SITE_URL, MEDIA_URL
-from tasks.models import Telescope, Satellite, InputData, Point, Task, Frame, TLEData, BalanceRequest, TaskResult
+from tasks.models import Telescope, Satellite, InputData, Point, Task, Frame, TLEData, BalanceRequest, TaskResult, \
+    IngestionJob, ResultUpload
+from tasks import directupload, fastjson
+from tasks.uploads import UploadError
 from tasks.helpers import converting_degrees, is_float, is_int
+from tasks.tasks import queue_previews
+from tasks.validators import validate_point_rows, validate_frame_rows
+
+
+class JSONDataField(serializers.JSONField):
+    """
+    JSON data given as a string (form fields) or already parsed with the request body: strings are decoded
+    by fastjson, parsed data is taken as it is instead of being encoded once more to be checked.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, (str, bytes)):
+            try:
+                return fastjson.loads(data)
+            except fastjson.JSONDecodeError:
+                self.fail('invalid')
+        return data
+
+    def to_representation(self, value):
+        return value
 
 
 class TelescopeSerializer(serializers.ModelSerializer):
@@ -60,10 +87,8 @@ class SatelliteSerializer(serializers.ModelSerializer):
 class PointSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
-        errors = {}
-        errors.update(Point.validate_point(data, data.get('cs_type', None)))
-        errors.update(Point.validate_moment(data, datetime.now(tz=pytz.UTC)))
-        errors.update(Point.validate(data))
+        now = self.context.get('now', None) or datetime.now(tz=pytz.UTC)
+        errors = validate_point_rows([data], now).get(0, {})
         if len(errors) > 0:
             raise serializers.ValidationError(errors)
         return data
@@ -76,10 +101,8 @@ class PointSerializer(serializers.ModelSerializer):
 class FrameSerializer(serializers.ModelSerializer):
 
     def validate(self, data):
-        errors = {}
-        errors.update(Frame.validate_frame(data))
-        errors.update(Frame.validate_moment(data, datetime.now(tz=pytz.UTC)))
-        errors.update(Frame.validate(data))
+        now = self.context.get('now', None) or datetime.now(tz=pytz.UTC)
+        errors = validate_frame_rows([data], now).get(0, {})
         if len(errors) > 0:
             raise serializers.ValidationError(errors)
         return data
@@ -90,6 +113,7 @@ class FrameSerializer(serializers.ModelSerializer):
 
 
 class InputDataSerializer(serializers.ModelSerializer):
+    data_json = JSONDataField(label='Данные в формате JSON', required=False, allow_null=True)
 
     def save(self):
         data_type = InputData.NONE
@@ -97,10 +121,6 @@ class InputDataSerializer(serializers.ModelSerializer):
             data_type = InputData.TLE
         if self.validated_data.get('data_json') is not None:
             data_type = InputData.JSON
-            data_json = self.validated_data.get('data_json')
-            if isinstance(data_json, str):
-                data_json = json.loads(data_json)
-                self.validated_data.update(data_json=data_json)
         data = super().save(data_type=data_type)
         return data
 
@@ -109,6 +129,57 @@ class InputDataSerializer(serializers.ModelSerializer):
         fields = ('id', 'task', 'data_type', 'data_tle', 'data_json')
 
 
+class IngestionJobSerializer(serializers.ModelSerializer):
+    status = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+
+    def get_status(self, obj):
+        return obj.get_status_display()
+
+    def get_progress(self, obj):
+        if obj.status == IngestionJob.DONE:
+            return 1.0
+        return obj.processed / obj.total if obj.total > 0 else 0.0
+
+    class Meta:
+        model = IngestionJob
+        fields = ('task', 'status', 'total', 'processed', 'progress', 'errors', 'created_at', 'updated_at')
+
+
+class TLETrackSerializer(serializers.Serializer):
+    start_dt = serializers.DateTimeField()
+    end_dt = serializers.DateTimeField()
+    step = serializers.FloatField(min_value=0.001, default=lambda: getattr(settings, 'TLE_PROPAGATION_STEP', 1.0))
+    exposure = serializers.FloatField()
+    mag = serializers.FloatField(default=0.0)
+
+    def validate(self, data):
+        duration = (data['end_dt'] - data['start_dt']).total_seconds()
+        if not duration > 0:
+            raise serializers.ValidationError({"end_dt": "end_dt is not after start_dt"})
+        if duration > getattr(settings, 'TLE_PROPAGATION_MAX_DURATION', 86400):
+            raise serializers.ValidationError({"end_dt": "time window is too long"})
+        if not data['exposure'] > 0.0:
+            raise serializers.ValidationError({"exposure": "exposure is not positive"})
+        return data
+
+
+class PassPredictionSerializer(serializers.Serializer):
+    telescope = serializers.PrimaryKeyRelatedField(queryset=Telescope.objects.filter(enabled=True))
+    start_dt = serializers.DateTimeField()
+    end_dt = serializers.DateTimeField()
+    satellites = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    min_elevation = serializers.FloatField(min_value=0.0, max_value=90.0, default=0.0)
+
+    def validate(self, data):
+        duration = (data['end_dt'] - data['start_dt']).total_seconds()
+        if not duration > 0:
+            raise serializers.ValidationError({"end_dt": "end_dt is not after start_dt"})
+        if duration > getattr(settings, 'PASS_PREDICTION_MAX_DURATION', 86400):
+            raise serializers.ValidationError({"end_dt": "time window is too long"})
+        return data
+
+
 class TleDataSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -156,12 +227,20 @@ class BalanceRequestCreateSerializer(serializers.ModelSerializer):
 class TaskSerializer(serializers.ModelSerializer):
     url = serializers.SerializerMethodField()
     data_tle = serializers.CharField(label='Данные в формате TLE', required=False, allow_blank=True, default='', max_length=165)
-    data_json = serializers.JSONField(label='Данные в формате JSON', required=False, allow_null=True, default=None, binary=True)
+    data_json = JSONDataField(label='Данные в формате JSON', required=False, allow_null=True, default=None)
 
     def get_url(self, obj):
         if obj.status == Task.READY:
             return f'{obj.id}/results/'
 
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request', None)
+        if request is None or not request.user.is_staff:
+            # the scheduler weighs tasks by priority, so only staff set it
+            fields['priority'].read_only = True
+        return fields
+
     def validate_enabled(self, enabled):
         if not enabled:
             raise serializers.ValidationError({"telescope": "telescope should be enabled"})
@@ -186,7 +265,7 @@ class TaskSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Task
-        fields = ('id', 'status', 'author', 'created_at', 'telescope', "satellite", 'task_type', 'start_dt', 'end_dt', 'jdn', 'start_jd', 'end_jd', 'url', 'data_tle', 'data_json')
+        fields = ('id', 'status', 'author', 'created_at', 'telescope', "satellite", 'task_type', 'start_dt', 'end_dt', 'jdn', 'start_jd', 'end_jd', 'priority', 'url', 'data_tle', 'data_json')
 
 
 class TelescopeTaskSerializer(serializers.Serializer):
@@ -194,6 +273,9 @@ class TelescopeTaskSerializer(serializers.Serializer):
     telescope = serializers.DictField()
     points = serializers.ListField()
     frames = serializers.ListField()
+    slew = serializers.DictField(required=False)
+    cursor = serializers.CharField(required=False)
+    removed = serializers.ListField(required=False)
 
     def update(self, instance, validated_data):
         return instance
@@ -202,7 +284,7 @@ class TelescopeTaskSerializer(serializers.Serializer):
         return None
 
     class Meta:
-        fields = ('jdn', 'telescope', 'points', 'frames')
+        fields = ('jdn', 'telescope', 'points', 'frames', 'slew', 'cursor', 'removed')
 
 
 class TaskResultSerializer(serializers.ModelSerializer):
@@ -245,10 +327,17 @@ class TaskResultSerializer(serializers.ModelSerializer):
         }
 
     def get_results(self, obj):
-        results = []
-        for result in TaskResult.objects.filter(task=obj):
+        return list(self.iter_results(obj))
+
+    def get_previews(self, result):
+        """URLs of the previews of the image by name (see RESULT_PREVIEW_SIZES), empty until they are built."""
+        return {name: f'{SITE_URL}/{default_storage.url(path).lstrip("/")}' for name, path in result.previews.items()}
+
+    def iter_results(self, obj):
+        results = TaskResult.objects.filter(task=obj).select_related('point', 'frame').order_by('id')
+        for result in results.iterator(chunk_size=2000):
             if obj.task_type == Task.POINTS_MODE:
-                results.append({
+                yield {
                     'satellite': obj.satellite_id,
                     'mag': result.frame.mag,
                     'dt': result.point.dt.strftime('%Y-%m-%d %H:%M'),
@@ -256,14 +345,15 @@ class TaskResultSerializer(serializers.ModelSerializer):
                     'beta': result.point.beta,
                     'exposure': result.frame.exposure,
                     'url': f'{SITE_URL}/{result.image.url if result.image else None}',
-                })
+                    'previews': self.get_previews(result),
+                }
             else:
-                results.append({
+                yield {
                     'exposure': result.frame.exposure,
                     'dt': result.frame.dt.strftime('%Y-%m-%d %H:%M'),
                     'url': f'{SITE_URL}{result.image.url}',
-                })
-        return results
+                    'previews': self.get_previews(result),
+                }
 
     class Meta:
         model = Task
@@ -394,3 +484,265 @@ class ResultSerializer(serializers.ModelSerializer):
     class Meta:
         model = TaskResult
         fields = ('task', 'point', 'frame', 'image')
+
+
+def check_result_targets(task_id, user, entries):
+    """
+    The task if it is received by the telescope of the user (else None), and the errors of the entries
+    ({"frame": id, "point": id or null}) by index: frames and points of other tasks or already with results.
+    The task, the frames and the points of all entries are checked by one query each.
+    """
+    task = Task.objects.filter(id=task_id, telescope__user=user, status=Task.RECEIVED).first()
+    if task is None:
+        return None, {}
+    # ids of the task mapped to the ids of their stored results, if any
+    frames = dict(Frame.objects.filter(task_id=task_id, id__in=[entry['frame'] for entry in entries])
+                  .values_list('id', 'result'))
+    point_ids = [entry['point'] for entry in entries if entry.get('point', None) is not None]
+    points = dict(Point.objects.filter(task_id=task_id, id__in=point_ids).values_list('id', 'result')) \
+        if point_ids else {}
+    errors = {}
+    for index, entry in enumerate(entries):
+        error = {}
+        frame, point = entry['frame'], entry.get('point', None)
+        if frame not in frames:
+            error['frame'] = 'frame.task.id != task_id'
+        elif frames[frame] is not None:
+            error['frame'] = 'frame already has a result'
+        if point is not None and point not in points:
+            error['point'] = 'point.task.id != task_id'
+        elif point is not None and points[point] is not None:
+            error['point'] = 'point already has a result'
+        if error:
+            errors[index] = error
+    return task, errors
+
+
+def bulk_create_results(results):
+    """Inserts the results RESULT_BATCH_SIZE rows at a time and queues the previews of their images."""
+    results = TaskResult.objects.bulk_create(results, batch_size=getattr(settings, 'RESULT_BATCH_SIZE', 1000))
+    # ids are known on PostgreSQL; elsewhere the previews are left to build_missing_previews
+    queue_previews(result.id for result in results if result.id is not None and result.image)
+    return results
+
+
+def check_result_entries(results, check_entry=None):
+    """
+    Checks that results is a non-empty list of {"frame": id, "point": id or null, ...} not repeating frames or points;
+    check_entry(entry) returns the errors of the other members of an entry. Raises the errors by index.
+    """
+    if not isinstance(results, list) or not results:
+        raise serializers.ValidationError('results is not a non-empty list')
+    errors = {}
+    frames, points = set(), set()
+    for index, entry in enumerate(results):
+        if not isinstance(entry, dict):
+            errors[index] = 'result is not dict'
+            continue
+        error = {}
+        frame, point = entry.get('frame', None), entry.get('point', None)
+        if type(frame) is not int:
+            error['frame'] = 'frame is not int'
+        elif frame in frames:
+            error['frame'] = 'frame is repeated'
+        if point is not None and type(point) is not int:
+            error['point'] = 'point is not int'
+        elif point is not None and point in points:
+            error['point'] = 'point is repeated'
+        if not error and check_entry is not None:
+            error = check_entry(entry)
+        if error:
+            errors[index] = error
+            continue
+        frames.add(frame)
+        if point is not None:
+            points.add(point)
+    if errors:
+        raise serializers.ValidationError(errors)
+    return results
+
+
+class ResultBatchSerializer(serializers.Serializer):
+    """
+    A batch of results of one task: results lists {"frame": id, "point": id or null, "image": name of a file part
+    of the request}. The task, the frames and the points of the whole batch are checked by one query each.
+    save raises UploadError (409) if results of the frames or points are stored meanwhile, leaving the errors
+    of the conflicting entries by index in conflicts.
+    """
+    results = JSONDataField()
+
+    def validate_results(self, results):
+        files = self.context['request'].FILES
+        images = set()
+
+        def check_image(entry):
+            image = entry.get('image', None)
+            if image is not None and (not isinstance(image, str) or image not in files):
+                return {'image': 'image is not a file of the request'}
+            if image is not None and image in images:
+                return {'image': 'image is repeated'}
+            if image is not None:
+                images.add(image)
+            return {}
+
+        return check_result_entries(results, check_image)
+
+    def validate(self, data):
+        task, errors = check_result_targets(self.context['task_id'], self.context['request'].user, data['results'])
+        if task is None:
+            raise serializers.ValidationError({'task': 'task is not received by the telescope of the user'})
+        if errors:
+            raise serializers.ValidationError({'results': errors})
+        data['task'] = task
+        return data
+
+    def save(self):
+        task = self.validated_data['task']
+        files = self.context['request'].FILES
+        results = []
+        try:
+            for entry in self.validated_data['results']:
+                result = TaskResult(task=task, frame_id=entry['frame'], point_id=entry.get('point', None))
+                results.append(result)
+                image = entry.get('image', None)
+                if image is not None:
+                    # streamed from the uploaded file to the storage chunk by chunk
+                    result.image.save(files[image].name, files[image], save=False)
+            with transaction.atomic():
+                return bulk_create_results(results)
+        except Exception as error:
+            # nothing of the batch is stored, so neither are its images
+            for result in results:
+                if result.image:
+                    result.image.delete(save=False)
+            if not isinstance(error, IntegrityError):
+                raise
+        # a concurrent request stored results of the same frames or points after the validation
+        self.conflicts = check_result_targets(task.id, self.context['request'].user, self.validated_data['results'])[1]
+        raise UploadError('frame or point already has a result', status=409)
+
+
+class ResultUploadSerializer(serializers.ModelSerializer):
+    """A resumable upload of the image of a result, see tasks.uploads; checksum is the SHA-256 of the whole file in hex."""
+    frame = serializers.IntegerField(source='frame_id')
+    point = serializers.IntegerField(source='point_id', required=False, allow_null=True, default=None)
+    status = serializers.SerializerMethodField()
+    url = serializers.SerializerMethodField()
+
+    def get_status(self, obj):
+        return obj.get_status_display()
+
+    def get_url(self, obj):
+        return f'uploads/{obj.id}/'
+
+    def validate_name(self, name):
+        name = os.path.basename(name)
+        if not name:
+            raise serializers.ValidationError('name is empty')
+        return name
+
+    def validate_size(self, size):
+        if not 0 < size <= getattr(settings, 'RESULT_UPLOAD_MAX_SIZE', 1024 ** 3):
+            raise serializers.ValidationError('size is not in (0..RESULT_UPLOAD_MAX_SIZE]')
+        return size
+
+    def validate_checksum(self, checksum):
+        checksum = checksum.lower()
+        if checksum and not re.fullmatch('[0-9a-f]{64}', checksum):
+            raise serializers.ValidationError('checksum is not SHA-256 in hex')
+        return checksum
+
+    def validate(self, data):
+        entry = {'frame': data['frame_id'], 'point': data.get('point_id', None)}
+        task, errors = check_result_targets(self.context['task_id'], self.context['request'].user, [entry])
+        if task is None:
+            raise serializers.ValidationError({'task': 'task is not received by the telescope of the user'})
+        if errors:
+            raise serializers.ValidationError(errors[0])
+        data['task'] = task
+        return data
+
+    class Meta:
+        model = ResultUpload
+        fields = ('id', 'frame', 'point', 'name', 'size', 'checksum', 'offset', 'status', 'result', 'url')
+        read_only_fields = ('offset', 'result')
+
+
+class UploadURLSerializer(serializers.Serializer):
+    """
+    Requests signed upload URLs for the images of results of one task: results lists
+    {"frame": id, "point": id or null, "name": file name}, checked as in ResultBatchSerializer.
+    """
+    results = JSONDataField()
+
+    def validate_results(self, results):
+        def check_name(entry):
+            if not isinstance(entry.get('name', None), str) or not entry['name']:
+                return {'name': 'name is not a non-empty string'}
+            return {}
+
+        return check_result_entries(results, check_name)
+
+    def validate(self, data):
+        task, errors = check_result_targets(self.context['task_id'], self.context['request'].user, data['results'])
+        if task is None:
+            raise serializers.ValidationError({'task': 'task is not received by the telescope of the user'})
+        if errors:
+            raise serializers.ValidationError({'results': errors})
+        return data
+
+    def get_uploads(self):
+        """An upload URL and a confirmation token for every result."""
+        request = self.context['request']
+        backend = directupload.get_backend()
+        uploads = []
+        for entry in self.validated_data['results']:
+            key = directupload.image_key(self.context['task_id'], entry['frame'], entry['name'])
+            token = directupload.make_token(self.context['task_id'], entry['frame'], entry.get('point', None), key)
+            uploads.append({
+                'frame': entry['frame'],
+                'point': entry.get('point', None),
+                'method': 'PUT',
+                'url': backend.upload_url(request, key, token),
+                'token': token,
+            })
+        return uploads
+
+
+class UploadConfirmSerializer(serializers.Serializer):
+    """Confirms images uploaded to the signed URLs by their tokens, creating their results."""
+    tokens = serializers.ListField(child=serializers.CharField(), allow_empty=False)
+
+    def validate_tokens(self, tokens):
+        entries = []
+        errors = {}
+        for index, token in enumerate(tokens):
+            entry = directupload.load_token(token, directupload.token_max_age())
+            if entry is None or entry['task'] != self.context['task_id']:
+                errors[index] = 'token is not valid for the task'
+            entries.append(entry)
+        if errors:
+            raise serializers.ValidationError(errors)
+        return check_result_entries(entries)
+
+    def validate(self, data):
+        entries = data['tokens']
+        task, errors = check_result_targets(self.context['task_id'], self.context['request'].user, entries)
+        if task is None:
+            raise serializers.ValidationError({'task': 'task is not received by the telescope of the user'})
+        backend = directupload.get_backend()
+        for index, entry in enumerate(entries):
+            if index not in errors and not backend.size(entry['key']):
+                errors[index] = {'image': 'image is not uploaded'}
+        if errors:
+            raise serializers.ValidationError({'tokens': errors})
+        data['task'] = task
+        return data
+
+    def save(self):
+        task = self.validated_data['task']
+        results = [
+            TaskResult(task=task, frame_id=entry['frame'], point_id=entry['point'], image=entry['key'])
+            for entry in self.validated_data['tokens']
+        ]
+        return bulk_create_results(results)
@@ -0,0 +1,60 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from tasks.models import Telescope, Task, TaskTombstone, Point, Frame, TaskResult
+from tasks.plans import refresh_plan, refresh_task_moments, touch_plans
+from tasks.tasks import queue_previews
+
+
+@receiver(post_save, sender=Task)
+def refresh_task_plans(sender, instance, **kwargs):
+    """
+    Tasks enter and leave a plan by status, and leave the previous plan when moved to another night or telescope.
+    Task.save leaves the stored plan fields of the task, and whether they changed, on the instance.
+    """
+    if not getattr(instance, '_plan_changed', True):
+        return
+    stored = getattr(instance, '_stored_plan', None)
+    if stored is not None and stored[2] == Task.CREATED:
+        refresh_plan(stored[0], stored[1], [instance.id])
+    if instance.status == Task.CREATED:
+        refresh_plan(instance.telescope_id, instance.jdn, [instance.id])
+
+
+@receiver(post_delete, sender=Task)
+def refresh_deleted_task_plan(sender, instance, **kwargs):
+    with transaction.atomic():
+        TaskTombstone.objects.create(telescope_id=instance.telescope_id, task_id=instance.id,
+                                     revision=Telescope.next_revision(instance.telescope_id))
+    if instance.status == Task.CREATED:
+        refresh_plan(instance.telescope_id, instance.jdn, [instance.id])
+
+
+@receiver(post_save, sender=Point)
+@receiver(post_save, sender=Frame)
+@receiver(post_delete, sender=Point)
+@receiver(post_delete, sender=Frame)
+def refresh_moment_plan(sender, instance, **kwargs):
+    # bulk_create sends no signals: ingestion saves the task after its points and frames, which refreshes the plan
+    refresh_task_moments(instance.task_id)
+
+
+@receiver(post_save, sender=Telescope)
+def touch_telescope_plans(sender, instance, created, **kwargs):
+    if not created:
+        touch_plans(instance.id)
+
+
+@receiver(pre_save, sender=TaskResult)
+def remember_result_image(sender, instance, **kwargs):
+    instance._stored_image = None
+    if instance.pk is not None:
+        instance._stored_image = TaskResult.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=TaskResult)
+def queue_result_previews(sender, instance, **kwargs):
+    # bulk_create sends no signals: the bulk uploads queue their previews themselves
+    if instance.image and instance.image.name != getattr(instance, '_stored_image', None):
+        queue_previews([instance.id])
@@ -0,0 +1,222 @@
+from datetime import datetime
+
+import numpy as np
+import pytz
+
+from tasks import jdtime
+from tasks.models import Task, Point
+
+
+def angular_distance(alpha1, beta1, alpha2, beta2):
+    """Great-circle distance in degrees between (alpha, beta) positions, alpha as longitude and beta as latitude."""
+    alpha1, beta1, alpha2, beta2 = (np.radians(value) for value in (alpha1, beta1, alpha2, beta2))
+    a = np.sin((beta2 - beta1) / 2) ** 2 + np.cos(beta1) * np.cos(beta2) * np.sin((alpha2 - alpha1) / 2) ** 2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))))
+
+
+class SlewOptimizer:
+    """
+    Orders positions visited within time windows so that the mount slews less: a nearest neighbour
+    route over the positions available at every moment, improved by 2-opt reversals of up to
+    neighbourhood positions. A position i is observed from a moment in [window_start[i], window_end[i]]
+    for duration[i] seconds; slewing takes settle + distance / rate seconds. The mount starts from
+    start = (alpha, beta, moment) if given, otherwise from the first position of the route.
+    """
+    neighbourhood = 20
+    max_passes = 50
+
+    def __init__(self, rate, settle=0.0):
+        self.rate = rate
+        self.settle = settle
+
+    def slew(self, alpha1, beta1, alpha2, beta2):
+        return self.settle + angular_distance(alpha1, beta1, alpha2, beta2) / self.rate
+
+    def optimize(self, alpha, beta, window_start, window_end, duration, start=None):
+        """
+        Returns (order, times) of the best route found, or the order of window starts when nothing better fits;
+        times is None if even that order misses some window.
+        """
+        self.window_start = window_start
+        self.window_end = window_end
+        self.duration = duration
+        self.matrix = self.slew(alpha[:, None], beta[:, None], alpha[None, :], beta[None, :])
+        if start is not None:
+            self.from_start = self.slew(start[0], start[1], alpha, beta)
+            self.start_moment = start[2]
+        else:
+            self.from_start = np.zeros(len(alpha))
+            self.start_moment = -np.inf
+        original = np.argsort(window_start, kind='stable')
+        original_times = self.timing(original)
+        order = self._nearest_neighbour()
+        if order is None or self.timing(order) is None:
+            if original_times is None:
+                return original, None
+            order = original
+        order = self._two_opt(order)
+        if self.route_slew(order) > self.route_slew(original) and original_times is not None:
+            return original, original_times
+        return order, self.timing(order)
+
+    def route_slew(self, order):
+        if not len(order) > 0:
+            return 0.0
+        return float(self.from_start[order[0]] + self.matrix[order[:-1], order[1:]].sum())
+
+    def timing(self, order, times=None, first=0, last=None):
+        """
+        Observation moments of the route, or None if some position misses its window. Given the moments
+        of a route that differs only in positions first..last, recomputes them from first and stops as soon
+        as a position after last is free not later than before, as every following one stays feasible then.
+        """
+        if times is None:
+            times = np.empty(len(order))
+        else:
+            old_free = times + self.duration[order]
+            times = times.copy()
+        if first > 0:
+            previous = order[first - 1]
+            free = times[first - 1] + self.duration[previous]
+        else:
+            previous = None
+            free = self.start_moment
+        for position in range(first, len(order)):
+            index = order[position]
+            slew = self.from_start[index] if previous is None else self.matrix[previous, index]
+            moment = max(self.window_start[index], free + slew)
+            if moment > self.window_end[index]:
+                return None
+            times[position] = moment
+            free = moment + self.duration[index]
+            previous = index
+            if last is not None and position > last and free <= old_free[position]:
+                break
+        return times
+
+    def _nearest_neighbour(self):
+        size = len(self.duration)
+        unvisited = np.ones(size, dtype=bool)
+        order = []
+        slew_from = self.from_start
+        free = self.start_moment if np.isfinite(self.start_moment) else float(np.min(self.window_start))
+        for _ in range(size):
+            candidates = np.flatnonzero(unvisited)
+            slew = slew_from[candidates]
+            arrival = np.maximum(self.window_start[candidates], free + slew)
+            feasible = arrival <= self.window_end[candidates]
+            # the most urgent position must stay reachable after the chosen one
+            urgent = candidates[np.argmin(self.window_end[candidates])]
+            after = arrival + self.duration[candidates] + self.matrix[candidates, urgent]
+            allowed = feasible & ((candidates == urgent) | (after <= self.window_end[urgent]))
+            if not allowed.any():
+                allowed = feasible
+            if not allowed.any():
+                return None
+            # nearest of the positions observable without waiting, otherwise the one observable first
+            ready = allowed & (self.window_start[candidates] <= free + slew)
+            if ready.any():
+                choice = np.flatnonzero(ready)[np.argmin(slew[ready])]
+            else:
+                choice = np.flatnonzero(allowed)[np.argmin(arrival[allowed])]
+            index = candidates[choice]
+            order.append(index)
+            unvisited[index] = False
+            free = arrival[choice] + self.duration[index]
+            slew_from = self.matrix[index]
+        return np.array(order, dtype=np.int64)
+
+    def _two_opt(self, order):
+        order = order.copy()
+        size = len(order)
+        times = self.timing(order)
+        if size < 3 or times is None:
+            return order
+        for _ in range(self.max_passes):
+            improved = False
+            for i in range(size - 1):
+                for k in range(i + 1, min(i + self.neighbourhood, size)):
+                    if self._reversal_gain(order, i, k) <= 1e-9:
+                        continue
+                    candidate = order.copy()
+                    candidate[i:k + 1] = order[i:k + 1][::-1]
+                    candidate_times = self.timing(candidate, times, i, k)
+                    if candidate_times is None:
+                        continue
+                    order, times = candidate, candidate_times
+                    improved = True
+            if not improved:
+                break
+        return order
+
+    def _reversal_gain(self, order, i, k):
+        """Slew saved by reversing order[i..k]; the inner slews do not change since the slew is symmetric."""
+        first, last = order[i], order[k]
+        if i > 0:
+            gain = self.matrix[order[i - 1], first] - self.matrix[order[i - 1], last]
+        else:
+            gain = self.from_start[first] - self.from_start[last]
+        if k + 1 < len(order):
+            gain += self.matrix[last, order[k + 1]] - self.matrix[first, order[k + 1]]
+        return gain
+
+
+def optimize_plan_points(plan, tolerance, rate, settle=0.0):
+    """
+    Reorders the flexible points of a telescope plan (POINTS_MODE tasks in the horizontal system) to cut the
+    slew time. Every flexible point may move by up to tolerance seconds but stays between the fixed points
+    around it; moved points and their frames get the new dt, jdn and jd. Returns the estimated slew before
+    and after and the slew saved, in seconds.
+    """
+    points = sorted(plan['points'], key=lambda point: point['dt'])
+    frames = {}
+    for frame in plan['frames']:
+        frames.setdefault((frame['task'], frame['dt']), []).append(frame)
+    # exposures are in milliseconds
+    exposures = np.array([max([frame['exposure'] for frame in frames.get((point['task'], point['dt']), [])], default=0.0)
+                          for point in points], dtype=np.float64) / 1000.0
+    moments = np.array([point['dt'].timestamp() for point in points], dtype=np.float64)
+    alpha = np.array([point['alpha'] for point in points], dtype=np.float64)
+    beta = np.array([point['beta'] for point in points], dtype=np.float64)
+    flexible = np.array([point['task_type'] == Task.POINTS_MODE and point['cs_type'] == Point.EARTH_SYSTEM
+                         for point in points], dtype=bool)
+    optimizer = SlewOptimizer(rate, settle)
+    before = after = 0.0
+    new_moments = moments.copy()
+    new_order = np.arange(len(points))
+    # runs of flexible points between fixed ones are optimized separately
+    bounds = np.flatnonzero(np.diff(np.concatenate(([0], flexible.astype(np.int8), [0]))))
+    for begin, end in zip(bounds[0::2], bounds[1::2]):
+        segment = np.arange(begin, end)
+        start = None
+        lower = -np.inf
+        if begin > 0:
+            lower = moments[begin - 1] + exposures[begin - 1]
+            start = (alpha[begin - 1], beta[begin - 1], lower)
+        upper = moments[end] if end < len(points) else np.inf
+        window_start = np.maximum(moments[segment] - tolerance, lower)
+        window_end = np.maximum(np.minimum(moments[segment] + tolerance, upper - exposures[segment]), moments[segment])
+        window_start = np.minimum(window_start, moments[segment])
+        order, times = optimizer.optimize(alpha[segment], beta[segment], window_start, window_end, exposures[segment], start)
+        if times is None or np.array_equal(order, np.arange(len(segment))):
+            # points keep their moments unless the route changes
+            order = np.arange(len(segment))
+            times = moments[segment]
+        before += optimizer.route_slew(np.arange(len(segment)))
+        after += optimizer.route_slew(order)
+        new_order[segment] = segment[order]
+        new_moments[segment[order]] = times
+    for index in np.flatnonzero(flexible).tolist():
+        if new_moments[index] == moments[index]:
+            continue
+        dt = datetime.fromtimestamp(new_moments[index], tz=pytz.UTC)
+        dt64 = np.array([np.datetime64(dt.replace(tzinfo=None), 'us')])
+        jdn, jdf = jdtime.dt_to_jdn_jdf(dt64)
+        moved = [points[index]] + frames.get((points[index]['task'], points[index]['dt']), [])
+        for item in moved:
+            item['dt'] = dt
+            item['jdn'] = int(jdn[0])
+            item['jd'] = float(jdf[0])
+    plan['points'] = [points[index] for index in new_order.tolist()]
+    plan['frames'] = sorted(plan['frames'], key=lambda frame: frame['dt'])
+    return {'before': before, 'after': after, 'saved': before - after}
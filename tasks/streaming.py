@@ -0,0 +1,94 @@
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+class StreamingJSONMixin:
+    """
+    Streams JSON responses of generic views chunk by chunk instead of rendering them whole:
+    lists item by item from a queryset iterator, and the large array members of an object
+    (streamed_fields, rendered from the iter_<name> method of the serializer or given explicitly)
+    element by element. Only the JSON renderer streams; paginated lists, other renderers and
+    errors take the usual way.
+    """
+    streamed_fields = ()
+    chunk_size = 64 * 1024
+    queryset_chunk_size = 2000
+
+    def is_streaming(self):
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return isinstance(renderer, JSONRenderer) and renderer.format == 'json'
+
+    def render_json(self, data):
+        return self.request.accepted_renderer.render(data, self.request.accepted_media_type, {
+            'request': self.request,
+            'view': self,
+        })
+
+    def streaming_response(self, chunks, headers=None):
+        response = StreamingHttpResponse(self._buffered(chunks), content_type='application/json')
+        for name, value in (headers or {}).items():
+            response[name] = value
+        return response
+
+    def iter_list(self, items):
+        """A JSON array of the already represented items."""
+        yield b'['
+        for index, item in enumerate(items):
+            if index:
+                yield b','
+            yield self.render_json(item)
+        yield b']'
+
+    def iter_queryset(self, queryset):
+        serializer = self.get_serializer()
+        if hasattr(queryset, 'iterator'):
+            queryset = queryset.iterator(chunk_size=self.queryset_chunk_size)
+        return self.iter_list(serializer.to_representation(instance) for instance in queryset)
+
+    def iter_object(self, instance, streamed=None):
+        """
+        The representation of the instance as a JSON object; the streamed members follow the others,
+        rendered from the items of streamed[name] or of serializer.iter_<name>(instance).
+        """
+        serializer = self.get_serializer(instance)
+        streamed = dict(streamed or {})
+        for name in self.streamed_fields:
+            if name not in streamed:
+                streamed[name] = getattr(serializer, f'iter_{name}')(instance)
+        for name in streamed:
+            serializer.fields.pop(name, None)
+        head = self.render_json(serializer.to_representation(instance))
+        yield head[:-1]
+        for index, (name, items) in enumerate(streamed.items()):
+            if index or len(head) > 2:
+                yield b','
+            yield self.render_json(name) + b':'
+            yield from self.iter_list(items)
+        yield b'}'
+
+    def _buffered(self, chunks):
+        parts = []
+        size = 0
+        for chunk in chunks:
+            parts.append(chunk)
+            size += len(chunk)
+            if size >= self.chunk_size:
+                yield b''.join(parts)
+                parts = []
+                size = 0
+        if parts:
+            yield b''.join(parts)
+
+
+class StreamingListMixin(StreamingJSONMixin):
+    def list(self, request, *args, **kwargs):
+        if not self.is_streaming() or self.paginator is not None:
+            return super().list(request, *args, **kwargs)
+        return self.streaming_response(self.iter_queryset(self.filter_queryset(self.get_queryset())))
+
+
+class StreamingRetrieveMixin(StreamingJSONMixin):
+    def retrieve(self, request, *args, **kwargs):
+        if not self.is_streaming():
+            return super().retrieve(request, *args, **kwargs)
+        return self.streaming_response(self.iter_object(self.get_object()))
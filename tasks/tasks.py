@@ -0,0 +1,82 @@
+from datetime import datetime
+
+import julian
+from django.conf import settings
+from django.db import transaction
+
+from telescope.celery import app
+from tasks.ingestion import PlanIngestion, SlotCollisionError
+from tasks.models import IngestionJob, InputData, Telescope
+from tasks.scheduler import NightScheduler
+from tasks import previews, uploads
+
+
+@app.task
+def ingest_plan(job_id):
+    job = IngestionJob.objects.select_related('task').get(id=job_id)
+    if job.status != IngestionJob.PENDING:
+        return job.status
+    job.status = IngestionJob.RUNNING
+    job.save(update_fields=['status', 'updated_at'])
+    try:
+        inputdata = InputData.objects.get(task=job.task)
+        ingestion = PlanIngestion.from_input_data(inputdata.data_json)
+        if not ingestion.is_valid():
+            job.status = IngestionJob.FAILED
+            job.errors = ingestion.errors
+            job.save(update_fields=['status', 'errors', 'updated_at'])
+            return job.status
+        job.total = ingestion.size
+        job.save(update_fields=['total', 'updated_at'])
+        ingestion.save_in_batches(job.task, lambda processed: report_progress(job, processed))
+    except SlotCollisionError as e:
+        job.status = IngestionJob.FAILED
+        job.errors = {'telescope': str(e)}
+        job.save(update_fields=['status', 'errors', 'updated_at'])
+        return job.status
+    except Exception as e:
+        job.status = IngestionJob.FAILED
+        job.errors = {'error': str(e)}
+        job.save(update_fields=['status', 'errors', 'updated_at'])
+        raise
+    job.status = IngestionJob.DONE
+    job.save(update_fields=['status', 'updated_at'])
+    return job.status
+
+
+def report_progress(job, processed):
+    job.processed = processed
+    job.save(update_fields=['processed', 'updated_at'])
+
+
+@app.task
+def schedule_nights(jdn=None):
+    """Plans the night of every enabled telescope; by default the night served by the telescope plan now."""
+    if jdn is None:
+        jdn = int(julian.to_jd(datetime.now()))
+    return [NightScheduler(telescope, jdn).run() for telescope in Telescope.objects.filter(enabled=True)]
+
+
+@app.task
+def expire_uploads():
+    return uploads.expire_uploads()
+
+
+@app.task
+def build_previews(result_id):
+    return previews.build_previews(result_id)
+
+
+@app.task
+def build_missing_previews():
+    result_ids = previews.missing_previews(getattr(settings, 'RESULT_PREVIEW_SWEEP_SIZE', 1000))
+    for result_id in result_ids:
+        build_previews.delay(result_id)
+    return len(result_ids)
+
+
+def queue_previews(result_ids):
+    """Queues building the previews of the results once the transaction that stores them commits."""
+    result_ids = list(result_ids)
+    if result_ids:
+        transaction.on_commit(lambda: [build_previews.delay(result_id) for result_id in result_ids])
@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+import julian
+import numpy as np
+import pytz
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from PIL import Image
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from tasks import compression, fastjson, jdtime, planformat
+from tasks.models import Telescope, Satellite, Task, Point, Frame, AbstractTimeMoment, TaskResult, InputData, \
+    IngestionJob, TLEData, Balance, TelescopePlanBody, ResultUpload
+from tasks.events import plan_events
+from tasks.helpers import telescope_collision_task
+from tasks.jsonstream import JSONObjectStream
+from tasks.parsers import FastJSONParser
+from tasks.previews import build_previews, displayable
+from tasks.propagation import satrecs, parse_tle, topocentric
+from tasks.pubsub import MemoryBroker
+from tasks.scheduler import NightScheduler, weighted_interval_schedule
+from tasks.slew import SlewOptimizer, angular_distance, optimize_plan_points
+from tasks.tasks import ingest_plan
+from tasks.uploads import expire_uploads, part_path
+from tasks.plans import build_plan, get_plan, parse_cursor, rebuild_plan, refresh_plan, sync_plan, update_plan
+
+
+class PlanFixtureMixin:
+    @classmethod
+    def create_fixture(cls):
+        cls.author = User.objects.create(username='author')
+        cls.telescope = Telescope.objects.create(alias='t', name='T', code=1, altitude=100.0, latitude=55.7,
+                                                 longitude=37.6, fov=1.0)
+        Satellite.objects.create(number=25544, name='ISS')
+        cls.start = datetime(2030, 1, 1, 13, 0, tzinfo=pytz.UTC)
+        cls.jdn = AbstractTimeMoment.dt_to_jdn_jdf(cls.start)[0]
+
+    def create_task(self, index, satellite=None, size=3):
+        start = self.start + timedelta(minutes=10 * index)
+        task = Task.objects.create(author=self.author, telescope=self.telescope, task_type=Task.POINTS_MODE,
+                                   satellite_id=satellite, start_dt=start, end_dt=start + timedelta(seconds=size),
+                                   jdn=self.jdn, status=Task.CREATED)
+        for second in range(size):
+            dt = start + timedelta(seconds=second)
+            jdn, jd = AbstractTimeMoment.dt_to_jdn_jdf(dt)
+            Point.objects.create(task=task, dt=dt, jdn=jdn, jd=jd, alpha=float(second), beta=45.0)
+            Frame.objects.create(task=task, dt=dt, jdn=jdn, jd=jd, mag=5.0, exposure=100.0)
+        return task
+
+
+class PlanTestCase(PlanFixtureMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.create_fixture()
+
+
+class PlanTransactionTestCase(PlanFixtureMixin, TransactionTestCase):
+    """For the behaviour that waits for the commit of the transaction (transaction.on_commit)."""
+
+    def setUp(self):
+        self.create_fixture()
+
+
+class PlanAssemblyTestCase(PlanTestCase):
+    def test_query_count_does_not_depend_on_tasks(self):
+        self.create_task(0, satellite=25544)
+        with self.assertNumQueries(2):
+            points, frames = build_plan(self.telescope.id, self.jdn)
+        self.assertEqual((len(points), len(frames)), (3, 3))
+        for index in range(1, 10):
+            self.create_task(index, satellite=25544 if index % 2 else None)
+        with self.assertNumQueries(2):
+            points, frames = build_plan(self.telescope.id, self.jdn)
+        self.assertEqual((len(points), len(frames)), (30, 30))
+
+    def test_rows(self):
+        second = self.create_task(1)
+        first = self.create_task(0, satellite=25544)
+        points, frames = build_plan(self.telescope.id, self.jdn)
+        self.assertEqual([point['task'] for point in points], [first.id] * 3 + [second.id] * 3)
+        point = Point.objects.filter(task=first).order_by('dt').first()
+        expected = point.to_dict()
+        expected.update(dt='2030-01-01T13:00:00Z', task_type=Task.POINTS_MODE, satellite=25544)
+        self.assertEqual(points[0], expected)
+        self.assertNotIn('satellite', frames[-1])
+
+    def test_update_matches_build(self):
+        tasks = [self.create_task(index) for index in (0, 2, 4)]
+        rebuild_plan(self.telescope.id, self.jdn)
+        added = self.create_task(1, satellite=25544)
+        tasks[0].status = Task.READY
+        tasks[0].save()
+        tasks[2].start_dt -= timedelta(hours=1)
+        tasks[2].save()
+        plan = update_plan(self.telescope.id, self.jdn, {added.id, tasks[0].id, tasks[2].id})
+        self.assertEqual((plan.points, plan.frames), build_plan(self.telescope.id, self.jdn))
+
+
+class PlanSyncTestCase(PlanTestCase):
+    def create_task(self, index, satellite=None, size=3):
+        task = super().create_task(index, satellite, size)
+        task.start_jd = sum(AbstractTimeMoment.dt_to_jdn_jdf(task.start_dt))
+        task.end_jd = sum(AbstractTimeMoment.dt_to_jdn_jdf(task.end_dt))
+        task.save()
+        return task
+
+    def sync(self, cursor=None):
+        return sync_plan(self.telescope.id, cursor, self.start - timedelta(hours=1), self.jdn + 1.0)
+
+    def test_deleted_task_is_removed(self):
+        kept = self.create_task(0)
+        deleted = self.create_task(1)
+        deleted_id = deleted.id
+        plan = self.sync()
+        self.assertEqual({point['task'] for point in plan['points']}, {kept.id, deleted_id})
+        # points and frames keep their task (DO_NOTHING), so they go first
+        Point.objects.filter(task=deleted).delete()
+        Frame.objects.filter(task=deleted).delete()
+        deleted.delete()
+        plan = self.sync(parse_cursor(plan['cursor']))
+        self.assertEqual(plan['removed'], [deleted_id])
+        self.assertEqual(plan['points'], [])
+        plan = self.sync(parse_cursor(plan['cursor']))
+        self.assertEqual(plan['removed'], [])
+
+    def test_saving_other_fields_keeps_revision(self):
+        task = self.create_task(0)
+        revision = Task.objects.get(id=task.id).revision
+        task.priority = 5
+        task.save()
+        self.assertEqual(Task.objects.get(id=task.id).revision, revision)
+        task.status = Task.READY
+        task.save()
+        self.assertGreater(Task.objects.get(id=task.id).revision, revision)
+
+
+class MediaTestCase(PlanTestCase):
+    """Stores the files of a test in a temporary MEDIA_ROOT."""
+
+    def setUp(self):
+        self.media_root = media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+def image_bytes(array, image_format='PNG'):
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+class PreviewTestCase(MediaTestCase):
+    def test_16_bit_image_is_stretched(self):
+        picture = Image.open(io.BytesIO(image_bytes(np.array([[1000, 2000], [3000, 5000]], dtype=np.uint16))))
+        self.assertTrue(picture.mode.startswith('I;16'))
+        picture = displayable(picture)
+        self.assertEqual(picture.mode, 'L')
+        self.assertEqual(picture.getextrema(), (0, 255))
+
+    def test_build_previews(self):
+        task = self.create_task(0)
+        frames = list(task.frames.order_by('id'))
+        array = (np.arange(600 * 400) % 60000).astype(np.uint16).reshape(400, 600)
+        results = []
+        for frame in frames[:2]:
+            result = TaskResult(task=task, frame=frame)
+            result.image.save('frame.png', ContentFile(image_bytes(array)), save=False)
+            result.save()
+            results.append(result)
+        previews = build_previews(results[0].id)
+        self.assertEqual(set(previews), {'thumb', 'preview'})
+        self.assertEqual(Image.open(default_storage.open(previews['thumb'])).size, (256, 171))
+        # the same content shares the previews
+        self.assertEqual(build_previews(results[1].id), previews)
+        self.assertEqual(TaskResult.objects.get(id=results[1].id).image_hash, TaskResult.objects.get(id=results[0].id).image_hash)
+
+    def test_unreadable_image_gets_no_previews(self):
+        task = self.create_task(0)
+        result = TaskResult(task=task, frame=task.frames.first())
+        result.image.save('frame.fits', ContentFile(b'SIMPLE  =                    T'), save=False)
+        result.save()
+        self.assertEqual(build_previews(result.id), {})
+        self.assertEqual(TaskResult.objects.get(id=result.id).previews, {})
+
+
+class ResultTestCase(MediaTestCase):
+    """A received task of the telescope of observer, with its client."""
+
+    def setUp(self):
+        super().setUp()
+        self.observer = User.objects.create(username='observer')
+        Telescope.objects.filter(id=self.telescope.id).update(user=self.observer)
+        self.task = self.create_task(0)
+        Task.objects.filter(id=self.task.id).update(status=Task.RECEIVED)
+        self.frames = list(self.task.frames.order_by('id').values_list('id', flat=True))
+        self.points = list(self.task.points.order_by('id').values_list('id', flat=True))
+        self.client = APIClient()
+        self.client.force_authenticate(self.observer)
+
+    def stored_images(self):
+        directory = os.path.join(self.media_root, 'results')
+        return os.listdir(directory) if os.path.isdir(directory) else []
+
+
+class ResultBatchTestCase(ResultTestCase):
+    def post_batch(self, size=2):
+        data = {'results': json.dumps([{'frame': frame, 'point': point, 'image': f'image{index}'}
+                                       for index, (frame, point) in enumerate(zip(self.frames[:size], self.points))])}
+        for index in range(size):
+            data[f'image{index}'] = SimpleUploadedFile(f'result{index}.png', image_bytes(np.zeros((4, 4), np.uint8)))
+        return self.client.post(f'/api/tasks/{self.task.id}/add_results/', data, format='multipart')
+
+    def test_batch_is_stored(self):
+        response = self.post_batch()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(TaskResult.objects.values_list('frame_id', flat=True)), self.frames[:2])
+        self.assertEqual(len(self.stored_images()), 2)
+
+    def test_batch_is_checked_at_once(self):
+        TaskResult.objects.create(task=self.task, frame_id=self.frames[1])
+        response = self.client.post(f'/api/tasks/{self.task.id}/add_results/', {'results': [
+            {'frame': self.frames[0]}, {'frame': self.frames[1]}, {'frame': self.frames[2], 'point': 0},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['results'], {
+            '1': {'frame': 'frame already has a result'}, '2': {'point': 'point.task.id != task_id'},
+        })
+        self.assertEqual(TaskResult.objects.count(), 1)
+
+    def test_conflict_removes_images(self):
+        with mock.patch('tasks.serializers.bulk_create_results', side_effect=IntegrityError):
+            response = self.post_batch()
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.stored_images(), [])
+
+    def test_failure_removes_images(self):
+        with mock.patch('tasks.serializers.bulk_create_results', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.post_batch()
+        self.assertEqual(self.stored_images(), [])
+        self.assertFalse(TaskResult.objects.exists())
+
+
+class PlanViewTestCase(PlanTestCase):
+    """The plan of the current night served to the telescope."""
+
+    def setUp(self):
+        self.observer = User.objects.create(username='observer')
+        Telescope.objects.filter(id=self.telescope.id).update(user=self.observer)
+        self.jdn = int(julian.to_jd(datetime.now()))
+        self.start = datetime.now(tz=pytz.UTC).replace(microsecond=0) + timedelta(minutes=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.observer)
+
+    def get_plan(self, query='', **headers):
+        response = self.client.get(f'/api/tasks/tasks_get/{query}', **headers)
+        if response.status_code == 200:
+            content = b''.join(response.streaming_content) if response.streaming else response.content
+            if response.get('Content-Encoding', None) == 'gzip':
+                content = gzip.decompress(content)
+            response.plan = json.loads(content)[0]
+        return response
+
+    def test_telescope_revision_is_left_out(self):
+        self.create_task(0)
+        response = self.get_plan()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('revision', response.plan['telescope'])
+        self.assertEqual(response.plan['telescope']['alias'], 't')
+        self.assertEqual(len(response.plan['points']), 3)
+        Telescope.next_revision(self.telescope.id)
+        self.assertEqual(self.get_plan(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_unchanged_plan_is_not_sent_again(self):
+        task = self.create_task(0)
+        response = self.get_plan()
+        etag = response['ETag']
+        self.assertEqual(self.get_plan(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.get_plan(HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        self.assertNotEqual(self.get_plan('?optimize=1')['ETag'], etag)
+        task.status = Task.READY
+        task.save()
+        # the plan is refreshed once the transaction commits, which a TestCase never does
+        update_plan(self.telescope.id, self.jdn, [task.id])
+        response = self.get_plan(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.plan['points'], [])
+
+    def test_columnar_plan_matches_rows(self):
+        self.create_task(0, satellite=25544)
+        self.create_task(1)
+        rows = self.get_plan().plan
+        response = self.client.get('/api/tasks/tasks_get/?format=columns')
+        self.assertEqual(response['Content-Type'], planformat.COLUMNS_JSON_MEDIA_TYPE)
+        columns = response.json()[0]
+        for name, layout in planformat.PLAN_TABLES:
+            self.assertEqual(sorted(columns[name]), sorted(column for column, dtype in layout))
+            for column, dtype in layout:
+                self.assertEqual(columns[name][column], [row.get(column, None) for row in rows[name]])
+        self.assertEqual(columns['telescope'], rows['telescope'])
+
+        response = self.client.get('/api/tasks/tasks_get/', HTTP_ACCEPT=planformat.COLUMNS_MEDIA_TYPE)
+        self.assertEqual(response['Content-Type'], planformat.COLUMNS_MEDIA_TYPE)
+        meta, tables = planformat.decode_columns(response.content)
+        self.assertEqual((meta['jdn'], meta['telescope']['id']), (rows['jdn'], self.telescope.id))
+        points = tables['points']
+        self.assertEqual(points['id'].tolist(), [row['id'] for row in rows['points']])
+        self.assertEqual(points['alpha'].tolist(), [row['alpha'] for row in rows['points']])
+        self.assertEqual(points['satellite'].tolist(), [row.get('satellite', 0) for row in rows['points']])
+        self.assertEqual(jdtime.format_dt_array(points['dt']).tolist(),
+                         [row['dt'].replace('Z', '.000000Z') for row in rows['points']])
+        self.assertEqual(tables['frames']['exposure'].tolist(), [row['exposure'] for row in rows['frames']])
+
+    def test_columnar_errors_are_json(self):
+        response = self.client.get('/api/tasks/tasks_get/?since=x&format=plan')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json(), {'since': 'since is not a cursor'})
+
+    def test_compressed_plan_is_stored(self):
+        task = self.create_task(0, size=30)
+        response = self.get_plan(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.assertEqual(TelescopePlanBody.objects.count(), 1)
+        with mock.patch('tasks.compression.compress', side_effect=AssertionError):
+            cached = self.get_plan(HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(cached.plan, response.plan)
+        self.assertEqual(cached.plan, self.get_plan().plan)
+        self.assertEqual(cached['ETag'], response['ETag'])
+        self.assertEqual(self.get_plan(HTTP_IF_NONE_MATCH=cached['ETag'], HTTP_ACCEPT_ENCODING='gzip').status_code, 304)
+        task.status = Task.READY
+        task.save()
+        update_plan(self.telescope.id, self.jdn, [task.id])
+        self.assertFalse(TelescopePlanBody.objects.exists())
+
+    def test_identity_is_not_compressed(self):
+        self.create_task(0, size=30)
+        response = self.get_plan(HTTP_ACCEPT_ENCODING='gzip;q=0, identity')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertFalse(TelescopePlanBody.objects.exists())
+
+    def test_optimized_plan_reports_slew(self):
+        self.create_task(0)
+        response = self.get_plan('?optimize=1&tolerance=abc')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.plan['slew']), {'before', 'after', 'saved'})
+        self.assertEqual(len(response.plan['points']), 3)
+
+
+class PlanRefreshTestCase(PlanTransactionTestCase):
+    def test_changes_of_a_transaction_update_once(self):
+        with mock.patch('tasks.plans.update_plan') as update:
+            with transaction.atomic():
+                refresh_plan(self.telescope.id, self.jdn, [1])
+                refresh_plan(self.telescope.id, self.jdn, [2])
+                update.assert_not_called()
+        update.assert_called_once_with(self.telescope.id, self.jdn, {1, 2})
+
+    def test_rolled_back_changes_are_dropped(self):
+        with mock.patch('tasks.plans.update_plan') as update:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                refresh_plan(self.telescope.id, self.jdn, [1])
+                raise RuntimeError
+            with transaction.atomic():
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    refresh_plan(self.telescope.id, self.jdn, [2])
+                    raise RuntimeError
+                refresh_plan(self.telescope.id, self.jdn, [3])
+        update.assert_called_once_with(self.telescope.id, self.jdn, {3})
+
+    def test_stored_plan_follows_tasks(self):
+        tasks = [self.create_task(index) for index in range(3)]
+        self.assertEqual(len(get_plan(self.telescope.id, self.jdn).points), 9)
+        with transaction.atomic():
+            tasks[0].status = Task.READY
+            tasks[0].save()
+            tasks[1].start_dt += timedelta(minutes=30)
+            tasks[1].save()
+            Point.objects.filter(task=tasks[2]).first().delete()
+        plan = get_plan(self.telescope.id, self.jdn)
+        self.assertEqual((plan.points, plan.frames), build_plan(self.telescope.id, self.jdn))
+        self.assertEqual(len(plan.points), 5)
+
+
+class BinaryPlanMixin:
+    def binary_plan(self, size=10, **meta):
+        dt = np.datetime64(self.start.replace(tzinfo=None), 'us') + np.arange(size) * np.timedelta64(500, 'ms')
+        points = {'dt': dt, 'alpha': np.linspace(0.0, 90.0, size), 'beta': np.full(size, 45.0)}
+        frames = {'dt': dt, 'exposure': np.full(size, 100.0), 'mag': np.full(size, 5.0)}
+        return planformat.encode_plan(dict({'telescope': self.telescope.id, 'satellite': 25544}, **meta), points, frames)
+
+    def post_binary(self, body, query=''):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        return client.post(f'/api/tasks/tracking_task/{query}', body, content_type=planformat.MEDIA_TYPE)
+
+
+class BinaryPlanTestCase(BinaryPlanMixin, PlanTestCase):
+    def test_plan_is_stored(self):
+        response = self.post_binary(self.binary_plan())
+        self.assertEqual(response.status_code, 200)
+        task = Task.objects.get()
+        self.assertEqual((task.points.count(), task.frames.count()), (10, 10))
+        self.assertEqual(task.start_dt, self.start)
+        self.assertEqual(sorted(set(task.points.values_list('cs_type', flat=True))), [Point.EARTH_SYSTEM])
+
+    def test_input_data_keeps_columns(self):
+        self.post_binary(self.binary_plan())
+        data = InputData.objects.get().data_json
+        self.assertEqual((data['telescope'], data['satellite']), (self.telescope.id, 25544))
+        self.assertNotIn('points', data)
+        self.assertEqual(data['columns']['points']['dt'][:2], ['2030-01-01T13:00:00.000000Z', '2030-01-01T13:00:00.500000Z'])
+        self.assertEqual(data['columns']['points']['constants'], {'cs_type': Point.EARTH_SYSTEM})
+        self.assertEqual(data['columns']['frames']['exposure'], [100.0] * 10)
+
+    def test_broken_plans_are_rejected(self):
+        body = self.binary_plan()
+        self.assertEqual(self.post_binary(body[:-3]).status_code, 400)
+        self.assertEqual(self.post_binary(self.binary_plan(cs_type='0')).data,
+                         {'cs_type': 'cs_type is not in [EARTH_SYSTEM, STARS_SYSTEM]'})
+        self.assertFalse(Task.objects.exists())
+
+
+class AsyncIngestionTestCase(BinaryPlanMixin, PlanTransactionTestCase):
+    def test_binary_plan_is_ingested_from_its_columns(self):
+        with mock.patch('tasks.views.ingest_plan') as ingest:
+            response = self.post_binary(self.binary_plan(size=25), query='?async=1')
+        self.assertEqual(response.status_code, 202)
+        job = IngestionJob.objects.get(task_id=response.data['task'])
+        ingest.delay.assert_called_once_with(job.id)
+        self.assertEqual(job.task.points.count(), 0)
+        self.assertEqual(ingest_plan(job.id), IngestionJob.DONE)
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.total), (50, 50))
+        self.assertEqual((job.task.points.count(), job.task.frames.count()), (25, 25))
+
+
+class JSONPlanMixin:
+    def plan_rows(self, size=5):
+        dts = [(self.start + timedelta(seconds=second)).strftime('%Y-%m-%dT%H:%M:%S.%fZ') for second in range(size)]
+        points = [{'dt': dt, 'alpha': float(index), 'beta': 45.0, 'cs_type': Point.EARTH_SYSTEM} for index, dt in enumerate(dts)]
+        frames = [{'dt': dt, 'mag': 5.0, 'exposure': 100.0} for dt in dts]
+        return points, frames
+
+    def post_plan(self, points, frames, query=''):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        return client.post(f'/api/tasks/task_add/{query}', {
+            'telescope': self.telescope.id, 'task_type': Task.POINTS_MODE, 'data_tle': '',
+            'data_json': {'points': points, 'frames': frames},
+        }, format='json')
+
+
+class PlanIngestionTestCase(JSONPlanMixin, PlanTestCase):
+    def test_plan_is_stored(self):
+        response = self.post_plan(*self.plan_rows())
+        self.assertEqual(response.status_code, 200)
+        task = Task.objects.get()
+        self.assertEqual((task.start_dt, task.end_dt), (self.start, self.start + timedelta(seconds=4)))
+        self.assertEqual(list(task.points.order_by('dt').values_list('alpha', flat=True)), [0.0, 1.0, 2.0, 3.0, 4.0])
+        point = task.points.order_by('dt').last()
+        jdn, jd = AbstractTimeMoment.dt_to_jdn_jdf(point.dt)
+        self.assertEqual(point.jdn, jdn)
+        self.assertAlmostEqual(point.jd, jd, places=12)
+        self.assertEqual(task.frames.count(), 5)
+
+    def test_errors_are_reported_by_index(self):
+        points, frames = self.plan_rows()
+        points[1]['alpha'] = 400.0
+        points[3]['beta'] = 'x'
+        del frames[2]['dt']
+        frames[4]['exposure'] = -1.0
+        response = self.post_plan(points, frames)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'points': {'1': {'alpha': 'alpha is not in [0..360)'}, '3': {'beta': 'beta is not float'}},
+            'frames': {'2': {'dt': 'dt is None'}, '4': {'exposure': 'exposure is not positive'}},
+        })
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(Point.objects.exists())
+
+
+class AsyncPlanIngestionTestCase(JSONPlanMixin, PlanTransactionTestCase):
+    def post_async(self, points, frames):
+        with mock.patch('tasks.views.ingest_plan') as ingest:
+            response = self.post_plan(points, frames, query='?async=1')
+        self.assertEqual(response.status_code, 202)
+        job = IngestionJob.objects.get(task_id=response.data['task'])
+        ingest.delay.assert_called_once_with(job.id)
+        return response, job
+
+    def get_status(self, response, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.author)
+        return client.get(f'/api/tasks/{response.data["url"]}')
+
+    def test_plan_is_ingested(self):
+        response, job = self.post_async(*self.plan_rows())
+        self.assertEqual(self.get_status(response).data['status'], job.get_status_display())
+        self.assertEqual(ingest_plan(job.id), IngestionJob.DONE)
+        status = self.get_status(response).data
+        self.assertEqual((status['processed'], status['total'], status['progress']), (10, 10, 1.0))
+        self.assertEqual(job.task.points.count(), 5)
+        self.assertEqual(self.get_status(response, User.objects.create(username='other')).status_code, 404)
+
+    def test_invalid_plan_fails_the_job(self):
+        points, frames = self.plan_rows()
+        points[2]['alpha'] = -1.0
+        response, job = self.post_async(points, frames)
+        self.assertEqual(ingest_plan(job.id), IngestionJob.FAILED)
+        status = self.get_status(response).data
+        self.assertEqual(status['errors'], {'points': {'2': {'alpha': 'alpha is not in [0..360)'}}})
+        self.assertFalse(Point.objects.exists())
+
+
+class StreamedPlanTestCase(JSONPlanMixin, PlanTestCase):
+    def post_tracking(self, body):
+        client = APIClient()
+        client.force_authenticate(self.author)
+        return client.post('/api/tasks/tracking_task/', body, content_type='application/json')
+
+    def tracking_body(self, points, frames):
+        return json.dumps({
+            'telescope': self.telescope.id, 'tracking_data': {'satellite_id': 25544, 'mag': 6.5},
+            'track_points': [{'dt': point['dt'], 'alpha': point['alpha'], 'beta': point['beta']} for point in points],
+            'frames': [{'dt': frame['dt'], 'exposure': frame['exposure']} for frame in frames],
+        })
+
+    def test_tracking_plan_is_stored(self):
+        response = self.post_tracking(self.tracking_body(*self.plan_rows()))
+        self.assertEqual(response.status_code, 200)
+        task = Task.objects.get()
+        self.assertEqual((task.task_type, task.satellite_id), (Task.TRACKING_MODE, 25544))
+        self.assertEqual(set(task.frames.values_list('mag', flat=True)), {6.5})
+        self.assertEqual(task.points.count(), 5)
+        self.assertEqual(InputData.objects.get().data_json['tracking_data'], {'satellite_id': 25544, 'mag': 6.5})
+
+    def test_errors_are_reported_by_index(self):
+        points, frames = self.plan_rows()
+        points[2]['alpha'] = 'x'
+        frames[1]['exposure'] = 0.0
+        response = self.post_tracking(self.tracking_body(points, frames))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'points': {'2': {'alpha': 'alpha is not float'}}, 'frames': {'1': {'exposure': 'exposure is not positive'}},
+        })
+        self.assertEqual(self.post_tracking('{"telescope": 1, "track_points": [1, 2').status_code, 400)
+        self.assertFalse(Task.objects.exists())
+
+    def test_stream_matches_json(self):
+        body = {'a': 12345, 'x': [1.5, {'b': [1, 2]}, 's,]'], 'y': {'z': None}, 'n': -1.25e3}
+        with mock.patch.object(JSONObjectStream, 'chunk_size', 7):
+            events = list(JSONObjectStream(io.BytesIO(json.dumps(body).encode()), stream_keys=['x']))
+        self.assertEqual([value for event, key, value in events if key == 'x'], body['x'])
+        self.assertEqual({key: value for event, key, value in events if key != 'x'}, {'a': 12345, 'y': {'z': None}, 'n': -1250.0})
+
+
+def tle_checksum(line):
+    return sum(int(char) if char.isdigit() else char == '-' for char in line[:68]) % 10
+
+
+class TLEMixin:
+    def iss_tle(self, epoch=None, number=25544):
+        """An element set of the ISS with the epoch at the midnight (UTC) of epoch, today by default."""
+        epoch = (epoch or datetime.now(tz=pytz.UTC)).astimezone(pytz.UTC)
+        day = epoch.timetuple().tm_yday
+        line1 = f'1 {number:05d}U 98067A   {epoch.year % 100:02d}{day:03d}.00000000  .00001264  00000-0  31000-4 0  999'
+        line2 = f'2 {number:05d}  51.6442 250.0000 0003000 100.0000 260.0000 15.48600000 3000'
+        return '\n'.join(['ISS (ZARYA)', line1 + str(tle_checksum(line1)), line2 + str(tle_checksum(line2))])
+
+    def elevation(self, tle, dt64):
+        azimuth, elevation = topocentric(satrecs(parse_tle(tle)), dt64, self.telescope.latitude,
+                                         self.telescope.longitude, self.telescope.altitude)
+        return elevation[0]
+
+
+class TLETrackTestCase(TLEMixin, PlanTestCase):
+    def post_tle(self, **values):
+        start = datetime.now(tz=pytz.UTC).replace(microsecond=0) + timedelta(hours=1)
+        body = dict({
+            'telescope': self.telescope.id, 'task_type': Task.TRACKING_MODE, 'data_tle': self.iss_tle(),
+            'start_dt': start.isoformat(), 'end_dt': (start + timedelta(hours=12)).isoformat(), 'step': 10, 'exposure': 50,
+        }, **values)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        return client.post('/api/tasks/task_add/', body, format='json')
+
+    def test_track_is_propagated(self):
+        response = self.post_tle()
+        self.assertEqual(response.status_code, 200)
+        task = Task.objects.get()
+        self.assertEqual((task.task_type, task.satellite_id), (Task.TRACKING_MODE, 25544))
+        points = list(task.points.order_by('dt'))
+        self.assertGreater(len(points), 0)
+        self.assertEqual(task.frames.count(), len(points))
+        self.assertTrue(all(point.beta >= 0.0 and point.cs_type == Point.EARTH_SYSTEM for point in points))
+        dt64 = np.array([point.dt.replace(tzinfo=None) for point in points], dtype='datetime64[us]')
+        np.testing.assert_allclose(self.elevation(self.iss_tle(), dt64), [point.beta for point in points], atol=1e-6)
+        self.assertEqual(task.TLE_data.get().line1, self.iss_tle().split('\n')[1])
+
+    def test_broken_requests_are_rejected(self):
+        tle = self.iss_tle()
+        response = self.post_tle(data_tle=tle[:-1] + str((int(tle[-1]) + 1) % 10))
+        self.assertEqual(response.data, {'data_tle': 'line 2 of TLE has wrong checksum'})
+        response = self.post_tle(task_type=Task.POINTS_MODE)
+        self.assertEqual(response.data, {'task_type': 'TLE data needs TRACKING_MODE task_type'})
+        response = self.post_tle(exposure=0)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Task.objects.exists())
+
+
+class PassPredictionTestCase(TLEMixin, PlanTestCase):
+    def setUp(self):
+        self.tle = self.iss_tle()
+        header, line1, line2 = self.tle.split('\n')
+        TLEData.objects.create(satellite_id=25544, header=header, line1=line1, line2=line2,
+                               epoch=parse_tle(self.tle)[0].epoch)
+        self.window_start = datetime.now(tz=pytz.UTC).replace(minute=0, second=0, microsecond=0)
+
+    def post_passes(self, **values):
+        body = dict({
+            'telescope': self.telescope.id, 'start_dt': self.window_start.isoformat(),
+            'end_dt': (self.window_start + timedelta(days=1)).isoformat(), 'min_elevation': 10.0,
+        }, **values)
+        client = APIClient()
+        client.force_authenticate(self.author)
+        return client.post('/api/tasks/passes/', body, format='json')
+
+    def test_passes_match_sampled_track(self):
+        response = self.post_passes(satellites=[25544, 11111])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['missing'], [11111])
+        passes = response.data['passes']
+        self.assertGreater(len(passes), 0)
+        start = np.datetime64(self.window_start.replace(tzinfo=None), 'us')
+        dt64 = start + np.arange(0, 86400, 5) * np.timedelta64(1, 's')
+        above = self.elevation(self.tle, dt64) > 10.0
+        # passes of the sampled track: runs of moments above min_elevation
+        edges = np.flatnonzero(np.diff(above.astype(np.int8)))
+        self.assertEqual(len(passes), (len(edges) + above[0] + above[-1]) // 2)
+        for item in passes:
+            self.assertEqual(item['satellite'], 25544)
+            culmination = np.datetime64(item['culmination_dt'].rstrip('Z'), 'us')
+            self.assertAlmostEqual(self.elevation(self.tle, np.array([culmination]))[0], item['max_elevation'], places=6)
+            for name in ('rise_dt', 'set_dt'):
+                if item[name] is not None:
+                    moment = np.datetime64(item[name].rstrip('Z'), 'us')
+                    self.assertAlmostEqual(self.elevation(self.tle, np.array([moment]))[0], 10.0, places=2)
+
+    def test_broken_requests_are_rejected(self):
+        response = self.post_passes(end_dt=self.window_start.isoformat())
+        self.assertEqual(response.data, {'end_dt': ['end_dt is not after start_dt']})
+        response = self.post_passes(end_dt=(self.window_start + timedelta(days=2)).isoformat())
+        self.assertEqual(response.data, {'end_dt': ['time window is too long']})
+
+
+class CatalogImportTestCase(TLEMixin, PlanTestCase):
+    def post_catalog(self, text, user=None):
+        client = APIClient()
+        client.force_authenticate(user or User.objects.get_or_create(username='admin', defaults={'is_staff': True})[0])
+        return client.post('/api/tasks/tle_import/', {'file': SimpleUploadedFile('catalog.txt', text.encode())},
+                           format='multipart')
+
+    def test_catalog_is_upserted(self):
+        day = datetime(2030, 1, 10, tzinfo=pytz.UTC)
+        task = self.create_task(0, satellite=25544)
+        header, line1, line2 = self.iss_tle(day - timedelta(days=5)).split('\n')
+        TLEData.objects.create(task=task, satellite_id=25544, header=header, line1=line1, line2=line2)
+        broken = self.iss_tle(day, number=22222)
+        catalog = [self.iss_tle(day), self.iss_tle(day, number=11111), broken[:-1] + str((int(broken[-1]) + 1) % 10)]
+        response = self.post_catalog('\n'.join(catalog))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({key: response.data[key] for key in ('satellites_created', 'created', 'updated', 'skipped')},
+                         {'satellites_created': 1, 'created': 2, 'updated': 0, 'skipped': 0})
+        self.assertEqual(len(response.data['errors']), 1)
+        self.assertEqual(Satellite.objects.get(number=11111).name, 'ISS (ZARYA)')
+
+        catalog = [self.iss_tle(day + timedelta(days=1)), self.iss_tle(day - timedelta(days=1), number=11111)]
+        response = self.post_catalog('\n'.join(catalog))
+        self.assertEqual({key: response.data[key] for key in ('satellites_created', 'created', 'updated', 'skipped')},
+                         {'satellites_created': 0, 'created': 0, 'updated': 1, 'skipped': 1})
+        self.assertEqual(TLEData.objects.get(satellite_id=25544, task__isnull=True).epoch, day + timedelta(days=1))
+        self.assertEqual(TLEData.objects.get(satellite_id=11111).epoch, day)
+        self.assertEqual(TLEData.objects.get(task=task).line1, line1)
+
+    def test_only_staff_imports(self):
+        self.assertEqual(self.post_catalog(self.iss_tle(), user=self.author).status_code, 403)
+        self.assertFalse(TLEData.objects.exists())
+
+
+class SlotCollisionTestCase(JSONPlanMixin, PlanTestCase):
+    def test_overlapping_slots(self):
+        task = self.create_task(0, size=60)
+        second = timedelta(seconds=1)
+        for start, end, collides in (
+            (self.start + 10 * second, self.start + 20 * second, True),
+            (self.start - 10 * second, self.start + 70 * second, True),
+            (self.start - 10 * second, self.start + second, True),
+            (self.start + 60 * second, self.start + 70 * second, False),
+            (self.start - 10 * second, self.start, False),
+        ):
+            found = telescope_collision_task(self.telescope.id, start, end)
+            self.assertEqual(found, task if collides else None, (start, end))
+        self.assertIsNone(telescope_collision_task(self.telescope.id, self.start, self.start + second, task.id))
+        Task.objects.filter(id=task.id).update(status=Task.READY)
+        self.assertIsNone(telescope_collision_task(self.telescope.id, self.start, self.start + second))
+
+    def test_overlapping_plan_is_rejected(self):
+        self.create_task(0, size=60)
+        response = self.post_plan(*self.plan_rows())
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['status'], 'error')
+        self.assertEqual(Task.objects.count(), 1)
+        self.start += timedelta(minutes=1)
+        self.assertEqual(self.post_plan(*self.plan_rows()).status_code, 200)
+
+
+class SchedulerTestCase(PlanTestCase):
+    def test_weighted_interval_schedule_is_optimal(self):
+        rng = np.random.default_rng(0)
+        for trial in range(100):
+            size = int(rng.integers(1, 8))
+            starts = rng.integers(0, 20, size).astype(float)
+            ends = starts + rng.integers(1, 8, size)
+            weights = rng.integers(1, 10, size).astype(float)
+            best = 0.0
+            for mask in itertools.product((False, True), repeat=size):
+                indexes = np.flatnonzero(mask)
+                if all(ends[a] <= starts[b] or ends[b] <= starts[a] for a, b in itertools.combinations(indexes, 2)):
+                    best = max(best, weights[indexes].sum())
+            chosen = np.flatnonzero(weighted_interval_schedule(starts, ends, weights))
+            self.assertTrue(all(ends[a] <= starts[b] or ends[b] <= starts[a] for a, b in itertools.combinations(chosen, 2)))
+            self.assertEqual(weights[chosen].sum(), best)
+
+    def create_slot(self, author, start, end, priority=0, status=Task.CREATED):
+        return Task.objects.create(author=author, telescope=self.telescope, task_type=Task.POINTS_MODE, status=status,
+                                   jdn=self.jdn, start_dt=self.start + timedelta(minutes=start),
+                                   end_dt=self.start + timedelta(minutes=end), priority=priority)
+
+    def test_night_is_packed(self):
+        other = User.objects.create(username='other')
+        Balance.objects.create(user=self.author, telescope=self.telescope, minutes=60)
+        fixed = self.create_slot(other, 0, 30, status=Task.RECEIVED)
+        overlapping = self.create_slot(self.author, 20, 40)
+        first = self.create_slot(self.author, 40, 80, priority=1)
+        # fits the night, but not the 60 minutes of the balance of the author after the first
+        over_budget = self.create_slot(self.author, 80, 120)
+        long = self.create_slot(other, 100, 200)
+        short = self.create_slot(other, 90, 95, priority=5)
+        result = NightScheduler(self.telescope, self.jdn).run()
+        self.assertEqual(sorted(result['scheduled']), sorted([fixed.id, first.id, long.id, short.id]))
+        self.assertEqual(sorted(result['deferred']), sorted([overlapping.id, over_budget.id]))
+        self.assertEqual(Task.objects.get(id=over_budget.id).status, Task.DEFERRED)
+        self.assertEqual(Task.objects.get(id=fixed.id).status, Task.RECEIVED)
+        self.assertEqual(Task.objects.get(id=first.id).status, Task.CREATED)
+
+    def test_balance_is_not_enforced(self):
+        Balance.objects.create(user=self.author, telescope=self.telescope, minutes=10)
+        tasks = [self.create_slot(self.author, 0, 30), self.create_slot(self.author, 30, 60)]
+        result = NightScheduler(self.telescope, self.jdn, enforce_balance=False).run()
+        self.assertEqual(sorted(result['scheduled']), [task.id for task in tasks])
+        result = NightScheduler(self.telescope, self.jdn, enforce_balance=True).run()
+        self.assertEqual((result['scheduled'], sorted(result['deferred'])), ([], [task.id for task in tasks]))
+
+
+class SlewOrderTestCase(SimpleTestCase):
+    def plan(self, alphas, task_types=None):
+        start = datetime(2030, 1, 1, 20, 0, tzinfo=pytz.UTC)
+        points, frames = [], []
+        for index, alpha in enumerate(alphas):
+            dt = start + timedelta(seconds=20 * index)
+            task_type = task_types[index] if task_types else Task.POINTS_MODE
+            points.append({'task': index, 'dt': dt, 'alpha': alpha, 'beta': 45.0, 'cs_type': Point.EARTH_SYSTEM,
+                           'task_type': task_type, 'jdn': 0, 'jd': 0.0})
+            frames.append({'task': index, 'dt': dt, 'exposure': 2000.0, 'jdn': 0, 'jd': 0.0})
+        return {'points': points, 'frames': frames}
+
+    def route(self, points):
+        return sum(angular_distance(a['alpha'], a['beta'], b['alpha'], b['beta']) for a, b in zip(points, points[1:]))
+
+    def test_zigzag_is_reordered(self):
+        plan = self.plan([0.0, 180.0, 10.0, 170.0, 20.0, 160.0, 30.0, 150.0])
+        original = {point['task']: point['dt'] for point in plan['points']}
+        before = self.route(plan['points'])
+        report = optimize_plan_points(plan, 300.0, 3.0, 2.0)
+        points = plan['points']
+        self.assertLess(self.route(points), before)
+        self.assertLess(report['after'], report['before'])
+        self.assertEqual([point['dt'] for point in points], sorted(point['dt'] for point in points))
+        optimizer = SlewOptimizer(3.0, 2.0)
+        for a, b in zip(points, points[1:]):
+            self.assertLessEqual(2.0 + optimizer.slew(a['alpha'], a['beta'], b['alpha'], b['beta']),
+                                 (b['dt'] - a['dt']).total_seconds() + 1e-3)
+        for point in points:
+            self.assertLessEqual(abs((point['dt'] - original[point['task']]).total_seconds()), 300.0 + 1e-3)
+            frame = next(frame for frame in plan['frames'] if frame['task'] == point['task'])
+            self.assertEqual((frame['dt'], frame['jdn'], frame['jd']), (point['dt'], point['jdn'], point['jd']))
+
+    def test_fixed_points_stay(self):
+        task_types = [Task.POINTS_MODE, Task.TRACKING_MODE, Task.POINTS_MODE, Task.POINTS_MODE, Task.TRACKING_MODE]
+        plan = self.plan([0.0, 180.0, 10.0, 170.0, 20.0], task_types)
+        fixed = [(point['alpha'], point['dt']) for point in plan['points'] if point['task_type'] != Task.POINTS_MODE]
+        optimize_plan_points(plan, 300.0, 3.0, 2.0)
+        self.assertEqual([(point['alpha'], point['dt']) for point in plan['points'] if point['task_type'] != Task.POINTS_MODE],
+                         fixed)
+        tasks = [point['task'] for point in plan['points']]
+        self.assertEqual((tasks[1], tasks[4]), (1, 4))
+
+
+class PlanEventsTestCase(PlanTransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.observer = User.objects.create(username='observer')
+        Telescope.objects.filter(id=self.telescope.id).update(user=self.observer)
+        self.broker = MemoryBroker()
+        for module in ('tasks.events', 'tasks.plans'):
+            patcher = mock.patch(f'{module}.get_broker', return_value=self.broker)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def listen(self, authorization, change=None):
+        """The messages sent by the event stream until change (called in another thread) is pushed."""
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/tasks/tasks_events/', 'query_string': b'',
+                 'headers': [(b'authorization', authorization)]}
+        sent = []
+
+        async def run():
+            disconnected = asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            stream = asyncio.ensure_future(plan_events(scope, receive, send))
+            changes = [change] if change is not None else []
+            for attempt in range(100):
+                await asyncio.sleep(0.05)
+                bodies = b''.join(message.get('body', b'') for message in sent)
+                if stream.done() or (bodies and not changes and (change is None or b'event: plan' in bodies)):
+                    break
+                if bodies and changes:
+                    await asyncio.get_event_loop().run_in_executor(None, changes.pop())
+            disconnected.set()
+            await stream
+
+        asyncio.run(run())
+        return sent
+
+    def test_changes_are_pushed(self):
+        rebuild_plan(self.telescope.id, self.jdn)
+
+        def change():
+            with transaction.atomic():
+                self.create_task(0)
+
+        sent = self.listen(b'JWT ' + str(AccessToken.for_user(self.observer)).encode(), change)
+        self.assertEqual(sent[0]['status'], 200)
+        events = [message['body'] for message in sent[1:]]
+        self.assertTrue(events[0].startswith(b'event: versions\ndata: '))
+        plan = [event for event in events if event.startswith(b'event: plan')]
+        self.assertEqual(len(plan), 1)
+        delta = json.loads(plan[0].split(b'data: ', 1)[1])
+        self.assertEqual((delta['telescope'], delta['jdn'], delta['removed']), (self.telescope.id, self.jdn, []))
+        self.assertEqual(len(delta['points']), 3)
+
+    def test_unauthenticated_stream_is_refused(self):
+        sent = self.listen(b'JWT broken')
+        self.assertEqual(sent[0]['status'], 401)
+        self.assertEqual(len(sent), 2)
+
+
+class CompressionTestCase(SimpleTestCase):
+    def test_negotiation(self):
+        with mock.patch('tasks.compression.available_codings', return_value=['zstd', 'br', 'gzip']):
+            self.assertEqual(compression.negotiate('gzip, br'), 'br')
+            self.assertEqual(compression.negotiate('gzip;q=1, br;q=0.5'), 'gzip')
+            self.assertEqual(compression.negotiate('*'), 'zstd')
+            self.assertEqual(compression.negotiate('br;q=0, *;q=0.1'), 'zstd')
+            self.assertIsNone(compression.negotiate('identity, deflate'))
+            self.assertIsNone(compression.negotiate('gzip;q=x'))
+        self.assertEqual(compression.negotiate('gzip, br, zstd'), compression.available_codings()[0])
+
+    def test_streamed_gzip_matches_whole(self):
+        chunks = [b'[', b'{"a": 1},' * 1000, b'{}]']
+        self.assertEqual(gzip.decompress(b''.join(compression.compress_stream(chunks, 'gzip'))), b''.join(chunks))
+        self.assertEqual(gzip.decompress(compression.compress(b''.join(chunks), 'gzip')), b''.join(chunks))
+
+
+class FastJSONTestCase(SimpleTestCase):
+    @skipIf(fastjson.orjson is None, 'orjson is not installed')
+    def test_orjson_matches_fallback(self):
+        data = {
+            'aware': datetime(2030, 1, 1, 13, 0, 0, 123456, tzinfo=pytz.UTC),
+            'naive': datetime(2030, 1, 1, 13, 0),
+            'moscow': datetime(2030, 1, 1, 16, 0, tzinfo=pytz.FixedOffset(180)),
+            'array': np.array([1.5, 2.5]),
+            'text': 'Задание',
+            'keys': {1: 'a'},
+            'nested': [None, True, 1.25],
+        }
+        fast = fastjson.dumps(data)
+        with mock.patch.object(fastjson, 'orjson', None):
+            slow = fastjson.dumps(data)
+        self.assertEqual(json.loads(fast), json.loads(slow))
+        self.assertEqual(json.loads(fast)['aware'], '2030-01-01T13:00:00.123456Z')
+        self.assertEqual(json.loads(fast)['naive'], '2030-01-01T13:00:00Z')
+        self.assertEqual(fastjson.loads(fast), fastjson.loads(slow.decode()))
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(io.BytesIO('{"a": "ж"}'.encode('cp1251')), parser_context={'encoding': 'cp1251'}),
+                         {'a': 'ж'})
+        with self.assertRaises(ParseError):
+            parser.parse(io.BytesIO(b'{"a": '))
+
+
+def checksum_header(data):
+    return 'sha256 ' + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+class ResumableUploadTestCase(ResultTestCase):
+    def setUp(self):
+        super().setUp()
+        self.data = os.urandom(300000)
+
+    def start_upload(self, frame=None, **values):
+        return self.client.post(f'/api/tasks/{self.task.id}/uploads/', dict({
+            'frame': frame or self.frames[0], 'name': '../frame.fits', 'size': len(self.data),
+            'checksum': hashlib.sha256(self.data).hexdigest(),
+        }, **values), format='json')
+
+    def put(self, upload, offset, chunk, checksum=None):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = checksum
+        return self.client.generic('PUT', f'/api/tasks/uploads/{upload}/', chunk,
+                                   content_type='application/offset+octet-stream', **headers)
+
+    def test_upload_is_resumed_and_committed(self):
+        response = self.start_upload()
+        self.assertEqual(response.status_code, 200)
+        upload = response.json()['upload']
+        first = self.data[:100000]
+        self.assertEqual(self.put(upload, 0, first, checksum_header(first))['Upload-Offset'], '100000')
+        response = self.put(upload, 0, first)
+        self.assertEqual((response.status_code, response['Upload-Offset']), (409, '100000'))
+        response = self.put(upload, 100000, self.data[100000:200000], checksum_header(b'other'))
+        self.assertEqual((response.status_code, response['Upload-Offset']), (400, '100000'))
+        self.assertEqual(os.path.getsize(part_path(ResultUpload.objects.get(id=upload))), 100000)
+        self.assertEqual(self.client.post(f'/api/tasks/uploads/{upload}/commit/').status_code, 409)
+        self.assertEqual(self.put(upload, 100000, self.data[100000:]).status_code, 200)
+        self.assertEqual(self.client.head(f'/api/tasks/uploads/{upload}/')['Upload-Offset'], str(len(self.data)))
+        response = self.client.post(f'/api/tasks/uploads/{upload}/commit/')
+        self.assertEqual(response.status_code, 200)
+        result = TaskResult.objects.get(id=response.json()['result'])
+        self.assertEqual((result.frame_id, os.path.basename(result.image.name)), (self.frames[0], 'frame.fits'))
+        with result.image.open('rb') as image:
+            self.assertEqual(image.read(), self.data)
+        self.assertFalse(os.path.exists(part_path(ResultUpload.objects.get(id=upload))))
+        self.assertEqual(self.client.post(f'/api/tasks/uploads/{upload}/commit/').json()['result'], result.id)
+
+    def test_broken_uploads(self):
+        upload = self.start_upload(checksum='0' * 64).json()['upload']
+        self.put(upload, 0, self.data)
+        response = self.client.post(f'/api/tasks/uploads/{upload}/commit/')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TaskResult.objects.exists())
+        other = APIClient()
+        other.force_authenticate(self.author)
+        self.assertEqual(other.get(f'/api/tasks/uploads/{upload}/').status_code, 404)
+        self.assertEqual(self.start_upload(size=0).status_code, 400)
+
+    def test_stale_uploads_expire(self):
+        upload = self.start_upload().json()['upload']
+        self.put(upload, 0, self.data[:1000])
+        ResultUpload.objects.filter(id=upload).update(updated_at=datetime(2000, 1, 1, tzinfo=pytz.UTC))
+        self.assertEqual(expire_uploads(), 1)
+        self.assertFalse(ResultUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media_root, 'uploads')), [])
+
+
+class DirectUploadTestCase(ResultTestCase):
+    def upload_urls(self, size=3):
+        response = self.client.post(f'/api/tasks/{self.task.id}/upload_urls/', {'results': [
+            {'frame': frame, 'point': point, 'name': f'../image {index}.png'}
+            for index, (frame, point) in enumerate(zip(self.frames[:size], self.points))
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['uploads']
+
+    def put(self, upload, data):
+        return APIClient().generic('PUT', upload['url'].replace('http://testserver', ''), data,
+                                   content_type='application/octet-stream')
+
+    def confirm(self, uploads, task_id=None):
+        return self.client.post(f'/api/tasks/{task_id or self.task.id}/confirm_results/',
+                                {'tokens': [upload['token'] for upload in uploads]}, format='json')
+
+    def test_uploaded_images_are_confirmed(self):
+        uploads = self.upload_urls()
+        for index, upload in enumerate(uploads[:2]):
+            self.assertEqual(self.put(upload, bytes([index]) * 1000).status_code, 204)
+        self.assertEqual(self.confirm(uploads).status_code, 400)
+        self.assertFalse(TaskResult.objects.exists())
+        response = self.confirm(uploads[:2])
+        self.assertEqual(response.status_code, 200)
+        results = list(TaskResult.objects.order_by('frame_id'))
+        self.assertEqual([(result.frame_id, result.point_id) for result in results],
+                         list(zip(self.frames[:2], self.points[:2])))
+        with results[1].image.open('rb') as image:
+            self.assertEqual(image.read(), bytes([1]) * 1000)
+        self.assertEqual(self.confirm(uploads[:1]).status_code, 400)
+
+    def test_tokens_are_checked(self):
+        upload = self.upload_urls(size=1)[0]
+        self.assertEqual(self.put(dict(upload, url=upload['url'][:-3] + 'xx/'), b'image').status_code, 403)
+        self.assertEqual(self.put(upload, b'image').status_code, 204)
+        self.assertEqual(self.put(upload, b'other').status_code, 409)
+        self.assertEqual(self.confirm([upload], task_id=self.task.id + 1).status_code, 400)
+        self.assertFalse(TaskResult.objects.exists())
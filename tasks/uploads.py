@@ -0,0 +1,150 @@
+import base64
+import binascii
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytz
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, transaction
+
+from tasks.models import ResultUpload, TaskResult
+
+
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+READ_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def upload_root():
+    return getattr(settings, 'RESULT_UPLOAD_ROOT', os.path.join(settings.MEDIA_ROOT, 'uploads'))
+
+
+def part_path(upload):
+    """The file the chunks of the upload are appended to until it is committed."""
+    return os.path.join(upload_root(), f'{upload.id}.part')
+
+
+def parse_checksum(header):
+    """(algorithm, digest) of an Upload-Checksum header "<algorithm> <base64 digest>", None if there is none."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f'checksum algorithm is not one of {", ".join(CHECKSUM_ALGORITHMS)}')
+    try:
+        return algorithm, base64.b64decode(value.strip(), validate=True)
+    except binascii.Error:
+        raise UploadError('checksum is not base64')
+
+
+def append_chunk(upload, offset, stream, length, checksum=None):
+    """
+    Appends length bytes of the stream at offset, which must be the uploaded size, reading and writing them
+    READ_SIZE bytes at a time. A chunk that is cut short or does not match its checksum is dropped, so the
+    upload can be resumed from its offset. The caller holds the row of the upload locked.
+    """
+    if upload.status != ResultUpload.UPLOADING:
+        raise UploadError('upload is completed', status=409)
+    if offset != upload.offset:
+        raise UploadError('offset is not the uploaded size', status=409)
+    if length > upload.size - upload.offset:
+        raise UploadError('chunk exceeds the size of the upload')
+    digest = hashlib.new(checksum[0]) if checksum else None
+    path = part_path(upload)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'r+b' if os.path.exists(path) else 'w+b') as part:
+        # a write broken off by a dropped connection may have left bytes past the offset
+        part.truncate(offset)
+        part.seek(offset)
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(READ_SIZE, remaining))
+            if not data:
+                break
+            part.write(data)
+            if digest is not None:
+                digest.update(data)
+            remaining -= len(data)
+        if remaining > 0:
+            part.truncate(offset)
+            raise UploadError('chunk is shorter than its length')
+        if digest is not None and digest.digest() != checksum[1]:
+            part.truncate(offset)
+            raise UploadError('chunk does not match its checksum')
+        part.flush()
+        os.fsync(part.fileno())
+    upload.offset = offset + length
+    upload.save(update_fields=['offset', 'updated_at'])
+    return upload
+
+
+class PartFile(File):
+    """The part file handed to the storage: the file system storage moves it in place instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.name
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as part:
+        for data in iter(lambda: part.read(READ_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def commit_upload(upload):
+    """
+    Moves the uploaded file to the storage and creates its TaskResult in the transaction of the caller, which
+    holds the row of the upload locked. The stored image is removed again if the result cannot be created.
+    Committing a completed upload again returns its result.
+    """
+    if upload.status == ResultUpload.COMPLETED:
+        return upload.result
+    if upload.offset != upload.size:
+        raise UploadError('upload is not complete', status=409)
+    path = part_path(upload)
+    if not os.path.exists(path):
+        raise UploadError('part file of the upload is missing', status=410)
+    if upload.checksum and file_checksum(path) != upload.checksum:
+        raise UploadError('upload does not match its checksum')
+    result = TaskResult(task_id=upload.task_id, frame_id=upload.frame_id, point_id=upload.point_id)
+    with open(path, 'rb') as part:
+        result.image.save(upload.name, PartFile(part, name=path), save=False)
+    try:
+        with transaction.atomic():
+            result.save()
+    except IntegrityError:
+        result.image.delete(save=False)
+        raise UploadError('frame or point already has a result', status=409)
+    upload.result = result
+    upload.status = ResultUpload.COMPLETED
+    upload.save(update_fields=['result', 'status', 'updated_at'])
+    # storages that copy rather than move leave the part file behind
+    transaction.on_commit(lambda: remove_part(path))
+    return result
+
+
+def remove_part(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def expire_uploads():
+    """Drops the uploads not completed within RESULT_UPLOAD_EXPIRY seconds, with their part files."""
+    expiry = datetime.now(tz=pytz.UTC) - timedelta(seconds=getattr(settings, 'RESULT_UPLOAD_EXPIRY', 2 * 24 * 60 * 60))
+    uploads = list(ResultUpload.objects.filter(status=ResultUpload.UPLOADING, updated_at__lt=expiry))
+    for upload in uploads:
+        remove_part(part_path(upload))
+    ResultUpload.objects.filter(id__in=[upload.id for upload in uploads]).delete()
+    return len(uploads)
@@ -6,6 +6,8 @@ urlpatterns = [
     re_path(r'^telescopes/$', views.TelescopeView.as_view(), name='telescope_list'),
     re_path(r'^satellites/$', views.SatelliteView.as_view(), name='satellite_list'),
     re_path(r'^satellite_add/$', views.SatelliteCreateView.as_view(), name='satellite_add'),
+    re_path(r'^tle_import/$', views.TLECatalogImportView.as_view(), name='tle_import'),
+    re_path(r'^passes/$', views.SatellitePassesView.as_view(), name='satellite_passes'),
     re_path(r'^inputdata/$', views.InputDataView.as_view(), name='inputdata_list'),
     re_path(r'^get_tasks/$', views.UserTasks.as_view(), name='user_tasks'),
     re_path(r'^task_add/$', views.UserTaskCreateView.as_view(), name='task_add'),
@@ -13,8 +15,16 @@ urlpatterns = [
     re_path(r'^tracking_task/$', views.TrackingTaskCreateView.as_view(), name='tracking_task_add'),
     re_path(r'^tasks_get/$', views.TelescopeTasks.as_view(), name='telescope_tasks'),
     re_path(r'^task_stat/$', views.TaskStatusView.as_view(), name='task_status'),
+    re_path(r'^(?P<pk>\d+)/ingestion/$', views.TaskIngestionView.as_view(), name='task_ingestion'),
     re_path(r'^(?P<pk>\d+)/get_result/$', views.TaskResultView.as_view(), name='task_result'),
     re_path(r'^(?P<task_id>\d+)/add_result/$', views.ResultCreateView.as_view(), name='add_result'),
+    re_path(r'^(?P<task_id>\d+)/add_results/$', views.ResultBatchCreateView.as_view(), name='add_results'),
+    re_path(r'^(?P<task_id>\d+)/uploads/$', views.ResultUploadCreateView.as_view(), name='result_upload_add'),
+    re_path(r'^uploads/(?P<pk>\d+)/$', views.ResultUploadView.as_view(), name='result_upload'),
+    re_path(r'^uploads/(?P<pk>\d+)/commit/$', views.ResultUploadCommitView.as_view(), name='result_upload_commit'),
+    re_path(r'^(?P<task_id>\d+)/upload_urls/$', views.UploadURLView.as_view(), name='upload_urls'),
+    re_path(r'^(?P<task_id>\d+)/confirm_results/$', views.UploadConfirmView.as_view(), name='confirm_results'),
+    re_path(r'^upload_target/(?P<token>[^/]+)/$', views.UploadTargetView.as_view(), name='upload_target'),
     re_path(r'^requests/$', views.BalanceRequestView.as_view(), name='requests'),
     re_path(r'^save_request/$', views.BalanceRequestCreateView.as_view(), name='save_request'),
     re_path(r'^telescopes_with_balances/$', views.TelescopeChoosingView.as_view(), name='telescope_with_balances'),
@@ -0,0 +1,122 @@
+import numpy as np
+
+from tasks import jdtime
+from tasks.models import AbstractSpherePoint
+
+
+def collect_column(items, name, errors, kind='float'):
+    """
+    Collects item[name] of every row into a float64 array.
+    Rows with a missing or non-numeric value get NaN and an entry in errors[index].
+    """
+    values = [item.get(name, None) for item in items]
+    missing = [index for index, value in enumerate(values) if value is None]
+    for index in missing:
+        errors.setdefault(index, {})[name] = f'{name} is None'
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        column = np.full(len(values), np.nan)
+        for index, value in enumerate(values):
+            if value is None:
+                continue
+            try:
+                column[index] = float(value)
+            except (TypeError, ValueError):
+                errors.setdefault(index, {})[name] = f'{name} is not {kind}'
+        return column
+
+
+def _first_failures(checks, size):
+    """Applies (mask, field, reason) checks in order and keeps the first failure of each row."""
+    failures = {}
+    remaining = np.ones(size, dtype=bool)
+    for mask, field, reason in checks:
+        failed = mask & remaining
+        for index in np.flatnonzero(failed).tolist():
+            failures[index] = {field: reason}
+        remaining &= ~failed
+    return failures
+
+
+def _merge(*groups):
+    errors = {}
+    for group in groups:
+        for index, error in group.items():
+            errors.setdefault(index, {}).update(error)
+    return errors
+
+
+def validate_moments(dt, jd, now):
+    size = len(dt)
+    return _first_failures((
+        (np.isnat(dt), 'dt', 'dt is None'),
+        (~(dt > np.datetime64(now.replace(tzinfo=None), 'us')), 'dt', 'dt is not in the future'),
+        (~((jd >= 0.0) & (jd < 1.0)), 'jd', 'jd is not in [0..1)'),
+    ), size)
+
+
+def validate_points(alpha, beta, cs_type, dt, jd, now):
+    """
+    Columnar equivalent of Point.validate_point + Point.validate_moment + Point.validate.
+    Returns {index: {field: reason}} for the failed rows only.
+    """
+    size = len(alpha)
+    earth = cs_type == AbstractSpherePoint.EARTH_SYSTEM
+    stars = cs_type == AbstractSpherePoint.STARS_SYSTEM
+    known = earth | stars
+    sphere = _first_failures((
+        (~((alpha >= 0.0) & (alpha < 360.0)), 'alpha', 'alpha is not in [0..360)'),
+        (earth & ~((beta >= 0.0) & (beta <= 90.0)), 'beta', 'beta is not in [0..90]'),
+        (stars & ~((beta >= 0.0) & (beta <= 180.0)), 'beta', 'beta is not in [0..180]'),
+    ), size)
+    system = _first_failures((
+        (~known, 'cs_type', 'cs_type is not in [EARTH_SYSTEM, STARS_SYSTEM]'),
+    ), size)
+    return _merge(sphere, validate_moments(dt, jd, now), system)
+
+
+def validate_frames(mag, exposure, dt, jd, now):
+    """
+    Columnar equivalent of Frame.validate_frame + Frame.validate_moment.
+    Returns {index: {field: reason}} for the failed rows only.
+    """
+    size = len(exposure)
+    frame = _first_failures((
+        (np.isnan(mag), 'mag', 'mag is not float'),
+        (~(exposure > 0.0), 'exposure', 'exposure is not positive'),
+    ), size)
+    return _merge(frame, validate_moments(dt, jd, now))
+
+
+def _moment_columns(rows, errors):
+    dt = np.full(len(rows), np.datetime64('NaT', 'us'))
+    for index, row in enumerate(rows):
+        if row.get('dt', None) is not None:
+            dt[index] = jdtime.from_datetimes([row['dt']])[0]
+    return dt, collect_column(rows, 'jd', errors)
+
+
+def keep_type_errors(errors, rule_errors):
+    for index, error in rule_errors.items():
+        errors.setdefault(index, error)
+    return errors
+
+
+def validate_point_rows(rows, now):
+    """Validates already parsed rows (e.g. serializer data); type errors hide the range errors of the same row."""
+    errors = {}
+    alpha = collect_column(rows, 'alpha', errors)
+    beta = collect_column(rows, 'beta', errors)
+    cs_type = collect_column(rows, 'cs_type', errors, kind='int')
+    dt, jd = _moment_columns(rows, errors)
+    return keep_type_errors(errors, validate_points(alpha, beta, cs_type, dt, jd, now))
+
+
+def validate_frame_rows(rows, now):
+    """Validates already parsed rows (e.g. serializer data); type errors hide the range errors of the same row."""
+    errors = {}
+    mag = collect_column(rows, 'mag', errors)
+    exposure = collect_column(rows, 'exposure', errors)
+    dt, jd = _moment_columns(rows, errors)
+    return keep_type_errors(errors, validate_frames(mag, exposure, dt, jd, now))
@@ -1,27 +1,54 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+import io
+import itertools
 import locale
+import math
+import zlib
 import pytz
 import julian
-from django.db.models import Q
+import numpy as np
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
 
 from django.shortcuts import get_object_or_404
-from django.http import QueryDict
-from rest_framework import generics
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import HttpResponse, QueryDict
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags, quote_etag
+from rest_framework import generics, permissions
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
-from rest_framework.utils import json
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
 
-from tasks.models import Telescope, Satellite, InputData, Task, BalanceRequest, AbstractTimeMoment, Point, Frame
+from tasks.models import Telescope, Satellite, InputData, Task, BalanceRequest, Point, IngestionJob, TLEData, \
+    ResultUpload
 from tasks.serializers import (
     TelescopeSerializer, TelescopeBalanceSerializer, SatelliteSerializer,
-    InputDataSerializer, PointSerializer, BalanceRequestSerializer, TaskStatusSerializer,
-    BalanceRequestCreateSerializer, TaskSerializer, TaskResultSerializer, FrameSerializer, TelescopeTaskSerializer,
-    ResultSerializer
+    InputDataSerializer, BalanceRequestSerializer, TaskStatusSerializer,
+    BalanceRequestCreateSerializer, TaskSerializer, TaskResultSerializer, TelescopeTaskSerializer,
+    ResultSerializer, ResultBatchSerializer, ResultUploadSerializer, UploadURLSerializer, UploadConfirmSerializer,
+    IngestionJobSerializer, TLETrackSerializer, PassPredictionSerializer
 )
-from tasks.helpers import telescope_collision_task_message, get_points_json, get_track_json, get_frames_json
-
-
-DT_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+from tasks.helpers import get_points_json, get_track_json, get_frames_json, is_float
+from tasks.catalog import TLECatalogImport
+from tasks.compression import CompressionMixin
+from tasks.ingestion import PlanIngestion, PlanColumns, SlotCollisionError, POINT_FIELDS, FRAME_FIELDS
+from tasks.jdtime import DT_FORMAT
+from tasks.jsonstream import JSONObjectStream, JSONStreamError
+from tasks.passes import PassPredictor
+from tasks.parsers import PlanBinaryParser
+from tasks.renderers import PlanColumnsJSONRenderer, PlanColumnsRenderer
+from tasks import compression, directupload, propagation
+from tasks.propagation import parse_tle, TLEError
+from tasks.plans import get_plan, get_plan_body, store_plan_body, parse_cursor, sync_plan
+from tasks.slew import optimize_plan_points
+from tasks.streaming import StreamingJSONMixin, StreamingListMixin, StreamingRetrieveMixin
+from tasks.tasks import ingest_plan
+from tasks.uploads import UploadError, append_chunk, commit_upload, parse_checksum
 
 
 class TelescopeView(generics.ListAPIView):
@@ -54,7 +81,72 @@ class SatelliteCreateView(generics.CreateAPIView):
         })
 
 
-class InputDataView(generics.ListAPIView):
+class TLECatalogImportView(generics.GenericAPIView):
+    permission_classes = (permissions.IsAdminUser,)
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file', None)
+        if upload is not None:
+            lines = (line.decode('utf-8', errors='replace') for line in upload)
+        elif isinstance(request.data.get('data_tle', None), str):
+            lines = request.data['data_tle'].split('\n')
+        else:
+            return Response(data={'file': 'file or data_tle is required'}, status=400)
+        catalog = TLECatalogImport()
+        stats = catalog.run(lines)
+        return Response(data={
+            'msg': f'Загружено элементов TLE: {stats["created"] + stats["updated"]}',
+            'status': 'ok',
+            **stats,
+            'errors': catalog.errors,
+        })
+
+
+class SatellitePassesView(generics.GenericAPIView):
+    serializer_class = PassPredictionSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        params = serializer.validated_data
+        telescope = params['telescope']
+        start_dt = params['start_dt'].astimezone(pytz.UTC)
+        end_dt = params['end_dt'].astimezone(pytz.UTC)
+        elements = TLEData.current(params.get('satellites', None))
+        numbers = sorted(elements)
+        predictor = PassPredictor(
+            propagation.satrecs(elements[number] for number in numbers),
+            telescope.latitude, telescope.longitude, telescope.altitude,
+            min_elevation=params['min_elevation'], step=getattr(settings, 'PASS_SCREENING_STEP', 60.0)
+        )
+        passes = predictor.predict(np.datetime64(start_dt.replace(tzinfo=None), 'us'),
+                                   np.datetime64(end_dt.replace(tzinfo=None), 'us')) if numbers else []
+
+        def moment(seconds):
+            if seconds is None:
+                return None
+            return (start_dt + timedelta(seconds=seconds)).strftime(DT_FORMAT)
+
+        return Response(data={
+            'telescope': telescope.id,
+            'start_dt': start_dt.strftime(DT_FORMAT),
+            'end_dt': end_dt.strftime(DT_FORMAT),
+            'min_elevation': params['min_elevation'],
+            'passes': [{
+                'satellite': numbers[item.index],
+                'header': elements[numbers[item.index]].header,
+                'rise_dt': moment(item.rise),
+                'culmination_dt': moment(item.culmination),
+                'set_dt': moment(item.set),
+                'max_elevation': item.max_elevation,
+                'culmination_azimuth': item.culmination_azimuth,
+            } for item in passes],
+            'missing': sorted(set(params.get('satellites', [])) - set(numbers)),
+        })
+
+
+class InputDataView(CompressionMixin, StreamingListMixin, generics.ListAPIView):
     serializer_class = InputDataSerializer
 
     def get_queryset(self):
@@ -64,7 +156,107 @@ class InputDataView(generics.ListAPIView):
 
 class UserTaskCreateView(generics.CreateAPIView):
     serializer_class = TaskSerializer
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES + [PlanBinaryParser]
+    task_type = None
+
+    def is_async(self):
+        return self.request.query_params.get('async', '').lower() in ('1', 'true')
+
+    def is_binary(self):
+        media_type = (self.request.content_type or '').split(';')[0].strip()
+        return media_type == PlanBinaryParser.media_type
+
+    def get_tle_ingestion(self, validated_data, data):
+        if validated_data.get('task_type', None) != Task.TRACKING_MODE:
+            return None, None, {'task_type': 'TLE data needs TRACKING_MODE task_type'}
+        try:
+            elements = parse_tle(validated_data['data_tle'])
+        except TLEError as e:
+            return None, None, {'data_tle': str(e)}
+        if len(elements) != 1:
+            return None, None, {'data_tle': 'TLE should describe exactly one satellite'}
+        params_serializer = TLETrackSerializer(data=data)
+        if not params_serializer.is_valid():
+            return None, None, params_serializer.errors
+        params = params_serializer.validated_data
+        dt, azimuth, elevation = propagation.track(elements[0], validated_data['telescope'],
+                                                   params['start_dt'], params['end_dt'], params['step'])
+        if not len(dt) > 0:
+            return None, None, {'data_tle': 'satellite is below the horizon of the telescope during the time window'}
+        points = PlanColumns.from_arrays('points', POINT_FIELDS, {'dt': dt, 'alpha': azimuth, 'beta': elevation},
+                                         constants={'cs_type': Point.EARTH_SYSTEM})
+        frames = PlanColumns.from_arrays('frames', FRAME_FIELDS, {'dt': dt},
+                                         constants={'exposure': params['exposure'], 'mag': params['mag']})
+        ingestion = PlanIngestion.from_columns(points, frames)
+        if not ingestion.is_valid():
+            return None, None, ingestion.errors
+        return ingestion, elements[0], None
+
+    def post(self, request, *args, **kwargs):
+        # a collision leaves the atomic creation methods as an exception, so the task is rolled back
+        try:
+            if self.is_binary():
+                return self.create_from_binary(request)
+            return self.create(request, *args, **kwargs)
+        except SlotCollisionError as e:
+            return Response(data={'msg': str(e), 'status': 'error'}, status=400)
+
+    def create_from_binary(self, request):
+        meta = request.data['meta']
+        points = request.data['points']
+        constants = {}
+        if 'cs_type' not in points:
+            cs_type = meta.get('cs_type', Point.EARTH_SYSTEM)
+            if type(cs_type) is not int or cs_type not in (Point.EARTH_SYSTEM, Point.STARS_SYSTEM):
+                return Response({'cs_type': 'cs_type is not in [EARTH_SYSTEM, STARS_SYSTEM]'}, status=400)
+            constants['cs_type'] = cs_type
+        return self.create_from_columns(request, {
+            'telescope': meta.get('telescope', None),
+            'satellite': meta.get('satellite', None),
+            'task_type': self.task_type or meta.get('task_type', None),
+            'priority': meta.get('priority', 0),
+            'data_tle': '',
+        }, PlanColumns.from_arrays('points', POINT_FIELDS, points, constants=constants),
+            PlanColumns.from_arrays('frames', FRAME_FIELDS, request.data['frames']),
+            summary=meta, is_async=self.is_async())
+
+    def accept_ingestion(self, inputtask):
+        job = IngestionJob.objects.create(task=inputtask)
+        transaction.on_commit(lambda: ingest_plan.delay(job.id))
+        return Response(data={
+            'msg': f'Задание №{inputtask.id} принято в обработку',
+            'status': 'accepted',
+            'task': inputtask.id,
+            'url': f'{inputtask.id}/ingestion/',
+        }, status=202)
+
+    @transaction.atomic
+    def create_from_columns(self, request, task_data, points, frames, summary, is_async=False):
+        task_serializer = self.get_serializer(data=task_data)
+        if not task_serializer.is_valid():
+            return Response(task_serializer.errors, status=400)
+        ingestion = PlanIngestion.from_columns(points, frames)
+        if not ingestion.is_valid():
+            return Response(ingestion.errors, status=400)
+        inputtask = task_serializer.save(request.user)
+        data_serializer = InputDataSerializer(data={
+            'task': inputtask.id,
+            'data_tle': '',
+            'data_json': ingestion.to_record(summary),
+        }, context=self.get_serializer_context())
+        if not data_serializer.is_valid():
+            transaction.set_rollback(True)
+            return Response(data_serializer.errors, status=400)
+        data_serializer.save()
+        if is_async:
+            return self.accept_ingestion(inputtask)
+        ingestion.save(inputtask)
+        return Response(data={
+            'msg': f'Задание №{inputtask.id} успешно создано',
+            'status': 'ok'
+        })
 
+    @transaction.atomic
     def create(self, request, *args, **kwargs):
         data = request.data
         if isinstance(data, QueryDict):
@@ -73,76 +265,40 @@ class UserTaskCreateView(generics.CreateAPIView):
         task_serializer = task_serializer_class(data=data, context=self.get_serializer_context())
         if not task_serializer.is_valid():
             return Response(task_serializer.errors, status=400)
+        plan = task_serializer.validated_data.get('data_json', None)
+        data_tle = task_serializer.validated_data.get('data_tle', '')
+        is_async = plan is not None and self.is_async()
+        ingestion = None
+        element = None
+        if plan is not None and not is_async:
+            ingestion = PlanIngestion(plan)
+            if not ingestion.is_valid():
+                return Response(ingestion.errors, status=400)
+        elif plan is None and len(data_tle) > 0:
+            ingestion, element, errors = self.get_tle_ingestion(task_serializer.validated_data, data)
+            if errors:
+                return Response(errors, status=400)
         inputtask = task_serializer.save(request.user)
         data.update(task=inputtask.id)
         data_serializer = InputDataSerializer(data=data, context=self.get_serializer_context())
         if not data_serializer.is_valid():
+            transaction.set_rollback(True)
             return Response(data_serializer.errors, status=400)
         inputdata = data_serializer.save()
-        if inputdata.data_type == InputData.JSON:
-            min_dt = datetime.max.replace(tzinfo=pytz.UTC)
-            max_dt = datetime.min.replace(tzinfo=pytz.UTC)
-            if inputtask.task_type in [Task.POINTS_MODE, Task.TRACKING_MODE]:
-                plan = inputdata.data_json
-                points = plan.get('points', None)
-                if points is None:
-                    return Response({"points": "points is None"}, status=400)
-                if not len(points) > 0:
-                    return Response({"points": "points is Empty"}, status=400)
-                for point in points:
-                    dt = datetime.strptime(point['dt'], DT_FORMAT).replace(tzinfo=pytz.UTC)
-                    if min_dt > dt:
-                        min_dt = dt
-                    if max_dt < dt:
-                        max_dt = dt
-                    jdn, jdf = AbstractTimeMoment.dt_to_jdn_jdf(dt)
-                    point['jdn'] = jdn
-                    point['jd'] = jdf
-                    point['task'] = inputtask.id
-                point_serializer = PointSerializer(data=points, many=True)
-                if not point_serializer.is_valid():
-                    errors = {}
-                    for error in point_serializer.errors:
-                        errors.update(error)
-                    return Response(errors, status=400)
-                point_serializer.save()
-                frames = plan.get('frames', None)
-                if frames is None:
-                    return Response({"frames": "frames is None"}, status=400)
-                if not len(frames) > 0:
-                    return Response({"frames": "frames is Empty"}, status=400)
-                for frame in frames:
-                    dt = datetime.strptime(frame['dt'], DT_FORMAT).replace(tzinfo=pytz.UTC)
-                    if min_dt > dt:
-                        min_dt = dt
-                    if max_dt < dt:
-                        max_dt = dt
-                    jdn, jdf = AbstractTimeMoment.dt_to_jdn_jdf(dt)
-                    frame['jdn'] = jdn
-                    frame['jd'] = jdf
-                    frame['task'] = inputtask.id
-                frames_serializer = FrameSerializer(data=frames, many=True)
-                if not frames_serializer.is_valid():
-                    errors = {}
-                    for error in frames_serializer.errors:
-                        errors.update(error)
-                    return Response(errors, status=400)
-                frames_serializer.save()
-            else:
-                return Response(data_serializer.errors, status=400)
-            jdn1, jdf1 = AbstractTimeMoment.dt_to_jdn_jdf(min_dt)
-            inputtask.start_dt = min_dt
-            inputtask.start_jd = jdf1 + jdn1
-            inputtask.jdn = jdn1
-            jdn2, jdf2 = AbstractTimeMoment.dt_to_jdn_jdf(max_dt)
-            inputtask.end_dt = max_dt
-            inputtask.end_jd = jdf2 + jdn2
+        if inputdata.data_type == InputData.JSON and is_async:
+            return self.accept_ingestion(inputtask)
+        elif inputdata.data_type == InputData.JSON:
+            ingestion.save(inputtask)
         elif inputdata.data_type == InputData.TLE:
-            return Response(data_serializer.errors, status=501)
+            satellite, created = Satellite.objects.get_or_create(number=element.number, defaults={'name': element.header or ''})
+            if inputtask.satellite is None:
+                inputtask.satellite = satellite
+            TLEData.objects.create(task=inputtask, satellite=satellite, header=element.header and element.header[:25],
+                                   line1=element.line1, line2=element.line2, epoch=element.epoch)
+            ingestion.save(inputtask)
         else:
+            transaction.set_rollback(True)
             return Response(data_serializer.errors, status=400)
-        inputtask.status = Task.CREATED
-        inputtask.save()
         return Response(data={
             'msg': f'Задание №{inputtask.id} успешно создано',
             'status': 'ok'
@@ -150,6 +306,7 @@ class UserTaskCreateView(generics.CreateAPIView):
 
 
 class PointTaskCreateView(UserTaskCreateView):
+    task_type = Task.POINTS_MODE
 
     def create(self, request, *args, **kwargs):
         data = request.data
@@ -177,13 +334,20 @@ class PointTaskCreateView(UserTaskCreateView):
             data.update(satellite=satellite)
         data.update(task_type=task_type)
         data.update(data_tle='')
-        data.update(data_json=json.dumps({'points': points, 'frames': frames}))
+        data.update(data_json={'points': points, 'frames': frames})
         return super().create(request, *args, **kwargs)
 
 
 class TrackingTaskCreateView(UserTaskCreateView):
+    task_type = Task.TRACKING_MODE
+
+    def is_streaming(self):
+        media_type = (self.request.content_type or '').split(';')[0].strip()
+        return media_type == 'application/json' and not self.is_async()
 
     def create(self, request, *args, **kwargs):
+        if self.is_streaming():
+            return self.create_from_stream(request)
         data = request.data
         if isinstance(data, QueryDict):
             data._mutable = True
@@ -206,9 +370,41 @@ class TrackingTaskCreateView(UserTaskCreateView):
         data.update(satellite=satellite)
         data.update(task_type=task_type)
         data.update(data_tle='')
-        data.update(data_json=json.dumps({'points': points, 'frames': frames}))
+        data.update(data_json={'points': points, 'frames': frames})
         return super().create(request, *args, **kwargs)
 
+    def create_from_stream(self, request):
+        points = PlanColumns('points', POINT_FIELDS, constants={'cs_type': Point.EARTH_SYSTEM})
+        frames = PlanColumns('frames', FRAME_FIELDS, constants={'mag': None})
+        columns = {'track_points': points, 'frames': frames}
+        values = {}
+        if request.stream is None:
+            return Response({'detail': 'request body is empty'}, status=400)
+        try:
+            for event, key, value in JSONObjectStream(request.stream, stream_keys=columns):
+                if event == 'item':
+                    columns[key].append(value)
+                else:
+                    values[key] = value
+        except JSONStreamError as e:
+            return Response({'detail': f'JSON parse error - {e}'}, status=400)
+        tracking_data = values.get('tracking_data', None)
+        if not isinstance(tracking_data, dict):
+            return Response({'tracking_data': 'tracking_data is not dict'}, status=400)
+        mag = tracking_data.get('mag', None)
+        if mag is None:
+            return Response({'mag': 'mag is None'}, status=400)
+        if not is_float(mag):
+            return Response({'mag': 'mag is not float'}, status=400)
+        frames.set_constant('mag', float(mag))
+        return self.create_from_columns(request, {
+            'telescope': values.get('telescope', None),
+            'satellite': tracking_data.get('satellite_id', None),
+            'task_type': self.task_type,
+            'priority': values.get('priority', 0),
+            'data_tle': '',
+        }, points, frames, summary={'tracking_data': tracking_data})
+
 
 class BalanceRequestView(generics.ListAPIView):
     serializer_class = BalanceRequestSerializer
@@ -229,51 +425,138 @@ class BalanceRequestCreateView(generics.CreateAPIView):
         return Response(data=f'Заявка №{request.id} успешна создана')
 
 
-class UserTasks(generics.ListAPIView):
+class UserTasks(CompressionMixin, StreamingListMixin, generics.ListAPIView):
     serializer_class = TaskSerializer
 
     def get_queryset(self):
         return Task.objects.filter(author=self.request.user).order_by('-id')
 
 
-class TaskResultView(generics.RetrieveAPIView):
+class TaskResultView(CompressionMixin, StreamingRetrieveMixin, generics.RetrieveAPIView):
     serializer_class = TaskResultSerializer
+    streamed_fields = ('results',)
     queryset = Task.objects.all()
 
 
-class TelescopeTasks(generics.ListAPIView):
+class TaskIngestionView(generics.RetrieveAPIView):
+    serializer_class = IngestionJobSerializer
+    lookup_field = 'task_id'
+    lookup_url_kwarg = 'pk'
+
+    def get_queryset(self):
+        return IngestionJob.objects.filter(task__author=self.request.user)
+
+
+class TelescopeTasks(CompressionMixin, StreamingJSONMixin, generics.ListAPIView):
+    """
+    The plan of the telescope for the current night. Responses carry an ETag made of the plan version
+    (and the query parameters), so polling with If-None-Match costs two lookups and a 304 until the plan changes.
+    Compressed plans are stored with the plan until it changes, so they are not compressed again on every poll.
+    With since (the cursor of the previous response, empty for the first sync) and/or horizon (a julian date,
+    PLAN_SYNC_HORIZON days ahead by default) the plan is synchronized across nights instead, see plans.sync_plan.
+    """
     serializer_class = TelescopeTaskSerializer
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [PlanColumnsJSONRenderer, PlanColumnsRenderer]
+
+    def is_sync(self):
+        return 'since' in self.request.query_params or 'horizon' in self.request.query_params
+
+    def get_sync_plan(self):
+        telescope = get_object_or_404(Telescope, user=self.request.user)
+        since = self.request.query_params.get('since', '')
+        cursor = None
+        if since:
+            cursor = parse_cursor(since)
+            if cursor is None:
+                raise ValidationError({'since': 'since is not a cursor'})
+        now = datetime.now(tz=pytz.UTC)
+        horizon = self.request.query_params.get('horizon', None)
+        if horizon is None:
+            horizon = julian.to_jd(now.replace(tzinfo=None)) + getattr(settings, 'PLAN_SYNC_HORIZON', 1.0)
+        elif not is_float(horizon) or not math.isfinite(float(horizon)):
+            raise ValidationError({'horizon': 'horizon is not float'})
+        plan = sync_plan(telescope.id, cursor, now, float(horizon))
+        plan['telescope'] = telescope.to_dict()
+        plan['telescope']['avatar'] = None
+        plan['jdn'] = int(julian.to_jd(now.replace(tzinfo=None)))
+        return plan
+
+    def get_stored_plan(self):
+        if not hasattr(self, '_stored_plan'):
+            self._telescope = get_object_or_404(Telescope, user=self.request.user)
+            jdn = int(julian.to_jd(datetime.now()))
+            self._stored_plan = get_plan(self._telescope.id, jdn)
+        return self._telescope, self._stored_plan
+
+    def get_etag(self):
+        telescope, stored = self.get_stored_plan()
+        tag = f'{telescope.id}-{stored.jdn}-{stored.version}'
+        query = self.request.query_params.urlencode()
+        if query:
+            tag += f'-{zlib.crc32(query.encode()):08x}'
+        renderer_format = self.request.accepted_renderer.format
+        if renderer_format != 'json':
+            tag += f'-{renderer_format}'
+        return quote_etag(tag)
+
+    def list(self, request, *args, **kwargs):
+        if self.is_sync():
+            return super().list(request, *args, **kwargs)
+        etag = self.get_etag()
+        # compression by a proxy may weaken the tag the client sends back
+        matches = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))]
+        if etag in matches or '*' in matches:
+            return Response(status=304, headers={'ETag': etag, 'Vary': 'Accept, Accept-Encoding'})
+        coding = compression.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is not None:
+            telescope, stored = self.get_stored_plan()
+            cached = get_plan_body(stored, etag, coding)
+            if cached is not None:
+                response = HttpResponse(bytes(cached.body), content_type=cached.content_type)
+                response['Content-Encoding'] = coding
+                response['ETag'] = 'W/' + etag
+                response['Vary'] = 'Accept, Accept-Encoding'
+                return response
+            # rendered whole, so that finalize_response can store the compressed body
+            self._plan_body = (stored, etag, coding)
+        elif self.is_streaming():
+            plan = self.get_queryset()[0]
+            chunks = itertools.chain(
+                [b'['], self.iter_object(plan, {'points': plan['points'], 'frames': plan['frames']}), [b']']
+            )
+            return self.streaming_response(chunks, headers={'ETag': etag, 'Vary': 'Accept'})
+        response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        plan_body = getattr(self, '_plan_body', None)
+        if plan_body is not None and response.get('Content-Encoding', None) == plan_body[2] and not response.streaming:
+            store_plan_body(*plan_body, response['Content-Type'], response.content)
+        return response
 
     def get_queryset(self):
+        if self.is_sync():
+            return [self.get_sync_plan()]
         plan = {}
-        telescope = get_object_or_404(Telescope, user=self.request.user)
-        telescope_id = telescope.id
+        telescope, stored = self.get_stored_plan()
         plan['telescope'] = telescope.to_dict()
         plan['telescope']['avatar'] = None
-        jdn = int(julian.to_jd(datetime.now()))
-        plan['jdn'] = jdn
-        tasks = Task.objects.filter(Q(
-            status=Task.CREATED,
-            telescope_id=telescope_id,
-            jdn=jdn
-        )).order_by('start_dt')
-        plan['points'] = []
-        plan['frames'] = []
-        for task in tasks:
-            points = Point.objects.filter(task=task).order_by('dt')
-            for point in points:
-                p = point.to_dict()
-                p['task_type'] = task.task_type
-                if task.satellite is not None:
-                    p['satellite'] = task.satellite.number
-                plan['points'].append(p)
-            frames = Frame.objects.filter(task=task).order_by('dt')
-            for frame in frames:
-                f = frame.to_dict()
-                f['task_type'] = task.task_type
-                if task.satellite is not None:
-                    f['satellite'] = task.satellite.number
-                plan['frames'].append(f)
+        plan['jdn'] = stored.jdn
+        plan['points'] = stored.points
+        plan['frames'] = stored.frames
+        if self.request.query_params.get('optimize', '').lower() in ('1', 'true'):
+            tolerance = self.request.query_params.get('tolerance', None)
+            if tolerance is None or not is_float(tolerance) or not 0 <= float(tolerance) < float('inf'):
+                tolerance = getattr(settings, 'PLAN_TIME_TOLERANCE', 300.0)
+            for item in plan['points'] + plan['frames']:
+                item['dt'] = parse_datetime(item['dt'])
+            plan['slew'] = optimize_plan_points(
+                plan, float(tolerance),
+                getattr(settings, 'PLAN_SLEW_RATE', 3.0), getattr(settings, 'PLAN_SLEW_SETTLE', 2.0)
+            )
         return [plan]
 
 
@@ -305,3 +588,181 @@ class ResultCreateView(generics.CreateAPIView):
             'msg': f'Результат №{result.id} успешно обновлен',
             'status': 'ok'
         })
+
+
+class ResultBatchCreateView(generics.CreateAPIView):
+    """
+    Many results of a task in one multipart request, see ResultBatchSerializer. Images are spooled to temporary
+    files chunk by chunk while the body is parsed, never held in memory, and handed to the storage from there.
+    """
+    serializer_class = ResultBatchSerializer
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['task_id'] = int(self.kwargs['task_id'])
+        return context
+
+    @transaction.atomic
+    def create(self, request, *args, **kwargs):
+        result_serializer = self.get_serializer(data=request.data)
+        if not result_serializer.is_valid():
+            return Response(result_serializer.errors, status=400)
+        try:
+            results = result_serializer.save()
+        except UploadError as e:
+            return Response({'detail': str(e), 'results': result_serializer.conflicts}, status=e.status)
+        return Response(data={
+            'msg': f'Результаты задания №{self.kwargs["task_id"]} успешно сохранены ({len(results)})',
+            'status': 'ok'
+        })
+
+
+class ResultUploadCreateView(generics.CreateAPIView):
+    """Starts a resumable upload of the image of a result, see ResultUploadView."""
+    serializer_class = ResultUploadSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['task_id'] = int(self.kwargs['task_id'])
+        return context
+
+    def create(self, request, *args, **kwargs):
+        upload_serializer = self.get_serializer(data=request.data)
+        if not upload_serializer.is_valid():
+            return Response(upload_serializer.errors, status=400)
+        upload = upload_serializer.save()
+        return Response(data={
+            'msg': f'Загрузка №{upload.id} успешно создана',
+            'status': 'ok',
+            'upload': upload.id,
+            'url': f'uploads/{upload.id}/',
+        })
+
+
+class ResultUploadView(generics.RetrieveAPIView):
+    """
+    A resumable upload: GET or HEAD tell the uploaded size (also in the Upload-Offset header), PUT appends
+    the body at the Upload-Offset header, checked against the optional Upload-Checksum header
+    ("sha256 <base64 digest>"). A chunk that fails is dropped whole, so the upload goes on from the same offset.
+    """
+    serializer_class = ResultUploadSerializer
+
+    def get_queryset(self):
+        return ResultUpload.objects.filter(task__telescope__user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        upload = self.get_object()
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+    def put(self, request, *args, **kwargs):
+        offset = request.META.get('HTTP_UPLOAD_OFFSET', '')
+        length = request.META.get('CONTENT_LENGTH', '') or '0'
+        if not offset.isdigit():
+            return Response({'detail': 'Upload-Offset is not int'}, status=400)
+        if not length.isdigit():
+            return Response({'detail': 'Content-Length is not int'}, status=400)
+        upload = None
+        try:
+            checksum = parse_checksum(request.META.get('HTTP_UPLOAD_CHECKSUM', ''))
+            with transaction.atomic():
+                upload = get_object_or_404(self.get_queryset().select_for_update(nowait=True), pk=self.kwargs['pk'])
+                append_chunk(upload, int(offset), request.stream or io.BytesIO(), int(length), checksum)
+        except UploadError as e:
+            headers = {'Upload-Offset': str(ResultUpload.objects.get(pk=upload.pk).offset)} if upload else None
+            return Response({'detail': str(e)}, status=e.status, headers=headers)
+        except DatabaseError:
+            return Response({'detail': 'another chunk of the upload is being written'}, status=409)
+        return Response(self.get_serializer(upload).data, headers={'Upload-Offset': str(upload.offset)})
+
+
+class ResultUploadCommitView(generics.GenericAPIView):
+    """Attaches a fully uploaded image to a new result of the task; repeating the commit returns the same result."""
+
+    def get_queryset(self):
+        return ResultUpload.objects.filter(task__telescope__user=self.request.user)
+
+    def post(self, request, *args, **kwargs):
+        try:
+            with transaction.atomic():
+                upload = get_object_or_404(self.get_queryset().select_for_update(), pk=self.kwargs['pk'])
+                result = commit_upload(upload)
+        except UploadError as e:
+            return Response({'detail': str(e)}, status=e.status)
+        return Response(data={
+            'msg': f'Результат №{result.id} успешно обновлен',
+            'status': 'ok',
+            'result': result.id,
+        })
+
+
+class UploadURLView(generics.CreateAPIView):
+    """
+    Signed URLs the telescope uploads images to directly (see tasks.directupload), valid for
+    RESULT_UPLOAD_URL_MAX_AGE seconds; the results are created by confirming the tokens, see UploadConfirmView.
+    """
+    serializer_class = UploadURLSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['task_id'] = int(self.kwargs['task_id'])
+        return context
+
+    def create(self, request, *args, **kwargs):
+        upload_serializer = self.get_serializer(data=request.data)
+        if not upload_serializer.is_valid():
+            return Response(upload_serializer.errors, status=400)
+        return Response(data={
+            'msg': f'Ссылки для загрузки снимков задания №{self.kwargs["task_id"]} успешно созданы',
+            'status': 'ok',
+            'uploads': upload_serializer.get_uploads(),
+        })
+
+
+class UploadConfirmView(generics.CreateAPIView):
+    serializer_class = UploadConfirmSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['task_id'] = int(self.kwargs['task_id'])
+        return context
+
+    def create(self, request, *args, **kwargs):
+        confirm_serializer = self.get_serializer(data=request.data)
+        if not confirm_serializer.is_valid():
+            return Response(confirm_serializer.errors, status=400)
+        try:
+            with transaction.atomic():
+                results = confirm_serializer.save()
+        except IntegrityError:
+            return Response({'detail': 'frame or point already has a result'}, status=409)
+        return Response(data={
+            'msg': f'Результаты задания №{self.kwargs["task_id"]} успешно сохранены ({len(results)})',
+            'status': 'ok'
+        })
+
+
+class UploadTargetView(APIView):
+    """
+    The local stand-in of the storage for signed uploads: the PUT body is written to the default storage
+    under the key signed into the token, which is the only credential.
+    """
+    authentication_classes = ()
+    permission_classes = (permissions.AllowAny,)
+
+    def put(self, request, token, *args, **kwargs):
+        if not isinstance(directupload.get_backend(), directupload.LocalUploadBackend):
+            return Response({'detail': 'Not found.'}, status=404)
+        entry = directupload.load_token(token, directupload.url_max_age())
+        if entry is None:
+            return Response({'detail': 'token is not valid'}, status=403)
+        if default_storage.exists(entry['key']):
+            return Response({'detail': 'image is already uploaded'}, status=409)
+        name = default_storage.save(entry['key'], File(request.stream or io.BytesIO(), name=entry['key']))
+        if name != entry['key']:
+            default_storage.delete(name)
+            return Response({'detail': 'image is already uploaded'}, status=409)
+        return Response(status=204)
@@ -2,6 +2,8 @@
 ASGI config for telescope project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+The plan events of telescopes (a long-lived server-sent events stream) are served
+here directly, everything else goes to Django.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -13,4 +15,13 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'telescope.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from tasks.events import EVENTS_PATH, plan_events  # noqa: E402  (needs the apps loaded)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        await plan_events(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)